@@ -0,0 +1,236 @@
+"""
+asyncio client for the encoder register protocol, so many queries can share one bus from a single event loop
+"""
+
+import asyncio
+import collections
+import contextlib
+
+import can
+
+import get_register
+from get_register import (COM_PORT, Register, State, config_cache, encoder_can_filters, is_register_reply,
+                          send_read_request, apply_settings, set_content_mode, set_return_rate, set_baud_rate,
+                          set_encoder_mode, set_ang_val, set_revolutions, set_spin_dir, set_angular_vel_sample_period, set_device_addr,
+                          decode_apply_settings_register, decode_content_mode, decode_return_rate, decode_baud_rate,
+                          decode_encoder_mode, decode_ang_val, decode_revolutions, decode_angular_vel,
+                          decode_temperature, decode_spin_dir, decode_angular_vel_sample_period, decode_read_register,
+                          decode_device_addr, decode_version_num_l, decode_version_num_h, request_stats)
+
+
+class AsyncRegisterClient:
+    # Awaitable counterpart of the helpers in get_register.py.
+    #
+    # A can.Notifier feeds every frame into a can.AsyncBufferedReader, and a single dispatch task hands register
+    # replies (0x55 0x5F) to the read waiting on that device. Every other frame goes to the subscribers.
+    #
+    # A reply does not say which register it answers, so reads to the same device take turns with one in flight at a
+    # time, otherwise a lost reply would hand every later reply to the wrong read. Reads to different devices run
+    # concurrently, and none of them block the loop.
+    #
+    # Must be created from within a running event loop, preferably through `async with AsyncRegisterClient(bus)`.
+    def __init__(self, bus):
+        self.bus = bus
+        self._loop = asyncio.get_running_loop()
+        self._reader = can.AsyncBufferedReader()
+        # Per device address, (abort_time, future) of the read in flight
+        self._waiting = {}
+        # Per device address, the lock reads take turns on and how many reads are holding or waiting for it
+        self._device_locks = {}
+        self._device_readers = collections.Counter()
+        self._subscribers = []
+        self._notifier = can.Notifier(bus, [self._reader], loop=self._loop)
+        self._dispatch_task = self._loop.create_task(self._dispatch())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        self._notifier.stop()
+        self._dispatch_task.cancel()
+        try:
+            await self._dispatch_task
+        except asyncio.CancelledError:
+            pass
+        for _, future in self._waiting.values():
+            future.cancel()
+        self._waiting.clear()
+
+    # Callback is called from the event loop with every frame which is not a register reply
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    async def _dispatch(self):
+        async for msg in self._reader:
+            if is_register_reply(msg):
+                self._resolve(msg)
+            else:
+                for subscriber in self._subscribers:
+                    subscriber(msg)
+
+    def _resolve(self, msg):
+        waiting = self._waiting.get(msg.arbitration_id)
+        if waiting is not None:
+            abort_time, future = waiting
+            if abort_time >= self._loop.time() and not future.done():
+                future.set_result(msg)
+
+    # Serialises reads to device_addr, dropping its lock once no read needs it so devices which were only read once
+    # (e.g. by a scan) do not accumulate
+    @contextlib.asynccontextmanager
+    async def _device_turn(self, device_addr):
+        lock = self._device_locks.get(device_addr)
+        if lock is None:
+            lock = self._device_locks[device_addr] = asyncio.Lock()
+        self._device_readers[device_addr] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._device_readers[device_addr] -= 1
+            if not self._device_readers[device_addr]:
+                del self._device_readers[device_addr]
+                del self._device_locks[device_addr]
+
+    # Returns the reply message, or None if there was no reply after all retries, like send_read_and_wait.
+    # Each retry re-sends the request and waits backoff times longer than the attempt before. The timeout starts once
+    # the request is sent, not while waiting for an earlier read of the same device.
+    async def read(self, register: Register, timeout=1, retries=0, device_addr=None, backoff=2):
+        if device_addr is None:
+            device_addr = get_register.DEVICE_ADDR
+        async with self._device_turn(device_addr):
+            attempt_timeout = timeout
+            for attempt in range(retries + 1):
+                if attempt > 0:
+                    request_stats.count(device_addr, 'retries')
+                future = self._loop.create_future()
+                self._waiting[device_addr] = (self._loop.time() + attempt_timeout, future)
+                send_read_request(self.bus, register, device_addr)
+                try:
+                    return await asyncio.wait_for(future, attempt_timeout)
+                except asyncio.TimeoutError:
+                    attempt_timeout *= backoff
+                finally:
+                    del self._waiting[device_addr]
+        request_stats.count(device_addr, 'reply_timeouts')
+        return None
+
+    # Reads all registers, returning the reply (or None) for each register. They go to the same device, so they are
+    # sent one at a time
+    async def read_all(self, registers, timeout=1, device_addr=None):
+        registers = list(registers)
+        replies = await asyncio.gather(*(self.read(register, timeout, device_addr=device_addr)
+                                         for register in registers))
+        return dict(zip(registers, replies))
+
+    async def get_apply_settings_register(self, device_addr=None):
+        return decode_apply_settings_register(await self.read(Register.APPLY_SETTINGS, device_addr=device_addr))
+
+    async def apply_settings(self, mode, unlock=True, device_addr=None):
+        apply_settings(self.bus, mode, unlock, device_addr)
+
+    async def get_content_mode(self, device_addr=None):
+        return decode_content_mode(await self.read(Register.CONTENT_MODE, device_addr=device_addr))
+
+    async def set_content_mode(self, content_mode, unlock=True, device_addr=None):
+        set_content_mode(self.bus, content_mode, unlock, device_addr)
+
+    async def get_return_rate(self, device_addr=None):
+        return decode_return_rate(await self.read(Register.RETURN_RATE, device_addr=device_addr))
+
+    async def set_return_rate(self, return_rate, unlock=True, device_addr=None):
+        set_return_rate(self.bus, return_rate, unlock, device_addr)
+
+    async def get_baud_rate(self, device_addr=None):
+        return decode_baud_rate(await self.read(Register.BAUD_RATE, device_addr=device_addr))
+
+    async def set_baud_rate(self, baud_rate, unlock=True, device_addr=None):
+        set_baud_rate(self.bus, baud_rate, unlock, device_addr)
+
+    async def get_encoder_mode(self, device_addr=None):
+        return decode_encoder_mode(await self.read(Register.ENCODER_MODE, device_addr=device_addr))
+
+    async def set_encoder_mode(self, mode, unlock=True, device_addr=None):
+        set_encoder_mode(self.bus, mode, unlock, device_addr)
+
+    async def get_ang_val(self, device_addr=None):
+        return decode_ang_val(await self.read(Register.ANG_VAL, device_addr=device_addr))
+
+    async def set_ang_val(self, angle_register_value, unlock=True, device_addr=None):
+        set_ang_val(self.bus, angle_register_value, unlock, device_addr)
+
+    async def get_revolutions(self, device_addr=None):
+        return decode_revolutions(await self.read(Register.REVOLUTIONS, device_addr=device_addr))
+
+    async def set_revolutions(self, revolutions, unlock=True, device_addr=None):
+        set_revolutions(self.bus, revolutions, unlock, device_addr)
+
+    async def get_angular_vel(self, device_addr=None):
+        return decode_angular_vel(await self.read(Register.ANGULAR_VEL, device_addr=device_addr))
+
+    async def get_temperature(self, device_addr=None):
+        return decode_temperature(await self.read(Register.TEMPERATURE, device_addr=device_addr))
+
+    async def get_spin_dir(self, device_addr=None):
+        return decode_spin_dir(await self.read(Register.SPIN_DIR, device_addr=device_addr))
+
+    async def set_spin_dir(self, direction, unlock=True, device_addr=None):
+        set_spin_dir(self.bus, direction, unlock, device_addr)
+
+    async def get_angular_vel_sample_period(self, device_addr=None):
+        return decode_angular_vel_sample_period(
+            await self.read(Register.ANGULAR_VEL_SAMPLE_PERIOD, device_addr=device_addr))
+
+    async def set_angular_vel_sample_period(self, sample_period, unlock=True, device_addr=None):
+        set_angular_vel_sample_period(self.bus, sample_period, unlock, device_addr)
+
+    async def get_read_register(self, device_addr=None):
+        return decode_read_register(await self.read(Register.READ_REGISTER, device_addr=device_addr))
+
+    async def get_device_addr(self, device_addr=None):
+        return decode_device_addr(await self.read(Register.DEVICE_ADDR, device_addr=device_addr))
+
+    async def set_device_addr(self, address, unlock=True, device_addr=None):
+        set_device_addr(self.bus, address, unlock, device_addr)
+
+    async def get_version_num_l(self, device_addr=None):
+        return decode_version_num_l(await self.read(Register.VERSION_NUM_L, device_addr=device_addr))
+
+    async def get_version_num_h(self, device_addr=None):
+        return decode_version_num_h(await self.read(Register.VERSION_NUM_H, device_addr=device_addr))
+
+    # Async version of State.get_all, the registers are read one at a time without blocking the loop
+    # Like State.get_all, configuration registers come from config_cache once they have been read unless refresh is set
+    async def get_state(self, timeout=1, device_addr=None, refresh=False):
+        if device_addr is None:
+            device_addr = get_register.DEVICE_ADDR
+        if refresh:
+            config_cache.invalidate(device_addr)
+        generation = config_cache.generation(device_addr)
+        cached = config_cache.lookup(device_addr, State.attributes)
+        replies = await self.read_all([register for register in State.attributes if register not in cached], timeout,
+                                      device_addr)
+        config_cache.store(device_addr, replies, generation)
+        replies.update(cached)
+
+        state = State()
+        state.decode_all(replies)
+        return state
+
+
+async def print_all_info_async():
+    with can.Bus(interface='slcan', channel=COM_PORT, bitrate=250000,
+                 can_filters=encoder_can_filters([get_register.DEVICE_ADDR])) as bus:
+        async with AsyncRegisterClient(bus) as client:
+            state = await client.get_state()
+            state.print_all()
+
+
+if __name__ == "__main__":
+    asyncio.run(print_all_info_async())
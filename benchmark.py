@@ -0,0 +1,128 @@
+"""
+Latency and throughput benchmarks for the register and telemetry paths, run against simulated encoders so no hardware
+is needed. Results are written as JSON so runs can be compared.
+
+Usage: python benchmark.py [output path, defaults to benchmark_results.json]
+"""
+
+import json
+import platform
+import statistics
+import sys
+import time
+
+import can
+
+import dump_info
+from encoder_fleet import discover_encoders
+from encoder_sim import simulate_fleet, synthesize_telemetry
+from get_register import Register, State, send_read_and_wait, set_return_rate
+from telemetry import decode_telemetry, pack_payloads
+
+CHANNEL = 'benchmark'
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return {
+        'p50': statistics.median(samples),
+        'p99': samples[min(len(samples) - 1, round(0.99 * (len(samples) - 1)))],
+        'min': samples[0],
+        'max': samples[-1],
+        'count': len(samples),
+    }
+
+
+# Round trip time of send_read_and_wait for every register, in seconds
+def benchmark_register_reads(bus, device_addr, iterations=50):
+    results = {}
+    for register in Register:
+        round_trips = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            msg = send_read_and_wait(bus, register, device_addr=device_addr)
+            if msg is not None:
+                round_trips.append(time.perf_counter() - start)
+        results[register.name] = _percentiles(round_trips) if round_trips else None
+    return results
+
+
+# Wall time of State.get_all reading every register over the bus, in seconds
+def benchmark_get_all(bus, device_addr, iterations=20):
+    wall_times = []
+    timeouts = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        timeouts += len(State().get_all(bus, device_addr=device_addr, refresh=True))
+        wall_times.append(time.perf_counter() - start)
+    return dict(_percentiles(wall_times), timed_out_registers=timeouts)
+
+
+# Time to sweep the whole 11-bit ID space with discover_encoders, in seconds
+def benchmark_discovery(bus, device_addrs):
+    start = time.perf_counter()
+    found = discover_encoders(bus, can_ids=range(0x800))
+    return {'seconds': time.perf_counter() - start, 'expected': len(device_addrs),
+            'found': len(found & set(device_addrs))}
+
+
+def _decode_per_frame(msgs):
+    # The loop body of dump_info.dump_just_angle/dump_just_temp, minus the printing
+    for msg in msgs:
+        if len(msg.data) == 8 and msg.data[0] == 0x55:
+            if msg.data[1] == 0x55:
+                dump_info.decode_angle(msg.data)
+            elif msg.data[1] == 0x56:
+                dump_info.decode_temp(msg.data)
+
+
+def _decode_vectorized(msgs):
+    decode_telemetry(pack_payloads(msgs))
+
+
+# Frames/s each decode path sustains on the traffic encoder_count encoders streaming both angle and temperature at
+# return_rate would produce, alongside the rate it would need to keep up
+def benchmark_telemetry_decode(encoder_count, return_rate, duration=1.0):
+    msgs = synthesize_telemetry(range(0x50, 0x50 + encoder_count), return_rate, duration)
+    results = {'encoders': encoder_count, 'return_rate': return_rate,
+               'required_frames_per_second': len(msgs) / duration}
+    for name, decode in (('per_frame', _decode_per_frame), ('vectorized', _decode_vectorized)):
+        start = time.perf_counter()
+        decode(msgs)
+        results[f'{name}_frames_per_second'] = len(msgs) / (time.perf_counter() - start)
+    return results
+
+
+def run_benchmarks(output_path='benchmark_results.json', reply_latency=0.0, device_addrs=(0x50, 0x51, 0x52)):
+    results = {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'python_can': can.__version__,
+        'reply_latency': reply_latency,
+    }
+
+    encoders = simulate_fleet(device_addrs, CHANNEL, reply_latency=reply_latency)
+    try:
+        with can.Bus(interface='virtual', channel=CHANNEL) as bus:
+            # Keep the telemetry the encoders stream out of the way of the register replies
+            for device_addr in device_addrs:
+                set_return_rate(bus, 'single_return', device_addr=device_addr)
+            results['register_round_trip'] = benchmark_register_reads(bus, device_addrs[0])
+            results['get_all'] = benchmark_get_all(bus, device_addrs[0])
+            results['discovery'] = benchmark_discovery(bus, device_addrs)
+    finally:
+        for encoder in encoders:
+            encoder.stop()
+
+    results['telemetry_decode'] = [benchmark_telemetry_decode(encoder_count, return_rate)
+                                   for return_rate in (1000, 2000) for encoder_count in (1, 2, 4, 8, 16)]
+
+    with open(output_path, 'w') as output:
+        json.dump(results, output, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else 'benchmark_results.json'
+    run_benchmarks(path)
+    print(f"results written to {path}")
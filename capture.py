@@ -0,0 +1,139 @@
+"""
+Compact binary captures of CAN traffic, for recording high-rate encoder sessions and analysing them offline
+"""
+
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+import can
+
+from telemetry import TELEMETRY_FRAME
+
+# Files start with this magic, followed by the format version and the size of each record
+CAPTURE_MAGIC = b'UMRT-CAP'
+CAPTURE_VERSION = 2
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('record_size', '<u4')])
+
+# Bits of CAPTURE_RECORD's flags
+FLAG_EXTENDED_ID = 0x01
+FLAG_REMOTE_FRAME = 0x02
+FLAG_ERROR_FRAME = 0x04
+
+# One received frame. Payloads shorter than 8 bytes are zero-padded, dlc says how many of the bytes were received, so
+# capture['dlc'] == 8 selects the frames decode_telemetry can be trusted with.
+CAPTURE_RECORD = np.dtype([
+    ('timestamp', '<f8'),  # can.Message.timestamp, seconds
+    ('can_id', '<u4'),
+    ('dlc', 'u1'),
+    ('flags', 'u1'),
+    ('payload', TELEMETRY_FRAME),
+])
+_RECORD_STRUCT = struct.Struct('<dIBB8s')
+
+
+class CaptureWriter(can.Listener):
+    # Appends received frames to a capture file.
+    # Frames are packed into a preallocated buffer and written batch_size at a time, so there is one write per batch
+    # rather than one per frame. Can be used directly as a can.Notifier listener, or as a BusDispatcher subscriber
+    # through its on_message_received method.
+    def __init__(self, path, batch_size=4096):
+        self._file = open(path, 'wb')
+        header = np.zeros(1, dtype=HEADER)
+        header['magic'] = CAPTURE_MAGIC
+        header['version'] = CAPTURE_VERSION
+        header['record_size'] = CAPTURE_RECORD.itemsize
+        self._file.write(header.tobytes())
+
+        self._batch = bytearray(batch_size * _RECORD_STRUCT.size)
+        self._batch_size = batch_size
+        self._count = 0
+        self.frames_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def on_message_received(self, msg):
+        flags = ((FLAG_EXTENDED_ID if msg.is_extended_id else 0) | (FLAG_REMOTE_FRAME if msg.is_remote_frame else 0)
+                 | (FLAG_ERROR_FRAME if msg.is_error_frame else 0))
+        _RECORD_STRUCT.pack_into(self._batch, self._count * _RECORD_STRUCT.size,
+                                 msg.timestamp, msg.arbitration_id, min(len(msg.data), 8), flags, bytes(msg.data))
+        self._count += 1
+        if self._count == self._batch_size:
+            self.flush()
+
+    def flush(self):
+        self._file.write(memoryview(self._batch)[:self._count * _RECORD_STRUCT.size])
+        self.frames_written += self._count
+        self._count = 0
+
+    def stop(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+# Memory-maps a capture file as a read-only CAPTURE_RECORD array, nothing is read until it is accessed.
+# capture['payload'] can be passed straight to telemetry.decode_telemetry.
+# A capture cut off mid-write (e.g. the recording process was killed) ends in part of a record, which is left out.
+def open_capture(path):
+    header = np.fromfile(path, dtype=HEADER, count=1)
+    if len(header) != 1 or header['magic'][0] != CAPTURE_MAGIC:
+        raise ValueError(f'{path} is not a capture file')
+    if header['version'][0] != CAPTURE_VERSION or header['record_size'][0] != CAPTURE_RECORD.itemsize:
+        raise ValueError(f'{path} uses unsupported capture format version {header["version"][0]}')
+    records = (os.path.getsize(path) - HEADER.itemsize) // CAPTURE_RECORD.itemsize
+    if records == 0:
+        # mmap cannot map zero bytes
+        return np.zeros(0, dtype=CAPTURE_RECORD)
+    return np.memmap(path, dtype=CAPTURE_RECORD, mode='r', offset=HEADER.itemsize, shape=(records,))
+
+
+# Calls sink(msg) with a can.Message for every frame in a capture (from open_capture), paced so frames come out at
+# speed times the rate they were recorded at, e.g. speed=1 for real time or speed=10 for 10x.
+# speed=None replays as fast as possible, for benchmarking whatever sink is.
+def replay(capture, sink, speed=1.0, chunk_size=4096):
+    raw = capture.view(np.uint8).reshape(len(capture), CAPTURE_RECORD.itemsize)
+    payload_offset = CAPTURE_RECORD.fields['payload'][1]
+    start_time = time.monotonic()
+    first_timestamp = float(capture['timestamp'][0]) if len(capture) > 0 else 0.0
+
+    # Converting a chunk at a time avoids going through NumPy scalars for every frame
+    for chunk_start in range(0, len(capture), chunk_size):
+        chunk = slice(chunk_start, chunk_start + chunk_size)
+        timestamps = capture['timestamp'][chunk].tolist()
+        can_ids = capture['can_id'][chunk].tolist()
+        dlcs = capture['dlc'][chunk].tolist()
+        flags = capture['flags'][chunk].tolist()
+        payloads = raw[chunk, payload_offset:payload_offset + 8].tobytes()
+
+        for i, (timestamp, can_id, dlc, frame_flags) in enumerate(zip(timestamps, can_ids, dlcs, flags)):
+            if speed is not None:
+                delay = start_time + (timestamp - first_timestamp) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            sink(can.Message(timestamp=timestamp, arbitration_id=can_id,
+                             is_extended_id=bool(frame_flags & FLAG_EXTENDED_ID),
+                             is_remote_frame=bool(frame_flags & FLAG_REMOTE_FRAME),
+                             is_error_frame=bool(frame_flags & FLAG_ERROR_FRAME), dlc=dlc,
+                             data=payloads[8 * i:8 * i + dlc]))
+
+
+# Replays a capture onto python-can's in-process virtual bus from a background thread, so anything which opens
+# can.Bus(interface='virtual', channel=channel) receives the recorded frames, e.g. dump_info.dump_just_angle.
+# The virtual bus only delivers to buses which are already open, hence the start_delay before replaying.
+def replay_on_virtual_bus(capture, channel='replay', speed=1.0, start_delay=0.5):
+    def run():
+        with can.Bus(interface='virtual', channel=channel) as bus:
+            time.sleep(start_delay)
+            replay(capture, bus.send, speed)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
@@ -1,26 +1,139 @@
 """
 Shows how to receive messages via polling.
+
+Every function reads from the slcan adapter on /dev/ttyACM2 by default; pass interface='virtual' and a channel to
+read a capture replayed by capture.replay_on_virtual_bus instead. Passing can_ids only lets frames from those encoders
+through, which on SocketCAN is done by the kernel.
 """
 
+import time
+
 import can
 from can.bus import BusState
 
+from capture import CaptureWriter
+from get_register import encoder_can_filters
+
+
+def decode_angle(data, angular_velocity_sample_time=0.1):
+    """Decodes a 0x55 0x55 frame into (angle register, angle [°], angular velocity register, angular velocity [°/s],
+    number of rotations)."""
+
+    # From translated manual:
+    # Take the encoder reply "55 55 aa bb cc dd ee ff" data as an example to calculate
+    # Angle calculation method: Angle register value = (0xbb << 8) | 0xaa
+    #                           Angle (°) = Angle register value * 360 / 32768
+    angle_register = int.from_bytes([data[2], data[3]], byteorder='little', signed=False)
+    angle = angle_register * 360 / 32768
+
+    # From translated manual:
+    # Angular velocity (°/s) = angular velocity register value * 360 / 32768
+    #                          / angular velocity sampling time (s)
+    # Note: The above angular velocity sampling time is calculated in seconds, the default is 0.1s
+    #
+    # The manual does not state how to calculate the angular velocity register value, but since
+    # the angle register uses 'aa bb', and the number of revolutions uses 'ee ff', the angular
+    # velocity presumably comes from 'cc dd'
+    angular_velocity_register = int.from_bytes([data[4], data[5]], byteorder='little', signed=True)
+    angular_velocity = angular_velocity_register * 360 / 32768 / angular_velocity_sample_time
+
+    # From translated manual:
+    # Number of revolutions = (0xff << 8) | 0xee
+    number_of_rotations = int.from_bytes([data[6], data[7]], byteorder='little', signed=True)
+
+    return angle_register, angle, angular_velocity_register, angular_velocity, number_of_rotations
+
+
+def decode_temp(data):
+    """Decodes a 0x55 0x56 frame into the temperature [°C]."""
+
+    # From translated manual:
+    # Take the encoder reply "55 56 aa bb 00 00 00 00" data as an example to calculate
+    # Calculation method: Temperature (°C) = (0xbb << 8) | 0xaa / 100
+    temperature_register = int.from_bytes([data[2], data[3]], byteorder='little', signed=True)
+    return temperature_register / 100
+
+
+# Timing probes, see enable_probes. Each probe's stats are [calls, total ns, max ns].
+_probes_enabled = False
+_probe_stats = {}
+# Module functions enable_probes replaced, by name
+_unprobed = {}
+
+
+def _timed(name, function):
+    stats = _probe_stats.setdefault(name, [0, 0, 0])
+
+    def timed(*args, **kwargs):
+        start = time.perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
+
+    return timed
+
+
+def probe(name, function):
+    """Returns function timed as probe name while probes are enabled, otherwise function itself, so a disabled probe
+    costs nothing per call."""
+    return _timed(name, function) if _probes_enabled else function
+
 
-def dump_all():
+def enable_probes():
+    """Times every call to decode_angle and decode_temp (including calls from other modules through dump_info), and
+    every bus.recv of the dump_* functions started from now on. See probe_report."""
+    global _probes_enabled
+    _probes_enabled = True
+    for name in ('decode_angle', 'decode_temp'):
+        if name not in _unprobed:
+            _unprobed[name] = globals()[name]
+            globals()[name] = _timed(name, _unprobed[name])
+
+
+def disable_probes():
+    """Puts the unprobed decoders back. dump_* functions which are already running keep timing bus.recv."""
+    global _probes_enabled
+    _probes_enabled = False
+    for name, function in _unprobed.items():
+        globals()[name] = function
+    _unprobed.clear()
+
+
+def reset_probes():
+    """Zeroes every probe."""
+    for stats in _probe_stats.values():
+        stats[:] = [0, 0, 0]
+
+
+def probe_report():
+    """Returns {probe name: {'calls', 'total_ns', 'mean_ns', 'max_ns'}} for every probe which has been enabled.
+    recv includes waiting for a frame to arrive, so on a quiet bus it is mostly idle time."""
+    return {name: {'calls': calls, 'total_ns': total, 'mean_ns': total / calls if calls else 0.0, 'max_ns': maximum}
+            for name, (calls, total, maximum) in _probe_stats.items()}
+
+
+def dump_all(interface='slcan', channel='/dev/ttyACM2', can_ids=None):
     """Receives all messages and prints them to the console until Ctrl+C is pressed."""
 
     # this uses the default configuration (for example from environment variables, or a
     # config file) see https://python-can.readthedocs.io/en/stable/configuration.html
-    with can.Bus(interface='slcan', channel='/dev/ttyACM2', bitrate=250000) as bus:
+    with can.Bus(interface=interface, channel=channel, bitrate=250000,
+                 can_filters=encoder_can_filters(can_ids) if can_ids is not None else None) as bus:
         # set to read-only, only supported on some interfaces
         try:
             bus.state = BusState.PASSIVE
         except NotImplementedError:
             pass
 
+        recv = probe('recv', bus.recv)
         try:
             while True:
-                msg = bus.recv(1)
+                msg = recv(1)
                 if msg is not None and len(msg.data) >= 2:
                     if msg.data[0] == 0x55 and msg.data[1] == 0x55:
                         print(msg)
@@ -29,22 +142,24 @@ def dump_all():
             pass  # exit normally
 
 
-def dump_delta():
+def dump_delta(interface='slcan', channel='/dev/ttyACM2', can_ids=None):
     """Receives all messages and prints the difference from the last to the console until Ctrl+C is pressed."""
 
     # this uses the default configuration (for example from environment variables, or a
     # config file) see https://python-can.readthedocs.io/en/stable/configuration.html
-    with can.Bus(interface='slcan', channel='/dev/ttyACM2', bitrate=250000) as bus:
+    with can.Bus(interface=interface, channel=channel, bitrate=250000,
+                 can_filters=encoder_can_filters(can_ids) if can_ids is not None else None) as bus:
         # set to read-only, only supported on some interfaces
         try:
             bus.state = BusState.PASSIVE
         except NotImplementedError:
             pass
 
+        recv = probe('recv', bus.recv)
         try:
             last_msg = bytearray([0x55, 0x55, 0x3c, 0x00, 0x00, 0x00, 0xf2, 0xff])
             while True:
-                msg = bus.recv(1)
+                msg = recv(1)
                 if msg is not None and len(msg.data) == 8:
                     if msg.data[0] == 0x55 and msg.data[1] == 0x55:
                         output_msg = []
@@ -57,47 +172,28 @@ def dump_delta():
             pass  # exit normally
 
 
-def dump_just_angle():
+def dump_just_angle(interface='slcan', channel='/dev/ttyACM2', can_ids=None):
     """Receives all messages and prints the angle portion of each message to the console until Ctrl+C is pressed."""
 
     # this uses the default configuration (for example from environment variables, or a
     # config file) see https://python-can.readthedocs.io/en/stable/configuration.html
-    with can.Bus(interface='slcan', channel='/dev/ttyACM2', bitrate=250000) as bus:
+    with can.Bus(interface=interface, channel=channel, bitrate=250000,
+                 can_filters=encoder_can_filters(can_ids) if can_ids is not None else None) as bus:
         # set to read-only, only supported on some interfaces
         try:
             bus.state = BusState.PASSIVE
         except NotImplementedError:
             pass
 
+        recv = probe('recv', bus.recv)
         try:
             last_msg = bytearray([0x55, 0x55, 0x3c, 0x00, 0x00, 0x00, 0xf2, 0xff])
             while True:
-                msg = bus.recv(1)
+                msg = recv(1)
                 if msg is not None and len(msg.data) == 8:
                     if msg.data[0] == 0x55 and msg.data[1] == 0x55:
-                        # From translated manual:
-                        # Take the encoder reply "55 55 aa bb cc dd ee ff" data as an example to calculate
-                        # Angle calculation method: Angle register value = (0xbb << 8) | 0xaa
-                        #                           Angle (°) = Angle register value * 360 / 32768
-                        angle_register = int.from_bytes([msg.data[2], msg.data[3]], byteorder='little', signed=False)
-                        angle = angle_register * 360 / 32768
-
-                        # From translated manual:
-                        # Angular velocity (°/s) = angular velocity register value * 360 / 32768
-                        #                          / angular velocity sampling time (s)
-                        # Note: The above angular velocity sampling time is calculated in seconds, the default is 0.1s
-                        #
-                        # The manual does not state how to calculate the angular velocity register value, but since
-                        # the angle register uses 'aa bb', and the number of revolutions uses 'ee ff', the angular
-                        # velocity presumably comes from 'cc dd'
-                        angular_velocity_register = int.from_bytes([msg.data[4], msg.data[5]], byteorder='little',
-                                                                   signed=True)
-                        angular_velocity = angular_velocity_register * 360 / 32768 / 0.1
-
-                        # From translated manual:
-                        # Number of revolutions = (0xff << 8) | 0xee
-                        number_of_rotations = int.from_bytes([msg.data[6], msg.data[7]], byteorder='little',
-                                                             signed=True)
+                        angle_register, angle, angular_velocity_register, angular_velocity, number_of_rotations = \
+                            decode_angle(msg.data)
 
                         print(f"{angle_register:<5} = {angle:<15}°\t\t"
                               f"{angular_velocity_register:<5} = {angular_velocity:.2f} °/s\t\t"
@@ -107,28 +203,26 @@ def dump_just_angle():
             pass  # exit normally
 
 
-def dump_just_temp():
+def dump_just_temp(interface='slcan', channel='/dev/ttyACM2', can_ids=None):
     """Receives all messages and prints the temperature to the console until Ctrl+C is pressed."""
 
     # this uses the default configuration (for example from environment variables, or a
     # config file) see https://python-can.readthedocs.io/en/stable/configuration.html
-    with can.Bus(interface='slcan', channel='/dev/ttyACM2', bitrate=250000) as bus:
+    with can.Bus(interface=interface, channel=channel, bitrate=250000,
+                 can_filters=encoder_can_filters(can_ids) if can_ids is not None else None) as bus:
         # set to read-only, only supported on some interfaces
         try:
             bus.state = BusState.PASSIVE
         except NotImplementedError:
             pass
 
+        recv = probe('recv', bus.recv)
         try:
             while True:
-                msg = bus.recv(1)
+                msg = recv(1)
                 if msg is not None and len(msg.data) == 8:
                     if msg.data[0] == 0x55 and msg.data[1] == 0x56:
-                        # From translated manual:
-                        # Take the encoder reply "55 56 aa bb 00 00 00 00" data as an example to calculate
-                        # Calculation method: Temperature (°C) = (0xbb << 8) | 0xaa / 100
-                        temperature_register = int.from_bytes([msg.data[2], msg.data[3]], byteorder='little', signed=True)
-                        temperature = temperature_register / 100
+                        temperature = decode_temp(msg.data)
 
                         print(f"{temperature} °C")
 
@@ -136,5 +230,32 @@ def dump_just_temp():
             pass  # exit normally
 
 
+def dump_to_file(path, interface='slcan', channel='/dev/ttyACM2', can_ids=None):
+    """Receives all messages and records them to a capture file until Ctrl+C is pressed, see capture.open_capture."""
+
+    # this uses the default configuration (for example from environment variables, or a
+    # config file) see https://python-can.readthedocs.io/en/stable/configuration.html
+    with can.Bus(interface=interface, channel=channel, bitrate=250000,
+                 can_filters=encoder_can_filters(can_ids) if can_ids is not None else None) as bus:
+        # set to read-only, only supported on some interfaces
+        try:
+            bus.state = BusState.PASSIVE
+        except NotImplementedError:
+            pass
+
+        recv = probe('recv', bus.recv)
+        with CaptureWriter(path) as writer:
+            try:
+                while True:
+                    msg = recv(1)
+                    if msg is not None:
+                        writer.on_message_received(msg)
+
+            except KeyboardInterrupt:
+                pass  # exit normally
+
+        print(f"captured {writer.frames_written} frames to {path}")
+
+
 if __name__ == "__main__":
     dump_just_temp()
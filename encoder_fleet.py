@@ -0,0 +1,489 @@
+"""
+Drives several encoders (one per joint of the arm) which share a single CAN bus
+"""
+
+import can
+import collections
+import time
+from typing import NamedTuple
+
+from get_register import (COM_PORT, REGISTER_FORMATS, Register, State, config_cache, configure_encoders,
+                          decode_baud_rate, decode_register, decode_return_rate, encoder_can_filters,
+                          is_register_reply, read_request_message, send_multi_device_cached_read_and_wait,
+                          send_multi_device_read_and_wait, set_content_mode, set_return_rate, to_physical)
+
+# CAN IDs the arm's encoders are given addresses from, which discover_encoders scans by default.
+# Other devices on the arm bus may act on a register read frame sent to their ID, so this should only cover IDs kept
+# for encoders.
+ENCODER_CAN_IDS = range(0x50, 0x60)
+
+
+def discover_encoders(bus, can_ids=None, window=32, timeout=0.05):
+    # Finds every encoder on the bus by asking each CAN ID in can_ids (ENCODER_CAN_IDS by default) for its DEVICE_ADDR
+    # register. Only sweep the whole 11-bit space (range(0x800)) on a bus with nothing but encoders on it.
+    # Requests are pipelined with at most window of them waiting for a reply at once, and an ID which has not answered
+    # within timeout is given up on, so a full sweep takes a couple of seconds instead of one timeout per ID.
+    # The probes are not counted in get_register.request_stats, which would otherwise gain an entry per ID scanned.
+    # Returns the set of CAN IDs which answered, which can be used as-is for EncoderFleet or EncoderInterface.
+    if can_ids is None:
+        can_ids = ENCODER_CAN_IDS
+    found = set()
+    # CAN ID -> abort time, in the order the requests were sent (and so in the order they expire)
+    in_flight = {}
+    to_scan = iter(can_ids)
+    scan_exhausted = False
+    try:
+        while True:
+            now = time.monotonic()
+            while in_flight and next(iter(in_flight.values())) < now:
+                del in_flight[next(iter(in_flight))]
+
+            while not scan_exhausted and len(in_flight) < window:
+                can_id = next(to_scan, None)
+                if can_id is None:
+                    scan_exhausted = True
+                    break
+                try:
+                    bus.send(read_request_message(Register.DEVICE_ADDR, can_id))
+                except can.CanError:
+                    print("Error sending CAN message")
+                in_flight[can_id] = time.monotonic() + timeout
+
+            if not in_flight:
+                break
+
+            msg = bus.recv(max(0.0, next(iter(in_flight.values())) - time.monotonic()))
+            if msg is not None and is_register_reply(msg) and msg.arbitration_id in in_flight:
+                found.add(msg.arbitration_id)
+                del in_flight[msg.arbitration_id]
+    except KeyboardInterrupt:
+        pass
+    return found
+
+
+class EncoderFleet:
+    # Holds the device addresses of every encoder on a bus, and runs register operations against all of them at once.
+    #
+    # Reads are pipelined across every device through send_multi_device_read_and_wait, so reading the whole fleet
+    # takes about as long as reading a single encoder. Writes need no reply, so pushing a setting to the whole fleet is
+    # just its frames sent back to back.
+    #
+    # The bus may be a can.BusABC or a BusDispatcher.
+    def __init__(self, bus, device_addrs):
+        self.bus = bus
+        self.device_addrs = list(device_addrs)
+
+    # Builds a fleet from every encoder which answers a discover_encoders scan
+    @classmethod
+    def discover(cls, bus, **scan_args):
+        return cls(bus, sorted(discover_encoders(bus, **scan_args)))
+
+    # Returns {device_addr: {register: reply or None}}.
+    # With cached=True, configuration registers are answered from config_cache where possible like
+    # send_cached_read_and_wait does.
+    def read_registers(self, registers, timeout=1, cached=False):
+        registers = list(registers)
+        # Interleave the devices so every encoder gets its first request as early as possible
+        requests = [(device_addr, register) for register in registers for device_addr in self.device_addrs]
+        if cached:
+            replies = send_multi_device_cached_read_and_wait(self.bus, requests, timeout)
+        else:
+            replies = send_multi_device_read_and_wait(self.bus, requests, timeout)
+
+        fleet_replies = {device_addr: {} for device_addr in self.device_addrs}
+        for (device_addr, register), msg in replies.items():
+            fleet_replies[device_addr][register] = msg
+        return fleet_replies
+
+    # Returns {device_addr: State} for every encoder, only reading the live registers of encoders whose configuration
+    # is already cached unless refresh is set
+    def get_states(self, timeout=1, refresh=False):
+        if refresh:
+            for device_addr in self.device_addrs:
+                config_cache.invalidate(device_addr)
+        states = {}
+        for device_addr, replies in self.read_registers(State.attributes, timeout, cached=True).items():
+            states[device_addr] = State()
+            states[device_addr].decode_all(replies)
+        return states
+
+    # Applies the same settings to every encoder as one transaction each, see get_register.configure_encoders.
+    # Returns {device_addr: ConfigResult}.
+    def configure(self, settings, timeout=1, restart_timeout=2):
+        return configure_encoders(self.bus, {device_addr: settings for device_addr in self.device_addrs}, timeout,
+                                  restart_timeout)
+
+    # Like configure, but with different settings per encoder given as {device_addr: settings}
+    def configure_each(self, settings, timeout=1, restart_timeout=2):
+        return configure_encoders(self.bus, settings, timeout, restart_timeout)
+
+    # Calls a get_* helper from get_register.py on every encoder, e.g. fleet.get(get_return_rate).
+    # Each call is its own round trip, prefer read_registers for anything performance sensitive.
+    def get(self, getter):
+        return {device_addr: getter(self.bus, device_addr=device_addr) for device_addr in self.device_addrs}
+
+    # Calls a set_* helper (or apply_settings) from get_register.py on every encoder with the same value,
+    # e.g. fleet.push(set_return_rate, 1000)
+    def push(self, setter, value, unlock=True):
+        for device_addr in self.device_addrs:
+            setter(self.bus, value, unlock, device_addr)
+
+    # Like push, but with a different value per encoder given as {device_addr: value}
+    def push_each(self, setter, values, unlock=True):
+        for device_addr, value in values.items():
+            setter(self.bus, value, unlock, device_addr)
+
+
+# Bits one data frame with data_length bytes takes up on the bus, including worst-case bit stuffing and the interframe
+# space after it, so a load computed from it is an upper bound
+def frame_bits(data_length=8, extended_id=False):
+    if extended_id:
+        return 67 + 8 * data_length + (54 + 8 * data_length - 1) // 4
+    return 47 + 8 * data_length + (34 + 8 * data_length - 1) // 4
+
+
+# RETURN_RATE options which stream, in Hz from slowest to fastest
+STREAM_RATES = sorted(rate for rate in REGISTER_FORMATS[Register.RETURN_RATE].values.values()
+                      if not isinstance(rate, str))
+
+
+# STREAM_RATES of at least min_rate Hz, raising ValueError if there are none
+def stream_rates(min_rate=1):
+    rates = [rate for rate in STREAM_RATES if rate >= min_rate]
+    if not rates:
+        raise ValueError(f"no return rate is at least {min_rate} Hz")
+    return rates
+
+
+class JointPlan(NamedTuple):
+    # What one encoder is scheduled to send
+    return_rate: float
+    # As set_content_mode takes it
+    content_mode: str
+    # How often the host should read the TEMPERATURE register of this encoder, 0 if it is streamed or not wanted.
+    # Polling it with e.g. LatestValueCache.get_temperature(bus, device_addr, max_age=1 / temperature_poll_rate) costs
+    # a request and a reply, which at low rates is far cheaper than streaming temperature frames at the angle rate.
+    temperature_poll_rate: float = 0
+
+    # Worst-case bus bits per second this plan uses
+    @property
+    def bits_per_second(self):
+        frames = self.return_rate * (2 if self.content_mode == 'both' else 1)
+        return frames * frame_bits() + self.temperature_poll_rate * (frame_bits(5) + frame_bits())
+
+
+# Plan for an encoder streaming angles at return_rate which should report its temperature every 1 / temperature_rate
+# seconds, or never if temperature_rate is None
+def joint_plan(return_rate, temperature_rate=1):
+    if temperature_rate is None:
+        return JointPlan(return_rate, 'angles')
+    if return_rate <= temperature_rate:
+        # Streaming both costs one extra frame per sample, cheaper than polling at the same rate
+        return JointPlan(return_rate, 'both')
+    return JointPlan(return_rate, 'angles', temperature_poll_rate=temperature_rate)
+
+
+# Fraction of the bus a set of plans ({device_addr: JointPlan}) occupies at bitrate (in bits per second)
+def plan_utilisation(plans, bitrate):
+    return sum(plan.bits_per_second for plan in plans.values()) / bitrate
+
+
+def plan_stream_rates(priorities, bitrate, target=0.7, temperature_rate=1, min_rate=1):
+    # Picks a return rate for every encoder so the fleet fits in target (a fraction) of a bus running at bitrate
+    # (in bits per second). priorities is {device_addr: priority}, higher priorities get the fastest rates that fit
+    # first and encoders of equal priority always get the same rate.
+    # Every encoder streams angles at at least min_rate, and temperature as described in joint_plan.
+    # Returns {device_addr: JointPlan}, raising ValueError if even min_rate for everyone does not fit.
+    rates = stream_rates(min_rate)
+    # The slack allows for rounding when target came from plan_utilisation
+    budget = target * bitrate * (1 + 1e-9)
+    levels = {device_addr: 0 for device_addr in priorities}
+
+    def load():
+        return sum(joint_plan(rates[level], temperature_rate).bits_per_second for level in levels.values())
+
+    if load() > budget:
+        raise ValueError(f"{len(levels)} encoder(s) at {rates[0]} Hz need more than {target:.0%} of "
+                         f"{bitrate / 1000:g} K")
+
+    # Step each priority, highest first, up together as far as it fits, so equal priorities always get equal rates
+    for priority in sorted(set(priorities.values()), reverse=True):
+        group = [device_addr for device_addr in levels if priorities[device_addr] == priority]
+        while levels[group[0]] + 1 < len(rates):
+            for device_addr in group:
+                levels[device_addr] += 1
+            if load() > budget:
+                for device_addr in group:
+                    levels[device_addr] -= 1
+                break
+    return {device_addr: joint_plan(rates[level], temperature_rate) for device_addr, level in levels.items()}
+
+
+class BusLoadMonitor(can.Listener):
+    # Measures bus utilisation from the frames a bus receives, when added to a can.Notifier.
+    # It can only count what reaches it, so the bus it listens on should have no can_filters, and frames sent from
+    # this host are not included unless the interface echoes them back.
+    def __init__(self, bitrate):
+        self.bitrate = bitrate
+        # Only the notifier thread adds to this, utilisation only reads it
+        self._bits = 0
+        self._last_bits = 0
+        self._last_time = time.monotonic()
+
+    def on_message_received(self, msg):
+        self._bits += frame_bits(len(msg.data), msg.is_extended_id)
+
+    # Fraction of the bus used since the previous call (or since the monitor was created)
+    def utilisation(self):
+        now = time.monotonic()
+        bits = self._bits
+        elapsed = now - self._last_time
+        used = (bits - self._last_bits) / (elapsed * self.bitrate) if elapsed > 0 else 0.0
+        self._last_bits, self._last_time = bits, now
+        return used
+
+
+class BusScheduler:
+    # Keeps a fleet's streaming under target utilisation of its bus.
+    #
+    # apply() plans rates with plan_stream_rates and pushes them to the encoders with set_content_mode and
+    # set_return_rate. The settings are not saved, so the encoders go back to their saved rates when they restart.
+    # adjust() should then be called every few seconds with monitor added to a can.Notifier on the bus: it takes
+    # whatever traffic the plan does not account for out of the budget and re-plans when that changes by more than
+    # hysteresis, so the total stays under target.
+    def __init__(self, fleet, priorities, bitrate=None, target=0.7, temperature_rate=1, min_rate=1, hysteresis=0.05):
+        self.fleet = fleet
+        self.priorities = priorities
+        self.bitrate = self.read_bitrate() if bitrate is None else bitrate
+        self.target = target
+        self.temperature_rate = temperature_rate
+        self.min_rate = min_rate
+        self.hysteresis = hysteresis
+        self.monitor = BusLoadMonitor(self.bitrate)
+        # Utilisation the current plan was made to fit in
+        self.budget = target
+        # {device_addr: JointPlan} as last pushed, None before apply
+        self.plans = None
+
+    # Bitrate in bits per second from the encoders' BAUD_RATE, which must all agree to share a bus
+    def read_bitrate(self):
+        replies = self.fleet.read_registers([Register.BAUD_RATE], cached=True)
+        bauds = {decode_baud_rate(registers[Register.BAUD_RATE]) for registers in replies.values()}
+        if len(bauds) != 1 or None in bauds:
+            raise ValueError(f"could not read one bitrate from the fleet, got {bauds} K")
+        return bauds.pop() * 1000
+
+    # Plans for the current budget and pushes whatever changed since the last plan. Returns the plan.
+    def apply(self):
+        plans = plan_stream_rates(self.priorities, self.bitrate, self.budget, self.temperature_rate, self.min_rate)
+        previous = self.plans or {}
+        content_modes = {device_addr: plan.content_mode for device_addr, plan in plans.items()
+                         if device_addr not in previous or previous[device_addr].content_mode != plan.content_mode}
+        return_rates = {device_addr: plan.return_rate for device_addr, plan in plans.items()
+                        if device_addr not in previous or previous[device_addr].return_rate != plan.return_rate}
+        self.fleet.push_each(set_content_mode, content_modes)
+        self.fleet.push_each(set_return_rate, return_rates)
+        self.plans = plans
+        return plans
+
+    # Utilisation the current plan occupies at worst
+    def planned_utilisation(self):
+        return plan_utilisation(self.plans or {}, self.bitrate)
+
+    # Re-plans if the measured traffic outside the plan has changed the budget. Returns the measured utilisation.
+    def adjust(self):
+        measured = self.monitor.utilisation()
+        if self.plans is None:
+            return measured
+        unplanned = max(0.0, measured - self.planned_utilisation())
+        slowest = joint_plan(stream_rates(self.min_rate)[0], self.temperature_rate)
+        minimum = plan_utilisation({device_addr: slowest for device_addr in self.priorities}, self.bitrate)
+        # Never plan below what min_rate needs, the budget is as tight as it can be at that point
+        budget = max(minimum, self.target - unplanned)
+        if abs(budget - self.budget) > self.hysteresis:
+            self.budget = budget
+            self.apply()
+        return measured
+
+
+class JointSample(NamedTuple):
+    # One encoder's reply to a single-return trigger
+    # Degrees within the current revolution
+    angle: float
+    revolutions: int
+    # Degrees per second
+    angular_vel: float
+    # msg.timestamp of the reply
+    timestamp: float
+
+    # Degrees including whole revolutions
+    @property
+    def position(self):
+        return self.revolutions * 360 + self.angle
+
+
+class PoseSnapshot(NamedTuple):
+    # Every joint's sample from one trigger burst
+    # time.time() just before the burst was sent, the clock most interfaces stamp msg.timestamp with
+    trigger_time: float
+    # {device_addr: JointSample}, None for encoders which did not reply in time
+    joints: dict
+
+    @property
+    def complete(self):
+        return all(sample is not None for sample in self.joints.values())
+
+    # Seconds between the first and last reply, 0 with fewer than two replies
+    @property
+    def skew(self):
+        timestamps = [sample.timestamp for sample in self.joints.values() if sample is not None]
+        return max(timestamps) - min(timestamps) if len(timestamps) > 1 else 0.0
+
+
+class SkewStats(NamedTuple):
+    # Snapshots taken so far
+    snapshots: int
+    # Snapshots missing at least one joint, which are left out of the skew figures below
+    incomplete: int
+    # Seconds, over the complete snapshots still in PolledAcquisition's history
+    mean_skew: float
+    p99_skew: float
+    max_skew: float
+
+
+class PolledAcquisition:
+    # Reads the whole fleet as coherent poses instead of mixing free-running streams.
+    #
+    # start() switches every encoder to single return, which stops streaming, and each snapshot() then sends an
+    # ANG_VAL read request to every joint back to back and collects the replies. An ANG_VAL reply carries the angle,
+    # revolutions and angular velocity together, so one burst of n frames gives n complete joint states taken within
+    # a few frame times of each other. stop() puts the return rates back how they were.
+    #
+    # A reply which misses its burst is not taken for the next one: replies received before the trigger are dropped,
+    # and after an incomplete burst the bus is drained for another timeout before snapshot() returns, so a joint which
+    # does not answer costs 2 * timeout. Either way the snapshot counts as incomplete.
+    def __init__(self, fleet, timeout=0.05, history=1000):
+        self.fleet = fleet
+        self.timeout = timeout
+        # Skews of the most recent complete snapshots
+        self._skews = collections.deque(maxlen=history)
+        self._snapshots = 0
+        self._incomplete = 0
+        self._max_skew = 0.0
+        # {device_addr: seconds} from each encoder's ANGULAR_VEL_SAMPLE_PERIOD
+        self._sample_times = {}
+        # {device_addr: return rate} to restore in stop(), None while not started
+        self._previous_rates = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        replies = self.fleet.read_registers([Register.RETURN_RATE, Register.ANGULAR_VEL_SAMPLE_PERIOD], cached=True)
+        self._previous_rates = {}
+        for device_addr, registers in replies.items():
+            sample_period = decode_register(Register.ANGULAR_VEL_SAMPLE_PERIOD,
+                                            registers[Register.ANGULAR_VEL_SAMPLE_PERIOD])
+            if sample_period is None or registers[Register.RETURN_RATE] is None:
+                raise TimeoutError(f"encoder {hex(device_addr)} did not reply")
+            self._sample_times[device_addr] = to_physical(Register.ANGULAR_VEL_SAMPLE_PERIOD, sample_period)
+            self._previous_rates[device_addr] = decode_return_rate(registers[Register.RETURN_RATE])
+        self.fleet.push(set_return_rate, 'single_return')
+
+    def stop(self):
+        if self._previous_rates is not None:
+            self.fleet.push_each(set_return_rate, self._previous_rates)
+            self._previous_rates = None
+
+    # Triggers every joint and waits up to timeout for their replies
+    def snapshot(self):
+        trigger_time = time.time()
+        replies = self.fleet.read_registers([Register.ANG_VAL], self.timeout)
+        joints = {}
+        for device_addr, registers in replies.items():
+            msg = registers[Register.ANG_VAL]
+            if msg is None or msg.timestamp < trigger_time:
+                joints[device_addr] = None
+                continue
+            joints[device_addr] = JointSample(
+                angle=to_physical(Register.ANG_VAL, int.from_bytes(msg.data[2:4], 'little')),
+                revolutions=int.from_bytes(msg.data[4:6], 'little', signed=True),
+                angular_vel=to_physical(Register.ANGULAR_VEL, int.from_bytes(msg.data[6:8], 'little', signed=True))
+                / self._sample_times[device_addr],
+                timestamp=msg.timestamp)
+        pose = PoseSnapshot(trigger_time, joints)
+
+        self._snapshots += 1
+        if pose.complete:
+            self._skews.append(pose.skew)
+            self._max_skew = max(self._max_skew, pose.skew)
+        else:
+            self._incomplete += 1
+        return pose
+
+    # Calls callback with a snapshot rate times a second, until count snapshots have been taken or forever if count
+    # is None. Triggers are scheduled against a fixed start time so the rate does not drift with reply latency; if a
+    # snapshot overruns its period the missed triggers are skipped rather than fired back to back.
+    def run(self, rate, callback, count=None):
+        period = 1 / rate
+        next_time = time.monotonic()
+        taken = 0
+        try:
+            while count is None or taken < count:
+                time.sleep(max(0.0, next_time - time.monotonic()))
+                callback(self.snapshot())
+                taken += 1
+                next_time += period
+                now = time.monotonic()
+                if next_time < now:
+                    next_time += (now - next_time) // period * period + period
+        except KeyboardInterrupt:
+            pass
+
+    def stats(self):
+        skews = sorted(self._skews)
+        if not skews:
+            return SkewStats(self._snapshots, self._incomplete, 0.0, 0.0, self._max_skew)
+        return SkewStats(self._snapshots, self._incomplete, sum(skews) / len(skews),
+                         skews[min(len(skews) - 1, int(len(skews) * 0.99))], self._max_skew)
+
+
+def print_discovered_encoders():
+    with can.Bus(interface='slcan', channel=COM_PORT, bitrate=250000) as bus:
+        start = time.monotonic()
+        found = sorted(discover_encoders(bus))
+        print(f"found {len(found)} encoder(s) in {time.monotonic() - start:.2f} s")
+        # Same format encoder_dump takes its CAN IDs in
+        print(' '.join(hex(can_id) for can_id in found))
+
+
+def print_polled_poses(device_addrs, rate=50, count=500):
+    with can.Bus(interface='slcan', channel=COM_PORT, bitrate=250000,
+                 can_filters=encoder_can_filters(device_addrs)) as bus:
+        with PolledAcquisition(EncoderFleet(bus, device_addrs)) as acquisition:
+            acquisition.run(rate, lambda pose: print(
+                ' '.join(f"{hex(device_addr)}: {sample.position:9.2f}°" if sample is not None
+                         else f"{hex(device_addr)}: {'missing':>10}" for device_addr, sample in pose.joints.items())
+                + f" skew {pose.skew * 1e3:.2f} ms"), count)
+            stats = acquisition.stats()
+            print(f"{stats.snapshots} poses, {stats.incomplete} incomplete, skew mean {stats.mean_skew * 1e3:.2f} ms "
+                  f"p99 {stats.p99_skew * 1e3:.2f} ms max {stats.max_skew * 1e3:.2f} ms")
+
+
+def print_fleet_info(device_addrs):
+    with can.Bus(interface='slcan', channel=COM_PORT, bitrate=250000,
+                 can_filters=encoder_can_filters(device_addrs)) as bus:
+        for device_addr, state in EncoderFleet(bus, device_addrs).get_states().items():
+            print(f"---------- encoder {hex(device_addr)} ----------")
+            state.print_all()
+            print()
+
+
+if __name__ == "__main__":
+    print_discovered_encoders()
+    # print_fleet_info([0x50, 0x51])
+    # print_polled_poses([0x50, 0x51])
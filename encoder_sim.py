@@ -0,0 +1,282 @@
+"""
+Simulated encoder which speaks the same CAN protocol as the real one, for testing and benchmarking the host-side code
+without the arm attached
+"""
+
+import heapq
+import math
+import random
+import threading
+import time
+
+import can
+
+from get_register import REGISTER_FORMATS, Register
+
+# Register values after a factory reset, the live registers (angle, velocity...) come from the motion model instead
+FACTORY_SETTINGS = {
+    Register.APPLY_SETTINGS: 0x00,
+    Register.CONTENT_MODE: 0x03,
+    Register.RETURN_RATE: 0x06,
+    Register.BAUD_RATE: 0x04,
+    Register.ENCODER_MODE: 0x01,
+    Register.SPIN_DIR: 0x00,
+    Register.ANGULAR_VEL_SAMPLE_PERIOD: 1000,
+    Register.READ_REGISTER: 0x00,
+    Register.DEVICE_ADDR: 0x50,
+    Register.VERSION_NUM_L: 0x0001,
+    Register.VERSION_NUM_H: 0x0000,
+}
+
+UNLOCK_COMMAND = (0x69, 0x88, 0xB5)
+_REGISTER_ADDRESSES = {int(register) for register in Register}
+
+
+# Payload of a 0x55 0x55 frame, from the raw register values
+def angle_frame_data(angle, angular_vel, revolutions):
+    angular_vel &= 0xFFFF
+    revolutions &= 0xFFFF
+    return [0x55, 0x55, angle & 0xFF, angle >> 8, angular_vel & 0xFF, angular_vel >> 8, revolutions & 0xFF,
+            revolutions >> 8]
+
+
+# Payload of a 0x55 0x56 frame, from the raw register value
+def temperature_frame_data(temperature):
+    temperature &= 0xFFFF
+    return [0x55, 0x56, temperature & 0xFF, temperature >> 8, 0x00, 0x00, 0x00, 0x00]
+
+
+class SimulatedEncoder:
+    # Emulates one encoder on a python-can bus, by default the in-process virtual bus so the host-side code under test
+    # just needs to open can.Bus(interface='virtual', channel=channel). Pass interface='socketcan' and a vcan channel to
+    # simulate on a Linux virtual CAN interface instead.
+    #
+    # Implements:
+    #   - Register reads, answered with 0x55 0x5F and the requested register followed by the next two
+    #   - Register writes, which are ignored unless the encoder has been unlocked with 0x69 0x88 0xB5
+    #   - APPLY_SETTINGS save, factory reset and restart (which reloads the saved settings and locks the encoder again)
+    #   - Streaming angle and/or temperature frames at RETURN_RATE according to CONTENT_MODE, nothing in single return
+    #
+    # The shaft turns at a constant angular_velocity [°/s] and sits at temperature [°C], both can be changed while
+    # running. Every frame sent is delayed by reply_latency [s] and dropped with probability drop_rate.
+    def __init__(self, device_addr=0x50, channel='encoder_sim', interface='virtual', reply_latency=0.0,
+                 drop_rate=0.0, angular_velocity=0.0, temperature=25.0, seed=None):
+        self.channel = channel
+        self.interface = interface
+        self.reply_latency = reply_latency
+        self.drop_rate = drop_rate
+        self.angular_velocity = angular_velocity
+        self.temperature = temperature
+
+        self.saved_settings = dict(FACTORY_SETTINGS)
+        self.saved_settings[Register.DEVICE_ADDR] = device_addr
+        self.registers = dict(self.saved_settings)
+        self.unlocked = False
+
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+        self._random = random.Random(seed)
+        # Position in angle register counts (32768 per revolution) at _position_time
+        self._position = 0.0
+        self._position_time = time.monotonic()
+        # (send time, sequence number, message) for every frame waiting out reply_latency
+        self._outgoing = []
+        self._sequence = 0
+        self._running = False
+        self._thread = None
+        self._bus = None
+
+    @property
+    def device_addr(self):
+        return self.registers[Register.DEVICE_ADDR]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        # The bus is opened here rather than in the thread, so the encoder is listening as soon as start returns
+        self._bus = can.Bus(interface=self.interface, channel=self.channel, receive_own_messages=False)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._bus is not None:
+            self._bus.shutdown()
+            self._bus = None
+
+    def _run(self):
+        next_stream_time = time.monotonic()
+        while self._running:
+            now = time.monotonic()
+            stream_period = self._stream_period()
+            if stream_period is None:
+                next_stream_time = now
+            elif now >= next_stream_time:
+                self._stream()
+                # Skip ahead rather than bursting if we have fallen more than a period behind
+                next_stream_time = max(next_stream_time + stream_period, now)
+
+            while self._outgoing and self._outgoing[0][0] <= now:
+                self._transmit(heapq.heappop(self._outgoing)[2])
+
+            wake_time = now + 0.01
+            if stream_period is not None:
+                wake_time = min(wake_time, next_stream_time)
+            if self._outgoing:
+                wake_time = min(wake_time, self._outgoing[0][0])
+
+            msg = self._bus.recv(max(0.0, wake_time - time.monotonic()))
+            if msg is not None:
+                self._handle(msg)
+
+    def _handle(self, msg):
+        if msg.arbitration_id != self.device_addr or len(msg.data) != 5 or msg.data[0] != 0xFF or msg.data[1] != 0xAA:
+            return
+
+        command, low, high = msg.data[2], msg.data[3], msg.data[4]
+        if (command, low, high) == UNLOCK_COMMAND:
+            self.unlocked = True
+        elif command == Register.READ_REGISTER:
+            self._reply_to_read(low)
+        elif self.unlocked and command in _REGISTER_ADDRESSES:
+            self._write(Register(command), low | (high << 8))
+
+    def _reply_to_read(self, address):
+        data = [0x55, 0x5F]
+        for offset in range(3):
+            value = self._read(Register(address + offset)) if address + offset in _REGISTER_ADDRESSES else 0
+            data += [value & 0xFF, (value >> 8) & 0xFF]
+        self._queue(data)
+
+    def _read(self, register):
+        match register:
+            case Register.ANG_VAL:
+                return int(self._current_position()) % 32768
+            case Register.REVOLUTIONS:
+                return self._revolutions() & 0xFFFF
+            case Register.ANGULAR_VEL:
+                return self._angular_vel_register() & 0xFFFF
+            case Register.TEMPERATURE:
+                return round(self.temperature * 100) & 0xFFFF
+        return self.registers.get(register, 0)
+
+    def _write(self, register, value):
+        match register:
+            case Register.APPLY_SETTINGS:
+                match value & 0xFF:
+                    case 0x00:
+                        self.saved_settings = dict(self.registers)
+                    case 0x01:
+                        self.registers = dict(FACTORY_SETTINGS)
+                        self.saved_settings = dict(FACTORY_SETTINGS)
+                    case 0xFF:
+                        self.registers = dict(self.saved_settings)
+                        self.unlocked = False
+            case Register.ANG_VAL:
+                self._set_position(self._revolutions() * 32768 + (value & 0x7FFF))
+            case Register.REVOLUTIONS:
+                revolutions = value - 0x10000 if value & 0x8000 else value
+                self._set_position(revolutions * 32768 + int(self._current_position()) % 32768)
+            case Register.ANGULAR_VEL | Register.TEMPERATURE | Register.VERSION_NUM_L | Register.VERSION_NUM_H:
+                pass  # Read-only
+            case _:
+                self.registers[register] = value
+
+    def _stream_period(self):
+        return_rate = REGISTER_FORMATS[Register.RETURN_RATE].values.get(self.registers[Register.RETURN_RATE])
+        if not isinstance(return_rate, (int, float)):
+            return None
+        return 1 / return_rate
+
+    def _stream(self):
+        content_mode = self.registers[Register.CONTENT_MODE]
+        if content_mode & 0x01:
+            self._queue(angle_frame_data(int(self._current_position()) % 32768, self._angular_vel_register(),
+                                         self._revolutions()))
+        if content_mode & 0x02:
+            self._queue(temperature_frame_data(round(self.temperature * 100)))
+
+    def _queue(self, data):
+        msg = can.Message(arbitration_id=self.device_addr, data=data, is_extended_id=False)
+        if self.reply_latency <= 0:
+            self._transmit(msg)
+        else:
+            self._sequence += 1
+            heapq.heappush(self._outgoing, (time.monotonic() + self.reply_latency, self._sequence, msg))
+
+    def _transmit(self, msg):
+        if self.drop_rate > 0 and self._random.random() < self.drop_rate:
+            self.frames_dropped += 1
+            return
+        try:
+            self._bus.send(msg)
+            self.frames_sent += 1
+        except can.CanError:
+            self.frames_dropped += 1
+
+    # Position model, in angle register counts
+
+    def _direction(self):
+        return -1 if self.registers[Register.SPIN_DIR] == 0x01 else 1
+
+    def _current_position(self):
+        now = time.monotonic()
+        self._position += self._direction() * self.angular_velocity * 32768 / 360 * (now - self._position_time)
+        self._position_time = now
+        return self._position
+
+    def _set_position(self, position):
+        self._current_position()
+        self._position = float(position)
+
+    def _revolutions(self):
+        if self.registers[Register.ENCODER_MODE] == 0x00:
+            return 0
+        # Wraps like the signed 16-bit register would
+        return (math.floor(self._current_position() / 32768) + 0x8000) % 0x10000 - 0x8000
+
+    def _angular_vel_register(self):
+        # The encoder reports the change in angle over the sample period, overflowing if the period is too long
+        sample_time = self.registers[Register.ANGULAR_VEL_SAMPLE_PERIOD] * REGISTER_FORMATS[
+            Register.ANGULAR_VEL_SAMPLE_PERIOD].scale
+        change = round(self._direction() * self.angular_velocity * 32768 / 360 * sample_time)
+        return (change + 0x8000) % 0x10000 - 0x8000
+
+
+# Starts one simulated encoder per address on the same channel
+def simulate_fleet(device_addrs, channel='encoder_sim', **encoder_args):
+    encoders = [SimulatedEncoder(device_addr, channel, **encoder_args) for device_addr in device_addrs]
+    for encoder in encoders:
+        encoder.start()
+    return encoders
+
+
+# Builds the frames the encoders in device_addrs would stream over duration [s] at return_rate [Hz], in the order they
+# would arrive, without waiting for any of it to happen in real time. Each shaft turns at angular_velocity [°/s].
+# For feeding decoders a known load as fast as they can take it, e.g. in benchmark.py.
+def synthesize_telemetry(device_addrs, return_rate, duration, content_mode=0x03, angular_velocity=90.0,
+                         temperature=25.0, sample_time=0.1):
+    counts_per_second = angular_velocity * 32768 / 360
+    angular_vel = round(counts_per_second * sample_time)
+    msgs = []
+    for step in range(int(return_rate * duration)):
+        timestamp = step / return_rate
+        position = math.floor(counts_per_second * timestamp)
+        for device_addr in device_addrs:
+            if content_mode & 0x01:
+                msgs.append(can.Message(timestamp=timestamp, arbitration_id=device_addr, is_extended_id=False,
+                                        data=angle_frame_data(position % 32768, angular_vel, position // 32768)))
+            if content_mode & 0x02:
+                msgs.append(can.Message(timestamp=timestamp, arbitration_id=device_addr, is_extended_id=False,
+                                        data=temperature_frame_data(round(temperature * 100))))
+    return msgs
@@ -7,8 +7,13 @@ COM_PORT = '/dev/ttyACM3'
 DEVICE_ADDR = 0x50
 
 import can
+import collections
+import concurrent.futures
+import queue
+import threading
 import time
 from enum import IntEnum
+from typing import NamedTuple, Optional
 
 
 class Register(IntEnum):
@@ -123,27 +128,241 @@ class Register(IntEnum):
     # Appears to be the high word of the version number
 
 
-def send_read_request(bus, register: Register):
+class RegisterFormat(NamedTuple):
+    # How a register's value is laid out in the reply frame (bytes 2 onwards) and in the write payload
+    description: str
+    # Size of the value in bytes, little-endian
+    width: int = 2
+    signed: bool = False
+    # Physical units per count of the register value, see to_physical
+    scale: float = 1
+    unit: str = ''
+    # Register value -> meaning, for registers which hold one of a fixed set of options
+    values: Optional[dict] = None
+    # Bounds on writable values, defaulting to whatever fits in width
+    minimum: Optional[int] = None
+    maximum: Optional[int] = None
+    # Registers whose reply format is not understood are decoded to the whole reply frame as a list of bytes
+    decode_frame: bool = False
+
+    # NumPy dtype string of the value, for decoding many replies at once
+    @property
+    def dtype(self):
+        return f"<{'i' if self.signed else 'u'}{self.width}"
+
+
+# One entry per register, see the comments on Register for where each of these come from.
+# Supporting a new register only needs a new entry here.
+REGISTER_FORMATS = {
+    Register.APPLY_SETTINGS: RegisterFormat('apply settings mode', width=1, decode_frame=True,
+                                            values={0x00: 'save', 0x01: 'factory_reset', 0xFF: 'restart'}),
+    Register.CONTENT_MODE: RegisterFormat('content mode', width=1,
+                                          values={0x01: 'angles', 0x02: 'temperature', 0x03: 'both'}),
+    Register.RETURN_RATE: RegisterFormat('rate', width=1, unit='Hz',
+                                         values={0x00: 0.1, 0x01: 0.2, 0x02: 0.5, 0x03: 1, 0x04: 2, 0x05: 5, 0x06: 10,
+                                                 0x07: 20, 0x08: 50, 0x09: 100, 0x0A: 125, 0x0B: 200, 0x0C: 1000,
+                                                 0x0D: 2000, 0x0E: 'single_return'}),
+    Register.BAUD_RATE: RegisterFormat('baud rate', width=1, unit='K',
+                                       values={0x00: 1000, 0x01: 800, 0x02: 500, 0x03: 400, 0x04: 250, 0x05: 200,
+                                               0x06: 125, 0x07: 100, 0x08: 80, 0x09: 50, 0x0A: 40, 0x0B: 20, 0x0C: 10,
+                                               0x0D: 5, 0x0E: 3}),
+    Register.ENCODER_MODE: RegisterFormat('encoder mode', width=1, values={0x00: 'single', 0x01: 'multi'}),
+    Register.ANG_VAL: RegisterFormat('angle value', scale=360 / 32768, unit='°', maximum=32767),
+    Register.REVOLUTIONS: RegisterFormat('number of revolutions', signed=True),
+    # The scale does not include the division by the angular velocity sample time
+    Register.ANGULAR_VEL: RegisterFormat('angular velocity', signed=True, scale=360 / 32768, unit='°'),
+    Register.TEMPERATURE: RegisterFormat('temperature', signed=True, scale=1 / 100, unit='°C'),
+    Register.SPIN_DIR: RegisterFormat('spin direction', width=1, values={0x00: 'clockwise', 0x01: 'counterclockwise'}),
+    Register.ANGULAR_VEL_SAMPLE_PERIOD: RegisterFormat('sample period', scale=1e-4, unit='s', minimum=1),
+    Register.READ_REGISTER: RegisterFormat('read register', decode_frame=True),
+    Register.DEVICE_ADDR: RegisterFormat('CAN address', maximum=0x7FF),
+    Register.VERSION_NUM_L: RegisterFormat('version number low word', decode_frame=True),
+    Register.VERSION_NUM_H: RegisterFormat('version number high word', decode_frame=True),
+}
+
+
+def _make_decoder(register_format):
+    if register_format.decode_frame:
+        return lambda msg: list(msg.data)
+
+    end = 2 + register_format.width
+    signed = register_format.signed
+    if register_format.values is not None:
+        values = register_format.values
+        return lambda msg: values.get(int.from_bytes(msg.data[2:end], byteorder='little', signed=signed))
+    return lambda msg: int.from_bytes(msg.data[2:end], byteorder='little', signed=signed)
+
+
+def _make_encoder(register_format):
+    invalid_value = f'Invalid {register_format.description} provided'
+
+    if register_format.values is not None:
+        register_values = {value: register_value for register_value, value in register_format.values.items()}
+
+        def encode(value):
+            try:
+                return [register_values[value], 0x00]
+            except (KeyError, TypeError):
+                raise ValueError(invalid_value) from None
+        return encode
+
+    bits = 8 * register_format.width
+    minimum = register_format.minimum
+    if minimum is None:
+        minimum = -(1 << (bits - 1)) if register_format.signed else 0
+    maximum = register_format.maximum
+    if maximum is None:
+        maximum = (1 << (bits - 1)) - 1 if register_format.signed else (1 << bits) - 1
+
+    def encode(value):
+        if value < minimum or value > maximum: raise ValueError(invalid_value)
+        # The payload is always 2 bytes, two's complement takes care of signed values
+        return list(int.to_bytes(value & 0xFFFF, 2, byteorder='little'))
+    return encode
+
+
+# Precomputed from REGISTER_FORMATS so every lookup is a single dict access
+_DECODERS = {register: _make_decoder(register_format) for register, register_format in REGISTER_FORMATS.items()}
+_ENCODERS = {register: _make_encoder(register_format) for register, register_format in REGISTER_FORMATS.items()
+             if not register_format.decode_frame or register_format.values is not None}
+
+
+# Decodes a register reply, returning None if msg is None (i.e. the read timed out) or holds an unknown option
+def decode_register(register: Register, msg):
+    if msg is None:
+        return None
+    return _DECODERS[register](msg)
+
+
+# Returns the 2-byte write payload for value, raising ValueError if the register cannot hold it
+def encode_register(register: Register, value):
+    return _ENCODERS[register](value)
+
+
+# Converts a raw register value to physical units, e.g. an ANG_VAL of 2730 to 30°
+def to_physical(register: Register, register_value):
+    return register_value * REGISTER_FORMATS[register].scale
+
+
+# Registers whose values change by themselves. Every other register only changes when it is written (or the encoder
+# restarts, which only happens on request), so replies for them can be cached between writes.
+LIVE_REGISTERS = (Register.ANG_VAL, Register.REVOLUTIONS, Register.ANGULAR_VEL, Register.TEMPERATURE)
+
+
+class ConfigCache:
+    # Replies for the configuration (non-live) registers of every encoder, by device address.
+    #
+    # send_write_request invalidates a device's entries whenever it writes to it, which covers the set_* helpers and
+    # apply_settings (restart and factory reset included). Each device has a generation number which every
+    # invalidation bumps, and replies are only stored if it has not changed since the read was sent, so a reply
+    # which raced a write can never be cached.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._replies = {}
+        self._generations = collections.Counter()
+
+    # The generation to pass to store for a read about to be sent to device_addr
+    def generation(self, device_addr):
+        with self._lock:
+            return self._generations[device_addr]
+
+    # Returns {register: reply} for whichever of registers are cached for device_addr
+    def lookup(self, device_addr, registers):
+        with self._lock:
+            cached = self._replies.get(device_addr, {})
+            return {register: cached[register] for register in registers if register in cached}
+
+    # Caches the configuration registers among replies ({register: reply or None}, all read from device_addr in one
+    # batch), unless device_addr has been written to since generation.
+    # Nothing is cached if any reply is missing: replies are matched to requests by sequence, so a batch which lost
+    # one is the batch most likely to have put another on the wrong register.
+    def store(self, device_addr, replies, generation):
+        if any(msg is None for msg in replies.values()):
+            return
+        with self._lock:
+            if self._generations[device_addr] != generation:
+                return
+            cached = self._replies.setdefault(device_addr, {})
+            for register, msg in replies.items():
+                if register not in LIVE_REGISTERS:
+                    cached[register] = msg
+
+    # Forgets everything cached for device_addr, or for every device if device_addr is None
+    def invalidate(self, device_addr=None):
+        with self._lock:
+            device_addrs = list(self._replies) if device_addr is None else [device_addr]
+            for invalidated_addr in device_addrs:
+                self._replies.pop(invalidated_addr, None)
+                self._generations[invalidated_addr] += 1
+
+
+config_cache = ConfigCache()
+
+
+class RequestStats:
+    # Per device address counts of what happened to the requests sent through this module:
+    #   - requests: read requests sent
+    #   - retries: read requests re-sent because the previous attempt got no reply
+    #   - reply_timeouts: reads which gave up without a reply (after all their retries)
+    #   - send_errors: frames (reads or writes) the bus refused to send
+    # Requests are sent from any thread, so updates take a lock; that is cheap next to the bus round trip they count.
+    # See health.py for exporting them.
+    KINDS = ('requests', 'retries', 'reply_timeouts', 'send_errors')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = collections.defaultdict(lambda: dict.fromkeys(RequestStats.KINDS, 0))
+
+    def count(self, device_addr, kind, n=1):
+        with self._lock:
+            self._counts[device_addr][kind] += n
+
+    # Returns {device_addr: {kind: count}}
+    def snapshot(self):
+        with self._lock:
+            return {device_addr: dict(counts) for device_addr, counts in self._counts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+request_stats = RequestStats()
+
+
+# The frame asking device_addr for the value of register
+def read_request_message(register: Register, device_addr):
     # Built from example at https://python-can.readthedocs.io/en/stable/
-    msg = can.Message(arbitration_id=DEVICE_ADDR,
-                      data=[0xFF, 0xAA, 0x27, register, 0x00],
-                      is_extended_id=False)
+    return can.Message(arbitration_id=device_addr,
+                       data=[0xFF, 0xAA, 0x27, register, 0x00],
+                       is_extended_id=False)
+
+
+# Every request helper takes an optional device_addr so several encoders can share a bus, falling back to DEVICE_ADDR
+def send_read_request(bus, register: Register, device_addr=None):
+    if device_addr is None:
+        device_addr = DEVICE_ADDR
+    msg = read_request_message(register, device_addr)
 
+    request_stats.count(device_addr, 'requests')
     try:
         bus.send(msg)
     except can.CanError:
+        request_stats.count(device_addr, 'send_errors')
         print("Error sending CAN message")
 
 
-def send_write_request(bus, register: Register, payload, unlock=True):
+def send_write_request(bus, register: Register, payload, unlock=True, device_addr=None):
     assert (len(payload) == 2)
+    if device_addr is None:
+        device_addr = DEVICE_ADDR
 
     # Send unlock command then message
-    unlock_msg = can.Message(arbitration_id=DEVICE_ADDR,
+    unlock_msg = can.Message(arbitration_id=device_addr,
                              data=[0xFF, 0xAA, 0x69, 0x88, 0xB5],
                              is_extended_id=False)
 
-    msg = can.Message(arbitration_id=DEVICE_ADDR,
+    msg = can.Message(arbitration_id=device_addr,
                       data=[0xFF, 0xAA, register, payload[0], payload[1]],
                       is_extended_id=False)
 
@@ -151,396 +370,606 @@ def send_write_request(bus, register: Register, payload, unlock=True):
         if unlock: bus.send(unlock_msg)
         bus.send(msg)
     except can.CanError:
+        request_stats.count(device_addr, 'send_errors')
         print("Error sending CAN message")
+    config_cache.invalidate(device_addr)
 
 
-def send_read_and_wait(bus, register: Register, timeout=1, retries=0):
-    send_read_request(bus, register)
+# can_filters for can.Bus which only let frames from the given encoders through.
+# On SocketCAN these become CAN_RAW_FILTERs in the kernel, so other traffic on the bus never wakes the process; other
+# interfaces apply them in the driver or in python-can.
+def encoder_can_filters(device_addrs):
+    return [{'can_id': device_addr, 'can_mask': 0x7FF, 'extended': False} for device_addr in device_addrs]
 
-    for _ in range(retries + 1):
-        try:
-            abort_time = time.time() + timeout
-            while time.time() < abort_time:
-                msg = bus.recv(1)
-                if msg is not None and len(msg.data) == 8:
-                    if msg.data[0] == 0x55 and msg.data[1] == 0x5F:
-                        return msg
-        except KeyboardInterrupt:
+
+# Whether msg is a 0x55 0x5F register reply, from device_addr if one is given
+def is_register_reply(msg, device_addr=None):
+    return (len(msg.data) == 8 and msg.data[0] == 0x55 and msg.data[1] == 0x5F
+            and (device_addr is None or msg.arbitration_id == device_addr))
+
+
+# Blocks until a register reply from device_addr arrives or the time.monotonic() deadline passes, returning None in
+# the latter case. Each recv blocks for exactly the time left, so a missing reply costs no more than the deadline.
+def wait_for_reply(bus, device_addr, deadline):
+    while True:
+        time_left = deadline - time.monotonic()
+        if time_left <= 0:
             return None
+        msg = bus.recv(time_left)
+        if msg is not None and is_register_reply(msg, device_addr):
+            return msg
+
+
+# Reads a register, returning the reply or None if there was none.
+# The request is re-sent for each of the retries, each attempt waiting backoff times longer than the one before, so a
+# missing reply costs at most timeout * (1 + backoff + ... + backoff^retries).
+def send_read_and_wait(bus, register: Register, timeout=1, retries=0, device_addr=None, backoff=2):
+    if device_addr is None:
+        device_addr = DEVICE_ADDR
+
+    attempt_timeout = timeout
+    try:
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                request_stats.count(device_addr, 'retries')
+            send_read_request(bus, register, device_addr)
+            msg = wait_for_reply(bus, device_addr, time.monotonic() + attempt_timeout)
+            if msg is not None:
+                return msg
+            attempt_timeout *= backoff
+        request_stats.count(device_addr, 'reply_timeouts')
+    except KeyboardInterrupt:
+        pass
     return None
 
 
-def get_apply_settings_register(bus):
-    settings_register = None
-    msg = send_read_and_wait(bus, Register.APPLY_SETTINGS)
-    if msg is not None:
-        settings_register = list(msg.data)
-    return settings_register
+def send_batch_read_and_wait(bus, registers, timeout=1, device_addr=None):
+    # Pipelined version of send_read_and_wait: every read request is sent back to back, then the replies are
+    # collected as they arrive, so reading n registers costs about one round trip instead of n.
+    #
+    # The 0x55 0x5F reply does not say which register it is answering, but the encoder answers in order, so the
+    # i-th reply is matched to the i-th request. That only holds while no reply goes missing, so the timeout covers
+    # the batch as a whole: if fewer replies than requests arrive by the deadline, none of them can be trusted and
+    # the registers are re-read one at a time, see send_multi_device_read_and_wait. Registers which still get no
+    # reply are reported as None, exactly as send_read_and_wait reports a timeout.
+    if device_addr is None:
+        device_addr = DEVICE_ADDR
+    replies = send_multi_device_read_and_wait(bus, [(device_addr, register) for register in registers], timeout)
+    return {register: msg for (_, register), msg in replies.items()}
+
+
+# send_batch_read_and_wait which answers configuration registers from config_cache where it can, so only the live
+# registers and whatever is not cached yet go to the bus. refresh=True reads everything and re-populates the cache.
+def send_cached_read_and_wait(bus, registers, timeout=1, device_addr=None, refresh=False):
+    if device_addr is None:
+        device_addr = DEVICE_ADDR
+    if refresh:
+        config_cache.invalidate(device_addr)
+    replies = send_multi_device_cached_read_and_wait(bus, [(device_addr, register) for register in registers], timeout)
+    return {register: msg for (_, register), msg in replies.items()}
+
+
+# send_multi_device_read_and_wait which answers configuration registers from config_cache where it can, and caches
+# the configuration replies it does read
+def send_multi_device_cached_read_and_wait(bus, requests, timeout=1):
+    requests = list(requests)
+    device_addrs = {device_addr for device_addr, _ in requests}
+    # Taken before the lookup, so anything invalidated in between is not re-cached from a stale read
+    generations = {device_addr: config_cache.generation(device_addr) for device_addr in device_addrs}
+    cached = {}
+    for device_addr in device_addrs:
+        device_registers = [register for request_addr, register in requests if request_addr == device_addr]
+        for register, msg in config_cache.lookup(device_addr, device_registers).items():
+            cached[(device_addr, register)] = msg
+
+    replies = send_multi_device_read_and_wait(bus, [request for request in requests if request not in cached], timeout)
+    for device_addr in device_addrs:
+        config_cache.store(device_addr, {register: msg for (reply_addr, register), msg in replies.items()
+                                         if reply_addr == device_addr}, generations[device_addr])
+    replies.update(cached)
+    return {request: replies[request] for request in requests}
+
+
+# Re-reads every configuration register of device_addr into config_cache, returning the registers which timed out
+def refresh_config(bus, timeout=1, device_addr=None):
+    replies = send_cached_read_and_wait(bus, [register for register in Register if register not in LIVE_REGISTERS],
+                                        timeout, device_addr, refresh=True)
+    return [register for register, msg in replies.items() if msg is None]
+
+
+def send_multi_device_read_and_wait(bus, requests, timeout=1):
+    # send_batch_read_and_wait across several encoders at once, requests being (device_addr, register) pairs.
+    # Replies are told apart by arbitration_id and matched by sequence per device, so every device works through
+    # its own requests concurrently. Returns the reply (or None) for each (device_addr, register) pair.
+    #
+    # A device which answers some but not all of its requests by the deadline has lost a reply somewhere, and since
+    # replies do not name their register there is no telling which. Its replies are all discarded and its registers
+    # re-read one at a time.
+    #
+    # Replies received before their request was sent are ignored, and after any miss the bus is drained for another
+    # timeout before anything else is sent, so a late reply is not taken for a later request as long as it arrives
+    # within timeout of the deadline it missed. Only one later than that can still land on the wrong register. The
+    # price is that a device which does not answer costs two timeouts instead of one.
+    requests = list(requests)
+    replies, short_devices = _pipelined_read(bus, requests, timeout)
+    if None in replies.values():
+        drain_replies(bus, timeout)
+    if short_devices:
+        replies.update(_read_one_at_a_time(bus, [request for request in requests if request[0] in short_devices],
+                                           timeout))
+    return replies
+
+
+# Receives and discards everything on bus for duration [s], so a reply still on its way to a request which timed out
+# is not taken for the next one
+def drain_replies(bus, duration):
+    abort_time = time.monotonic() + duration
+    try:
+        while True:
+            time_left = abort_time - time.monotonic()
+            if time_left <= 0:
+                return
+            bus.recv(time_left)
+    except KeyboardInterrupt:
+        pass
+
+
+# Sends every request back to back and matches the replies by sequence per device.
+# Returns the replies, with None for every request of a device which did not answer all of its requests, and the
+# devices which answered some of their requests but not all.
+# Replies timestamped before the first request went out answer some earlier read and are ignored; python-can stamps
+# frames with time.time(), whether the interface or python-can itself takes the timestamp.
+def _pipelined_read(bus, requests, timeout):
+    replies = dict.fromkeys(requests)
+
+    # Requests each device has yet to answer, in the order they were sent
+    pending = {}
+    sent_time = time.time()
+    for device_addr, register in requests:
+        pending.setdefault(device_addr, collections.deque()).append((device_addr, register))
+        send_read_request(bus, register, device_addr)
+    requested = {device_addr: len(device_pending) for device_addr, device_pending in pending.items()}
+
+    remaining = len(requests)
+    try:
+        abort_time = time.monotonic() + timeout
+        while remaining > 0:
+            time_left = abort_time - time.monotonic()
+            if time_left <= 0:
+                break
+            msg = bus.recv(time_left)
+            if msg is not None and is_register_reply(msg) and msg.timestamp >= sent_time:
+                device_pending = pending.get(msg.arbitration_id)
+                if device_pending:
+                    replies[device_pending.popleft()] = msg
+                    remaining -= 1
+    except KeyboardInterrupt:
+        pass
+
+    short_devices = set()
+    for device_addr, device_pending in pending.items():
+        if not device_pending:
+            continue
+        for request in replies:
+            if request[0] == device_addr:
+                replies[request] = None
+        if len(device_pending) == requested[device_addr]:
+            request_stats.count(device_addr, 'reply_timeouts', len(device_pending))
+        else:
+            # Only the requests whose replies went missing have to be sent again; the re-reads of the others are
+            # down to not knowing which ones those were
+            request_stats.count(device_addr, 'retries', len(device_pending))
+            short_devices.add(device_addr)
+    return replies, short_devices
+
+
+# Reads requests with at most one read in flight per device, so every reply belongs to the one register its device
+# was asked for. Devices still take turns concurrently, but each register a device does not answer costs a full
+# timeout, plus another draining its reply in case it is only late.
+def _read_one_at_a_time(bus, requests, timeout):
+    replies = dict.fromkeys(requests)
+    queued = {}
+    for request in requests:
+        queued.setdefault(request[0], collections.deque()).append(request)
+
+    while queued:
+        round_replies, _ = _pipelined_read(bus, [device_queue.popleft() for device_queue in queued.values()], timeout)
+        replies.update(round_replies)
+        if None in round_replies.values():
+            drain_replies(bus, timeout)
+        queued = {device_addr: device_queue for device_addr, device_queue in queued.items() if device_queue}
+    return replies
+
+
+class BusDispatcher(can.Listener):
+    # Owns the receive side of a bus through a single can.Notifier thread, instead of every caller polling bus.recv
+    # and discarding whatever it was not looking for.
+    #   - Register replies (0x55 0x5F) are handed to the oldest read_register future still waiting on that device
+    #   - Every other frame (angle/temperature telemetry, other devices) is fanned out to the subscribers
+    #
+    # A dispatcher can be passed anywhere a bus is expected: send() goes straight to the bus, and recv() returns the
+    # register replies no future was waiting for, so send_read_and_wait and the get_*/set_* helpers work unchanged
+    # without stealing telemetry from streaming consumers.
+    def __init__(self, bus):
+        self.bus = bus
+        self._lock = threading.Lock()
+        # Per device address, (abort_time, future) for each read_register request in the order the requests were sent
+        self._waiting = collections.defaultdict(collections.deque)
+        self._unclaimed_replies = queue.Queue()
+        self._subscribers = []
+        self._notifier = can.Notifier(bus, [self])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        # Notifier.stop will in turn call stop on this listener
+        self._notifier.stop()
+
+    def stop(self):
+        with self._lock:
+            for device_waiting in self._waiting.values():
+                while device_waiting:
+                    device_waiting.popleft()[1].cancel()
+
+    def send(self, msg, timeout=None):
+        self.bus.send(msg, timeout)
+
+    def recv(self, timeout=None):
+        try:
+            return self._unclaimed_replies.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    # Callback is called from the notifier thread with every frame which is not a register reply
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers = self._subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [subscriber for subscriber in self._subscribers if subscriber is not callback]
+
+    # Returns a concurrent.futures.Future resolving to the reply message.
+    # Replies are matched by sequence like send_batch_read_and_wait. Once timeout has passed the request stops waiting
+    # for a reply, so a lost reply only affects the requests to the same device whose replies arrive before its
+    # deadline, but those each get the reply meant for the next request. Keep at most one read per device in flight
+    # (as send_read_and_wait does) wherever a reply may be lost.
+    def read_register(self, register: Register, timeout=1, device_addr=None):
+        if device_addr is None:
+            device_addr = DEVICE_ADDR
+        future = concurrent.futures.Future()
+        # Hold the lock while sending so the order of _waiting always matches the order requests went out
+        with self._lock:
+            self._waiting[device_addr].append((time.monotonic() + timeout, future))
+            send_read_request(self, register, device_addr)
+        return future
+
+    def on_message_received(self, msg):
+        if is_register_reply(msg):
+            self._dispatch_reply(msg)
+        else:
+            for subscriber in self._subscribers:
+                subscriber(msg)
+
+    def _dispatch_reply(self, msg):
+        now = time.monotonic()
+        with self._lock:
+            device_waiting = self._waiting.get(msg.arbitration_id, ())
+            while device_waiting:
+                abort_time, future = device_waiting.popleft()
+                if abort_time < now:
+                    future.cancel()
+                    request_stats.count(msg.arbitration_id, 'reply_timeouts')
+                elif future.set_running_or_notify_cancel():
+                    future.set_result(msg)
+                    return
+        self._unclaimed_replies.put(msg)
+
+
+def get_apply_settings_register(bus, device_addr=None):
+    return decode_apply_settings_register(send_read_and_wait(bus, Register.APPLY_SETTINGS, device_addr=device_addr))
+
+
+def decode_apply_settings_register(msg):
+    return decode_register(Register.APPLY_SETTINGS, msg)
 
 
 # Eligible modes: 'save', 'factory_reset', 'restart'
-def apply_settings(bus, mode, unlock=True):
-    payload = [0x00, 0x00]
-    match mode:
-        case 'save':
-            payload[0] = 0x00
-        case 'factory_reset':
-            payload[0] = 0x01
-        case 'restart':
-            payload[0] = 0xFF
-        case _:
-            raise ValueError('Invalid apply settings mode provided')
-    send_write_request(bus, Register.APPLY_SETTINGS, payload, unlock)
-
-
-def get_content_mode(bus):
-    content_mode = None
-    msg = send_read_and_wait(bus, Register.CONTENT_MODE)
-    if msg is not None:
-        match msg.data[2]:
-            case 0x01:
-                content_mode = 'angles'
-            case 0x02:
-                content_mode = 'temperature'
-            case 0x03:
-                content_mode = 'both'
-    return content_mode
-
-
-def set_content_mode(bus, content_mode, unlock=True):
-    payload = [0x00, 0x00]
-    match content_mode:
-        case 'angles':
-            payload[0] = 0x01
-        case 'temperature':
-            payload[0] = 0x02
-        case 'both':
-            payload[0] = 0x03
-        case _:
-            raise ValueError('Invalid content mode provided')
-    send_write_request(bus, Register.CONTENT_MODE, payload, unlock)
-
-
-def get_return_rate(bus):
-    return_rate = None
-    msg = send_read_and_wait(bus, Register.RETURN_RATE)
-    if msg is not None:
-        match msg.data[2]:
-            case 0x00:
-                return_rate = 0.1
-            case 0x01:
-                return_rate = 0.2
-            case 0x02:
-                return_rate = 0.5
-            case 0x03:
-                return_rate = 1
-            case 0x04:
-                return_rate = 2
-            case 0x05:
-                return_rate = 5
-            case 0x06:
-                return_rate = 10
-            case 0x07:
-                return_rate = 20
-            case 0x08:
-                return_rate = 50
-            case 0x09:
-                return_rate = 100
-            case 0x0A:
-                return_rate = 125
-            case 0x0B:
-                return_rate = 200
-            case 0x0C:
-                return_rate = 1000
-            case 0x0D:
-                return_rate = 2000
-            case 0x0E:
-                return_rate = 'single_return'
-    return return_rate
-
-
-def set_return_rate(bus, return_rate, unlock=True):
-    # Note to anyone who has to maintain these switches, regex is your friend:
-    # Find: "case (0x..):\s*\r\n(\s+)return (.*)$"
-    # Replace: "case $3:\r\n$2payload[0] = $1"
-    payload = [0x00, 0x00]
-    match return_rate:
-        case 0.1:
-            payload[0] = 0x00
-        case 0.2:
-            payload[0] = 0x01
-        case 0.5:
-            payload[0] = 0x02
-        case 1:
-            payload[0] = 0x03
-        case 2:
-            payload[0] = 0x04
-        case 5:
-            payload[0] = 0x05
-        case 10:
-            payload[0] = 0x06
-        case 20:
-            payload[0] = 0x07
-        case 50:
-            payload[0] = 0x08
-        case 100:
-            payload[0] = 0x09
-        case 125:
-            payload[0] = 0x0A
-        case 200:
-            payload[0] = 0x0B
-        case 1000:
-            payload[0] = 0x0C
-        case 2000:
-            payload[0] = 0x0D
-        case 'single_return':
-            payload[0] = 0x0E
-        case _:
-            raise ValueError('Invalid rate provided')
-    send_write_request(bus, Register.RETURN_RATE, payload, unlock)
-
-
-def get_baud_rate(bus):
-    baud_rate = None
-    msg = send_read_and_wait(bus, Register.BAUD_RATE)
-    if msg is not None:
-        match msg.data[2]:
-            case 0x00:
-                baud_rate = 1000
-            case 0x01:
-                baud_rate = 800
-            case 0x02:
-                baud_rate = 500
-            case 0x03:
-                baud_rate = 400
-            case 0x04:
-                baud_rate = 250
-            case 0x05:
-                baud_rate = 200
-            case 0x06:
-                baud_rate = 125
-            case 0x07:
-                baud_rate = 100
-            case 0x08:
-                baud_rate = 80
-            case 0x09:
-                baud_rate = 50
-            case 0x0A:
-                baud_rate = 40
-            case 0x0B:
-                baud_rate = 20
-            case 0x0C:
-                baud_rate = 10
-            case 0x0D:
-                baud_rate = 5
-            case 0x0E:
-                baud_rate = 3
-    return baud_rate
-
-
-def set_baud_rate(bus, baud_rate, unlock=True):
-    payload = [0x00, 0x00]
-    match baud_rate:
-        case 1000:
-            payload[0] = 0x00
-        case 800:
-            payload[0] = 0x01
-        case 500:
-            payload[0] = 0x02
-        case 400:
-            payload[0] = 0x03
-        case 250:
-            payload[0] = 0x04
-        case 200:
-            payload[0] = 0x05
-        case 125:
-            payload[0] = 0x06
-        case 100:
-            payload[0] = 0x07
-        case 80:
-            payload[0] = 0x08
-        case 50:
-            payload[0] = 0x09
-        case 40:
-            payload[0] = 0x0A
-        case 20:
-            payload[0] = 0x0B
-        case 10:
-            payload[0] = 0x0C
-        case 5:
-            payload[0] = 0x0D
-        case 3:
-            payload[0] = 0x0E
-        case _:
-            raise ValueError('Invalid baud rate provided')
-    send_write_request(bus, Register.BAUD_RATE, payload, unlock)
-
-
-def get_encoder_mode(bus):
-    encoder_mode = None
-    msg = send_read_and_wait(bus, Register.ENCODER_MODE)
-    if msg is not None:
-        match msg.data[2]:
-            case 0x00:
-                encoder_mode = 'single'
-            case 0x01:
-                encoder_mode = 'multi'
-    return encoder_mode
-
-
-def set_encoder_mode(bus, mode, unlock=True):
-    payload = [0x00, 0x00]
-    match mode:
-        case 'single':
-            payload[0] = 0x00
-        case 'multi':
-            payload[0] = 0x01
-        case _:
-            raise ValueError('Invalid encoder mode provided')
-    send_write_request(bus, Register.ENCODER_MODE, payload, unlock)
+def apply_settings(bus, mode, unlock=True, device_addr=None):
+    send_write_request(bus, Register.APPLY_SETTINGS, encode_register(Register.APPLY_SETTINGS, mode), unlock,
+                       device_addr)
+
+
+def get_content_mode(bus, device_addr=None):
+    return decode_content_mode(send_read_and_wait(bus, Register.CONTENT_MODE, device_addr=device_addr))
+
+
+def decode_content_mode(msg):
+    return decode_register(Register.CONTENT_MODE, msg)
+
+
+def set_content_mode(bus, content_mode, unlock=True, device_addr=None):
+    send_write_request(bus, Register.CONTENT_MODE, encode_register(Register.CONTENT_MODE, content_mode), unlock,
+                       device_addr)
+
+
+def get_return_rate(bus, device_addr=None):
+    return decode_return_rate(send_read_and_wait(bus, Register.RETURN_RATE, device_addr=device_addr))
+
+
+def decode_return_rate(msg):
+    return decode_register(Register.RETURN_RATE, msg)
+
+
+def set_return_rate(bus, return_rate, unlock=True, device_addr=None):
+    send_write_request(bus, Register.RETURN_RATE, encode_register(Register.RETURN_RATE, return_rate), unlock,
+                       device_addr)
+
+
+def get_baud_rate(bus, device_addr=None):
+    return decode_baud_rate(send_read_and_wait(bus, Register.BAUD_RATE, device_addr=device_addr))
+
+
+def decode_baud_rate(msg):
+    return decode_register(Register.BAUD_RATE, msg)
+
+
+def set_baud_rate(bus, baud_rate, unlock=True, device_addr=None):
+    send_write_request(bus, Register.BAUD_RATE, encode_register(Register.BAUD_RATE, baud_rate), unlock, device_addr)
+
+
+def get_encoder_mode(bus, device_addr=None):
+    return decode_encoder_mode(send_read_and_wait(bus, Register.ENCODER_MODE, device_addr=device_addr))
+
+
+def decode_encoder_mode(msg):
+    return decode_register(Register.ENCODER_MODE, msg)
+
+
+def set_encoder_mode(bus, mode, unlock=True, device_addr=None):
+    send_write_request(bus, Register.ENCODER_MODE, encode_register(Register.ENCODER_MODE, mode), unlock, device_addr)
 
 
 # Returns the angle register value, to convert to degrees perform get_ang_val(bus) * 360 / 32768
-def get_ang_val(bus):
-    angle_register = None
-    msg = send_read_and_wait(bus, Register.ANG_VAL)
-    if msg is not None:
-        angle_register = int.from_bytes([msg.data[2], msg.data[3]], byteorder='little', signed=False)
-    return angle_register
+def get_ang_val(bus, device_addr=None):
+    return decode_ang_val(send_read_and_wait(bus, Register.ANG_VAL, device_addr=device_addr))
+
+
+def decode_ang_val(msg):
+    return decode_register(Register.ANG_VAL, msg)
 
 
-def set_ang_val(bus, angle_register_value, unlock=True):
-    if angle_register_value < 0 or angle_register_value >= 2e15: raise ValueError('Invalid angle value provided')
-    payload = int.to_bytes(angle_register_value, 2, byteorder='little', signed=False)
-    send_write_request(bus, Register.ANG_VAL, payload, unlock)
+def set_ang_val(bus, angle_register_value, unlock=True, device_addr=None):
+    send_write_request(bus, Register.ANG_VAL, encode_register(Register.ANG_VAL, angle_register_value), unlock,
+                       device_addr)
 
 
-def get_revolutions(bus):
-    num_revolutions = None
-    msg = send_read_and_wait(bus, Register.REVOLUTIONS)
-    if msg is not None:
-        num_revolutions = int.from_bytes([msg.data[2], msg.data[3]], byteorder='little', signed=True)
-    return num_revolutions
+def get_revolutions(bus, device_addr=None):
+    return decode_revolutions(send_read_and_wait(bus, Register.REVOLUTIONS, device_addr=device_addr))
 
 
-def set_revolutions(bus, revolutions, unlock=True):
-    if revolutions < -2e15 or revolutions >= 2e15: raise ValueError('Invalid number of revolutions provided')
-    payload = int.to_bytes(revolutions, 2, byteorder='little', signed=True)
-    send_write_request(bus, Register.REVOLUTIONS, payload, unlock)
+def decode_revolutions(msg):
+    return decode_register(Register.REVOLUTIONS, msg)
+
+
+def set_revolutions(bus, revolutions, unlock=True, device_addr=None):
+    send_write_request(bus, Register.REVOLUTIONS, encode_register(Register.REVOLUTIONS, revolutions), unlock,
+                       device_addr)
 
 
 # Returns the angular velocity register value, to convert to degrees/s perform
 #   get_angular_vel(bus) * 360 / 32768 / get_angular_vel_sample_period(bus) / 10e5
-def get_angular_vel(bus):
-    angular_velocity_register = None
-    msg = send_read_and_wait(bus, Register.ANGULAR_VEL)
-    if msg is not None:
-        angular_velocity_register = int.from_bytes([msg.data[2], msg.data[3]], byteorder='little', signed=True)
-    return angular_velocity_register
+def get_angular_vel(bus, device_addr=None):
+    return decode_angular_vel(send_read_and_wait(bus, Register.ANGULAR_VEL, device_addr=device_addr))
+
+
+def decode_angular_vel(msg):
+    return decode_register(Register.ANGULAR_VEL, msg)
 
 
 # Angular velocity is not eligible to be set
 
 
 # Returns in centidegrees Celsius, to convert to degrees celsius perform get_temperature(bus) / 100
-def get_temperature(bus):
-    temperature_register = None
-    msg = send_read_and_wait(bus, Register.TEMPERATURE)
-    if msg is not None:
-        temperature_register = int.from_bytes([msg.data[2], msg.data[3]], byteorder='little', signed=True)
-    return temperature_register
+def get_temperature(bus, device_addr=None):
+    return decode_temperature(send_read_and_wait(bus, Register.TEMPERATURE, device_addr=device_addr))
+
+
+def decode_temperature(msg):
+    return decode_register(Register.TEMPERATURE, msg)
 
 
 # Temperature is not eligible to be set
 
 
-def get_spin_dir(bus):
-    spin_dir = None
-    msg = send_read_and_wait(bus, Register.SPIN_DIR)
-    if msg is not None:
-        match msg.data[2]:
-            case 0x00:
-                spin_dir = 'clockwise'
-            case 0x01:
-                spin_dir = 'counterclockwise'
-    return spin_dir
+def get_spin_dir(bus, device_addr=None):
+    return decode_spin_dir(send_read_and_wait(bus, Register.SPIN_DIR, device_addr=device_addr))
+
 
+def decode_spin_dir(msg):
+    return decode_register(Register.SPIN_DIR, msg)
 
-def set_spin_dir(bus, direction, unlock=True):
-    payload = [0x00, 0x00]
-    match direction:
-        case 'clockwise':
-            payload[0] = 0x00
-        case 'counterclockwise':
-            payload[0] = 0x01
-        case _:
-            raise ValueError('Invalid spin direction provided')
-    send_write_request(bus, Register.SPIN_DIR, payload, unlock)
+
+def set_spin_dir(bus, direction, unlock=True, device_addr=None):
+    send_write_request(bus, Register.SPIN_DIR, encode_register(Register.SPIN_DIR, direction), unlock, device_addr)
 
 
 # Returns in 10^-4 seconds, i.e. hundreds of microseconds
-def get_angular_vel_sample_period(bus):
-    angular_vel_sample_register = None
-    msg = send_read_and_wait(bus, Register.ANGULAR_VEL_SAMPLE_PERIOD)
-    if msg is not None:
-        angular_vel_sample_register = int.from_bytes([msg.data[2], msg.data[3]], byteorder='little', signed=False)
-    return angular_vel_sample_register
+def get_angular_vel_sample_period(bus, device_addr=None):
+    return decode_angular_vel_sample_period(
+        send_read_and_wait(bus, Register.ANGULAR_VEL_SAMPLE_PERIOD, device_addr=device_addr))
+
 
+def decode_angular_vel_sample_period(msg):
+    return decode_register(Register.ANGULAR_VEL_SAMPLE_PERIOD, msg)
 
-def set_angular_vel_sample_period(bus, sample_period, unlock=True):
-    if sample_period < 1 or sample_period >= 2e16: raise ValueError('Invalid sample period provided')
-    payload = int.to_bytes(sample_period, 2, byteorder='little', signed=True)
-    send_write_request(bus, Register.ANGULAR_VEL_SAMPLE_PERIOD, payload, unlock)
+
+def set_angular_vel_sample_period(bus, sample_period, unlock=True, device_addr=None):
+    send_write_request(bus, Register.ANGULAR_VEL_SAMPLE_PERIOD,
+                       encode_register(Register.ANGULAR_VEL_SAMPLE_PERIOD, sample_period), unlock, device_addr)
 
 
 # No idea what this returns
-def get_read_register(bus):
-    read_register = None
-    msg = send_read_and_wait(bus, Register.READ_REGISTER)
-    if msg is not None:
-        read_register = list(msg.data)
-    return read_register
+def get_read_register(bus, device_addr=None):
+    return decode_read_register(send_read_and_wait(bus, Register.READ_REGISTER, device_addr=device_addr))
+
+
+def decode_read_register(msg):
+    return decode_register(Register.READ_REGISTER, msg)
 
 
 # Not confident in what READ_REGISTER does, so not allowing writing
 
 
-def get_device_addr(bus):
-    device_address = None
-    msg = send_read_and_wait(bus, Register.DEVICE_ADDR)
-    if msg is not None:
-        device_address = int.from_bytes([msg.data[2], msg.data[3]], byteorder='little', signed=False)
-    return device_address
+def get_device_addr(bus, device_addr=None):
+    return decode_device_addr(send_read_and_wait(bus, Register.DEVICE_ADDR, device_addr=device_addr))
+
 
+def decode_device_addr(msg):
+    return decode_register(Register.DEVICE_ADDR, msg)
 
-def set_device_addr(bus, address, unlock=True):
-    if address < 0 or address >= 2e11: raise ValueError('Invalid CAN address provided')
-    payload = int.to_bytes(address, 2, byteorder='little', signed=False)
-    send_write_request(bus, Register.DEVICE_ADDR, payload, unlock)
 
+def set_device_addr(bus, address, unlock=True, device_addr=None):
+    send_write_request(bus, Register.DEVICE_ADDR, encode_register(Register.DEVICE_ADDR, address), unlock, device_addr)
 
-def get_version_num_l(bus):
-    version_num_l = None
-    msg = send_read_and_wait(bus, Register.VERSION_NUM_L)
-    if msg is not None:
-        version_num_l = list(msg.data)
-    return version_num_l
 
+def get_version_num_l(bus, device_addr=None):
+    return decode_version_num_l(send_read_and_wait(bus, Register.VERSION_NUM_L, device_addr=device_addr))
 
-def get_version_num_h(bus):
-    version_num_h = None
-    msg = send_read_and_wait(bus, Register.VERSION_NUM_H)
-    if msg is not None:
-        version_num_h = list(msg.data)
-    return version_num_h
+
+def decode_version_num_l(msg):
+    return decode_register(Register.VERSION_NUM_L, msg)
+
+
+def get_version_num_h(bus, device_addr=None):
+    return decode_version_num_h(send_read_and_wait(bus, Register.VERSION_NUM_H, device_addr=device_addr))
+
+
+def decode_version_num_h(msg):
+    return decode_register(Register.VERSION_NUM_H, msg)
 
 
 # Version number is not eligible to be set
 
 
+# Registers configure_encoders can set. DEVICE_ADDR and BAUD_RATE are left out on purpose, changing either cuts the
+# encoder off from the bus it is being configured over, so its new settings could not be verified.
+CONFIGURABLE_REGISTERS = (Register.CONTENT_MODE, Register.RETURN_RATE, Register.ENCODER_MODE, Register.SPIN_DIR,
+                          Register.ANGULAR_VEL_SAMPLE_PERIOD)
+
+
+class ConfigResult(NamedTuple):
+    # Outcome of configure_encoders for one encoder
+    # {register: value} for every setting which differed from the encoder's and so was written
+    written: dict
+    # {register: (wanted value, value read back)} for every written setting which did not stick, the value read back
+    # being None if the encoder did not answer
+    mismatched: dict
+
+    @property
+    def ok(self):
+        return not self.mismatched
+
+
+# Configures encoders as one transaction each, settings being {device_addr: {register: value}} with values as the
+# set_* helpers take them (e.g. {Register.RETURN_RATE: 100, Register.SPIN_DIR: 'counterclockwise'}).
+#   1. The current settings are read (from config_cache where possible) and only the ones which differ are kept
+#   2. Each encoder with changes gets a single unlock, its changed registers back to back, then save and restart
+#   3. Once restarted, the written registers are read back one at a time per encoder, retrying for up to
+#      restart_timeout [s] while the encoders come back up
+# Every encoder goes through each step at the same time, so configuring the fleet takes about as long as one encoder.
+# Every value is validated before anything is sent, raising ValueError like the set_* helpers.
+# Returns {device_addr: ConfigResult}.
+def configure_encoders(bus, settings, timeout=1, restart_timeout=2):
+    payloads = {}
+    for device_addr, device_settings in settings.items():
+        for register in device_settings:
+            if register not in CONFIGURABLE_REGISTERS:
+                raise ValueError(f'{Register(register).name} cannot be configured')
+        payloads[device_addr] = {register: encode_register(register, value)
+                                 for register, value in device_settings.items()}
+
+    current = send_multi_device_cached_read_and_wait(
+        bus, [(device_addr, register) for device_addr, device_settings in settings.items()
+              for register in device_settings], timeout)
+    changes = {device_addr: {register: value for register, value in device_settings.items()
+                             if decode_register(register, current[(device_addr, register)]) != value}
+               for device_addr, device_settings in settings.items()}
+
+    for device_addr, device_changes in changes.items():
+        if not device_changes:
+            continue
+        for i, register in enumerate(device_changes):
+            send_write_request(bus, register, payloads[device_addr][register], unlock=i == 0,
+                               device_addr=device_addr)
+        apply_settings(bus, 'save', unlock=False, device_addr=device_addr)
+        apply_settings(bus, 'restart', unlock=False, device_addr=device_addr)
+
+    read_back = dict.fromkeys((device_addr, register) for device_addr, device_changes in changes.items()
+                              for register in device_changes)
+    generations = {device_addr: config_cache.generation(device_addr) for device_addr in changes}
+    # The request each device was last asked, and the devices which have left one unanswered since the last drain
+    asked = {}
+    missed = set()
+    deadline = time.monotonic() + restart_timeout
+    while True:
+        # Each device is asked for one register at a time, the same one until it answers. Requests are most likely to
+        # go missing while the encoders restart, and a reply lost from a pipelined batch would put the next one on the
+        # wrong register. A late reply only answers the wrong register once its device has moved on to the next one,
+        # so before a device which missed a reply moves on, the bus is drained until timeout past the deadline of the
+        # last request it was sent; a reply later than that can still be taken for the next register. The drain does
+        # not count against restart_timeout.
+        unanswered = {}
+        for device_addr, register in (request for request, msg in read_back.items() if msg is None):
+            unanswered.setdefault(device_addr, (device_addr, register))
+        if any(device_addr in missed and asked[device_addr] != request for device_addr, request in unanswered.items()):
+            drain_start = time.monotonic()
+            drain_replies(bus, round_start + 2 * timeout - drain_start)
+            deadline += time.monotonic() - drain_start
+            missed.clear()
+        time_left = deadline - time.monotonic()
+        if not unanswered or time_left <= 0:
+            break
+        for device_addr, request in unanswered.items():
+            if asked.get(device_addr) == request:
+                request_stats.count(device_addr, 'retries')
+        asked.update(unanswered)
+        round_start = time.monotonic()
+        replies, _ = _pipelined_read(bus, list(unanswered.values()), min(timeout, time_left))
+        read_back.update(replies)
+        missed.update(device_addr for (device_addr, _), msg in replies.items() if msg is None)
+    if missed:
+        drain_replies(bus, round_start + 2 * timeout - time.monotonic())
+    for device_addr, device_changes in changes.items():
+        config_cache.store(device_addr, {register: read_back[(device_addr, register)] for register in device_changes},
+                           generations[device_addr])
+
+    results = {}
+    for device_addr, device_changes in changes.items():
+        mismatched = {}
+        for register, value in device_changes.items():
+            actual = decode_register(register, read_back[(device_addr, register)])
+            if actual != value:
+                mismatched[register] = (value, actual)
+        results[device_addr] = ConfigResult(device_changes, mismatched)
+    return results
+
+
+# configure_encoders for a single encoder, returning its ConfigResult
+def configure_encoder(bus, settings, timeout=1, restart_timeout=2, device_addr=None):
+    if device_addr is None:
+        device_addr = DEVICE_ADDR
+    return configure_encoders(bus, {device_addr: settings}, timeout, restart_timeout)[device_addr]
+
+
 def connect_read_and_wait(register: Register, timeout=1, retries=0):
     # Built from example at https://python-can.readthedocs.io/en/v4.2.2/listeners.html
-    with can.Bus(interface='slcan', channel=COM_PORT, bitrate=250000) as bus:
+    with can.Bus(interface='slcan', channel=COM_PORT, bitrate=250000,
+                 can_filters=encoder_can_filters([DEVICE_ADDR])) as bus:
         response = None
         msg = send_read_and_wait(bus, register, timeout, retries)
         if msg is not None:
@@ -566,22 +995,36 @@ class State:
         self.baud_rate = None
         self.device_addr = None
 
-    def get_all(self, bus):
-        self.device_addr = get_device_addr(bus)
-        self.baud_rate = get_baud_rate(bus)
-        self.return_rate = get_return_rate(bus)
-        self.encoder_mode = get_encoder_mode(bus)
-        self.content_mode = get_content_mode(bus)
-        self.spin_dir = get_spin_dir(bus)
-        self.angular_vel_sample_period = get_angular_vel_sample_period(bus)
-        self.ang_val = get_ang_val(bus)
-        self.angular_vel = get_angular_vel(bus)
-        self.revolutions = get_revolutions(bus)
-        self.temperature = get_temperature(bus)
-        self.read_register = get_read_register(bus)
-        self.apply_settings_register = get_apply_settings_register(bus)
-        self.version_num_l = get_version_num_l(bus)
-        self.version_num_h = get_version_num_h(bus)
+    # Attribute for each register State tracks, in the order they are requested from the encoder
+    attributes = {
+        Register.DEVICE_ADDR: 'device_addr',
+        Register.BAUD_RATE: 'baud_rate',
+        Register.RETURN_RATE: 'return_rate',
+        Register.ENCODER_MODE: 'encoder_mode',
+        Register.CONTENT_MODE: 'content_mode',
+        Register.SPIN_DIR: 'spin_dir',
+        Register.ANGULAR_VEL_SAMPLE_PERIOD: 'angular_vel_sample_period',
+        Register.ANG_VAL: 'ang_val',
+        Register.ANGULAR_VEL: 'angular_vel',
+        Register.REVOLUTIONS: 'revolutions',
+        Register.TEMPERATURE: 'temperature',
+        Register.READ_REGISTER: 'read_register',
+        Register.APPLY_SETTINGS: 'apply_settings_register',
+        Register.VERSION_NUM_L: 'version_num_l',
+        Register.VERSION_NUM_H: 'version_num_h',
+    }
+
+    # Returns the registers which timed out.
+    # Configuration registers come from config_cache once they have been read, so repeated calls only read the live
+    # registers over the bus. refresh=True reads everything again.
+    def get_all(self, bus, timeout=1, device_addr=None, refresh=False):
+        return self.decode_all(send_cached_read_and_wait(bus, self.attributes, timeout, device_addr, refresh))
+
+    # Fills in the state from a {register: reply} mapping, returning the registers which had no reply
+    def decode_all(self, replies):
+        for register, msg in replies.items():
+            setattr(self, self.attributes[register], decode_register(register, msg))
+        return [register for register, msg in replies.items() if msg is None]
 
     def print_all(self):
         # Padding for each text block
@@ -604,7 +1047,7 @@ class State:
         print(
             f"{'current angle:':<{padding_2}} {f"{self.ang_val * 360 / 32768}°" if self.ang_val is not None else 'error'}")
         print(
-            f"{'current angular velocity:':<{padding_2}} {f"{self.angular_vel * 360 / 32768 / self.angular_vel_sample_period / 10e4}°/s" if self.angular_vel is not None and self.angular_vel_sample_period is not None else 'error'}")
+            f"{'current angular velocity:':<{padding_2}} {f"{self.angular_vel * 360 / 32768 / (self.angular_vel_sample_period * 1e-4)}°/s" if self.angular_vel is not None and self.angular_vel_sample_period is not None else 'error'}")
         print(
             f"{'current revolutions:':<{padding_2}} {f"{self.revolutions}" if self.revolutions is not None else 'error'}")
         print(
@@ -621,7 +1064,8 @@ class State:
 
 
 def print_all_info():
-    with can.Bus(interface='slcan', channel=COM_PORT, bitrate=250000) as bus:
+    with can.Bus(interface='slcan', channel=COM_PORT, bitrate=250000,
+                 can_filters=encoder_can_filters([DEVICE_ADDR])) as bus:
         state = State()
         state.get_all(bus)
         state.print_all()
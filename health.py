@@ -0,0 +1,230 @@
+"""
+Per encoder health statistics for the Python client: frame counts by type, frame rates, inter-arrival jitter, frames
+missing from the streams and request errors, with JSON and Prometheus text exports matching the C++ EncoderInterface's
+"""
+
+import json
+import time
+
+import can
+
+from get_register import request_stats
+
+# Histogram bucket i counts values in [2^(i-1), 2^i), bucket 0 counts 0 and the last bucket everything too large for
+# the others. Same layout as HEALTH_HISTOGRAM_BUCKETS in health_stats.hpp.
+HISTOGRAM_BUCKETS = 32
+
+# Weight of each new interval in the running mean and jitter, about the last 16 frames
+INTERVAL_SMOOTHING = 1 / 16
+
+# Frame types by their second byte, after the 0x55 every encoder frame starts with
+_ANGLE, _TEMPERATURE, _REPLY = 0x55, 0x56, 0x5F
+
+
+def _new_histogram():
+    return {'sum': 0, 'buckets': [0] * HISTOGRAM_BUCKETS}
+
+
+def _record(histogram, value):
+    histogram['buckets'][min(value.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+    histogram['sum'] += value
+
+
+class _Stream:
+    # Running stats of one kind of streamed frame from one encoder
+    __slots__ = ('frames', 'missed', 'mean_interval', 'jitter', 'interval_us', 'last_time')
+
+    def __init__(self):
+        self.frames = 0
+        self.missed = 0
+        self.mean_interval = 0.0
+        self.jitter = 0.0
+        self.interval_us = _new_histogram()
+        self.last_time = None
+
+    def record(self, timestamp, expected_period):
+        self.frames += 1
+        previous, self.last_time = self.last_time, timestamp
+        if previous is None or timestamp <= previous:
+            return
+
+        interval = timestamp - previous
+        _record(self.interval_us, int(interval * 1e6))
+        if self.mean_interval == 0:
+            self.mean_interval = interval
+        else:
+            self.jitter += (abs(interval - self.mean_interval) - self.jitter) * INTERVAL_SMOOTHING
+            self.mean_interval += (interval - self.mean_interval) * INTERVAL_SMOOTHING
+
+        if expected_period and interval > 1.5 * expected_period:
+            self.missed += round(interval / expected_period) - 1
+
+    def snapshot(self):
+        return {'frames': self.frames, 'missed': self.missed,
+                'rate': 1 / self.mean_interval if self.mean_interval > 0 else 0.0, 'jitter': self.jitter,
+                'interval_us': {'sum': self.interval_us['sum'], 'buckets': list(self.interval_us['buckets'])}}
+
+
+class _Encoder:
+    __slots__ = ('angle', 'temperature', 'replies', 'other_frames', 'invalid_length')
+
+    def __init__(self):
+        self.angle = _Stream()
+        self.temperature = _Stream()
+        self.replies = 0
+        self.other_frames = 0
+        self.invalid_length = 0
+
+
+class HealthMonitor(can.Listener):
+    # Keeps health statistics for every encoder whose frames it receives, when added to a can.Notifier (or fed
+    # directly through on_message_received).
+    #
+    # Frames are timed by msg.timestamp, so the interface's own timestamps are used where it has them. Gaps longer
+    # than one and a half periods of expected_rate (the encoders' RETURN_RATE in Hz) count as missed frames, None
+    # disables gap counting.
+    #
+    # If listeners are given, every frame is passed on to them and the time they take is recorded as the decode time
+    # per frame, e.g. HealthMonitor(listeners=[LatestValueCache()]) in place of the cache itself.
+    #
+    # Only the notifier thread updates the statistics and they take no lock, so a snapshot taken from another thread
+    # may be a frame behind on some counters.
+    def __init__(self, device_addrs=None, expected_rate=None, listeners=()):
+        self.device_addrs = None if device_addrs is None else set(device_addrs)
+        self.expected_period = 1 / expected_rate if expected_rate else None
+        self.listeners = list(listeners)
+        self._created = time.monotonic()
+        self._encoders = {}
+        self._unknown_frames = 0
+        self._decode_ns_per_frame = _new_histogram()
+
+    def set_expected_rate(self, expected_rate):
+        self.expected_period = 1 / expected_rate if expected_rate else None
+
+    def on_message_received(self, msg):
+        device_addr = msg.arbitration_id
+        encoder = self._encoders.get(device_addr)
+        if encoder is None:
+            if self.device_addrs is not None and device_addr not in self.device_addrs:
+                self._unknown_frames += 1
+                return
+            encoder = self._encoders[device_addr] = _Encoder()
+
+        data = msg.data
+        if len(data) != 8:
+            encoder.invalid_length += 1
+            return
+        frame_type = data[1] if data[0] == 0x55 else None
+        if frame_type == _ANGLE:
+            encoder.angle.record(msg.timestamp, self.expected_period)
+        elif frame_type == _TEMPERATURE:
+            encoder.temperature.record(msg.timestamp, self.expected_period)
+        elif frame_type == _REPLY:
+            encoder.replies += 1
+        else:
+            encoder.other_frames += 1
+
+        if self.listeners:
+            start = time.perf_counter_ns()
+            for listener in self.listeners:
+                listener.on_message_received(msg)
+            _record(self._decode_ns_per_frame, time.perf_counter_ns() - start)
+
+    def stop(self):
+        for listener in self.listeners:
+            listener.stop()
+
+    # Returns every statistic as plain dicts and lists, laid out like the C++ to_json export with the request
+    # counters of get_register.request_stats added to each encoder
+    def snapshot(self):
+        requests = request_stats.snapshot()
+        device_addrs = set(self._encoders) | set(requests) if self.device_addrs is None else self.device_addrs
+        encoders = {}
+        for device_addr in sorted(device_addrs):
+            encoder = self._encoders.get(device_addr) or _Encoder()
+            encoders[hex(device_addr)] = {
+                'angle': encoder.angle.snapshot(),
+                'temperature': encoder.temperature.snapshot(),
+                'replies': encoder.replies,
+                'other_frames': encoder.other_frames,
+                'invalid_length': encoder.invalid_length,
+                **requests.get(device_addr, dict.fromkeys(request_stats.KINDS, 0)),
+            }
+        return {'uptime': time.monotonic() - self._created, 'encoders': encoders,
+                'unknown_frames': self._unknown_frames,
+                'decode_ns_per_frame': {'sum': self._decode_ns_per_frame['sum'],
+                                        'buckets': list(self._decode_ns_per_frame['buckets'])}}
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self):
+        return to_prometheus(self.snapshot())
+
+
+def to_prometheus(snapshot):
+    # Formats a HealthMonitor snapshot in the Prometheus text exposition format, with the same metric names as the
+    # C++ to_prometheus so both can feed the same dashboards
+    lines = []
+    encoders = snapshot['encoders']
+    streams = ('angle', 'temperature')
+
+    def family(name, metric_type, description):
+        lines.append(f"# HELP umrt_encoder_{name} {description}")
+        lines.append(f"# TYPE umrt_encoder_{name} {metric_type}")
+
+    def sample(name, labels, value):
+        label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+        lines.append(f"umrt_encoder_{name}{{{label_text}}} {value}" if label_text else f"umrt_encoder_{name} {value}")
+
+    def histogram(name, labels, counts, unit):
+        cumulative = 0
+        for bucket, count in enumerate(counts['buckets'][:-1]):
+            cumulative += count
+            sample(f"{name}_bucket", {**labels, 'le': f"{unit * 2 ** bucket:g}"}, cumulative)
+        cumulative += counts['buckets'][-1]
+        sample(f"{name}_bucket", {**labels, 'le': '+Inf'}, cumulative)
+        sample(f"{name}_sum", labels, f"{counts['sum'] * unit:g}")
+        sample(f"{name}_count", labels, cumulative)
+
+    family('uptime_seconds', 'gauge', 'Seconds since the stats were created.')
+    sample('uptime_seconds', {}, f"{snapshot['uptime']:g}")
+
+    family('frames_total', 'counter', 'Frames received by type.')
+    for can_id, encoder in encoders.items():
+        for frame_type, frames in (('angle', encoder['angle']['frames']),
+                                   ('temperature', encoder['temperature']['frames']),
+                                   ('reply', encoder['replies']), ('other', encoder['other_frames']),
+                                   ('invalid_length', encoder['invalid_length'])):
+            sample('frames_total', {'can_id': can_id, 'type': frame_type}, frames)
+
+    for name, key, metric_type, description in (
+            ('missed_frames_total', 'missed', 'counter',
+             'Frames estimated missing from gaps in the stream longer than the expected period.'),
+            ('frame_rate_hertz', 'rate', 'gauge', 'Recent frame rate of the stream.'),
+            ('frame_jitter_seconds', 'jitter', 'gauge', 'Recent mean absolute deviation of the time between frames.')):
+        family(name, metric_type, description)
+        for can_id, encoder in encoders.items():
+            for stream in streams:
+                sample(name, {'can_id': can_id, 'stream': stream}, f"{encoder[stream][key]:g}")
+
+    family('frame_interval_seconds', 'histogram', 'Time between frames of the stream.')
+    for can_id, encoder in encoders.items():
+        for stream in streams:
+            histogram('frame_interval_seconds', {'can_id': can_id, 'stream': stream}, encoder[stream]['interval_us'],
+                      1e-6)
+
+    for kind, description in (('requests', 'Register read requests sent.'),
+                              ('retries', 'Register read requests re-sent after getting no reply.'),
+                              ('reply_timeouts', 'Register reads which got no reply in time.'),
+                              ('send_errors', 'Requests which could not be sent.')):
+        family(f"{kind}_total", 'counter', description)
+        for can_id, encoder in encoders.items():
+            sample(f"{kind}_total", {'can_id': can_id}, encoder[kind])
+
+    family('unknown_frames_total', 'counter', "Frames from CAN IDs other than the encoders'.")
+    sample('unknown_frames_total', {}, snapshot['unknown_frames'])
+
+    family('decode_seconds_per_frame', 'histogram', 'Listener time per frame.')
+    histogram('decode_seconds_per_frame', {}, snapshot['decode_ns_per_frame'], 1e-9)
+    return '\n'.join(lines) + '\n'
@@ -11,21 +11,57 @@
 #define ARM_ENCODER_DRIVER_ENCODER_INTERFACE_HPP
 #include <boost/log/trivial.hpp>
 #include <boost/signals2/signal.hpp>
+#include <atomic>
+#include <chrono>
+#include <cstddef>
 #include <cstdint>
 #include <cstdlib>
 #include <fcntl.h>
 #include <iostream>
 #include <linux/can.h>
 #include <linux/can/raw.h>
+#include <linux/errqueue.h>
+#include <linux/net_tstamp.h>
 #include <net/if.h>
+#include <poll.h>
 #include <cstring>
+#include <sys/eventfd.h>
 #include <sys/ioctl.h>
 #include <sys/socket.h>
+#include <ctime>
 #include <unistd.h>
 #include <stdexcept>
 #include <cerrno>
+#include <condition_variable>
 #include <unordered_set>
 #include <memory>
+#include <mutex>
+#include <thread>
+#include <vector>
+#include "health_stats.hpp"
+#include "latest_value_cache.hpp"
+#include "motion_estimator.hpp"
+#include "profiler.hpp"
+#include "sample_sink.hpp"
+#include "spsc_ring.hpp"
+
+/**
+ * Counters for @ref EncoderInterface::enable_decoupled_dispatch.
+ */
+struct DispatchStats {
+    /** frames waiting to be dispatched */
+    std::size_t queued = 0;
+    /** size of the ring */
+    std::size_t capacity = 0;
+    /** frames the read loop queued, including ones later overwritten */
+    std::uint64_t pushed = 0;
+    /** frames whose signals have been raised */
+    std::uint64_t dispatched = 0;
+    /** queued frames discarded under @ref OverflowPolicy::overwrite_oldest */
+    std::uint64_t overwritten = 0;
+    /** frames discarded under @ref OverflowPolicy::drop_newest */
+    std::uint64_t dropped = 0;
+};
 
 class EncoderInterface {
 public:
@@ -46,15 +82,140 @@ public:
 
     /**
      * Starts reading the encoder messages and raises boost signal events. 
+     * Frames are pulled from the socket in batches of up to @ref m_batch_size per recvmmsg call, see @ref set_batch_receive.
      */ 
     void begin_read_loop();
 
+    /**
+     * Configures how many frames @ref begin_read_loop pulls from the socket per system call. Must be called before @ref begin_read_loop.
+     * @param batch_size maximum number of frames per batch, 1 reads a single frame at a time.
+     * @param max_wait how long to wait for more frames once the first frame of a batch has arrived. With the default of zero a batch
+     * is whatever is already queued in the socket, so batching never adds latency; a non-zero wait trades up to max_wait of latency
+     * for fuller batches.
+     */
+    void set_batch_receive(std::size_t batch_size, std::chrono::microseconds max_wait = std::chrono::microseconds{0});
+
+    /**
+     * Decouples the signals from the socket: rather than raising them itself, @ref begin_read_loop queues every valid frame
+     * on a fixed-capacity lock-free ring, and they are raised by whichever thread drains it, either the one started by
+     * @ref start_dispatch_thread or the caller of @ref poll_dispatch. A slow slot then only fills the ring instead of stalling
+     * socket reads. Must be called before @ref begin_read_loop.
+     * @param capacity number of frames the ring holds, rounded up to a power of two.
+     * @param policy what to discard when the ring is full.
+     */
+    void enable_decoupled_dispatch(std::size_t capacity, OverflowPolicy policy = OverflowPolicy::overwrite_oldest);
+
+    /**
+     * Raises the signals for up to max_frames queued frames on the calling thread. Only one thread may drain the ring,
+     * so this must not be used alongside @ref start_dispatch_thread.
+     * @return number of frames dispatched
+     */
+    std::size_t poll_dispatch(std::size_t max_frames = SIZE_MAX);
+
+    /**
+     * @return an eventfd which becomes readable when frames are queued, for waiting on with poll/epoll before calling
+     * @ref poll_dispatch, or -1 if decoupled dispatch is not enabled.
+     */
+    int dispatch_fd() const;
+
+    /**
+     * Starts a thread which calls @ref poll_dispatch whenever frames are queued.
+     */
+    void start_dispatch_thread();
+
+    /**
+     * Stops the thread started by @ref start_dispatch_thread, frames still queued stay queued.
+     */
+    void stop_dispatch_thread();
+
+    /**
+     * @return counters for the ring, all zero if decoupled dispatch is not enabled.
+     */
+    DispatchStats dispatch_stats() const;
+
+    /**
+     * Enables @ref motion_signal: every encoder's position is run through an @ref AlphaBetaGammaFilter, timed by each frame's
+     * receive time on EncoderSample's steady clock (see @ref position_signal), giving velocity and acceleration at the full
+     * return rate without relying on the encoder's ANGULAR_VEL register. Must be called before @ref begin_read_loop.
+     * @param alpha position gain, see @ref AlphaBetaGammaFilter.
+     * @param beta velocity gain.
+     * @param gamma acceleration gain.
+     */
+    void enable_motion_estimation(double alpha = 0.2, double beta = 0.022, double gamma = 0.0012);
+
+    /**
+     * Copies out the most recent values received from an encoder, without waiting. The cache is updated by @ref begin_read_loop
+     * as frames arrive, before (and regardless of) signal dispatch, and can be read from any thread.
+     * @return false if can_id is not one of the encoders this interface listens to
+     */
+    bool latest_sample(std::uint32_t can_id, EncoderSample& sample) const;
+
+    /**
+     * Gets the most recent angle, angular velocity and revolutions of an encoder, reading its ANG_VAL register if the cached
+     * values are older than max_age. Blocks for at most timeout, and needs @ref begin_read_loop running on another thread.
+     *
+     * Register replies do not say which register they answer, so the register read needs exclusive use of the encoder's
+     * registers: a reply to anything else reading a register of the same encoder over the bus (such as the Python tools)
+     * that arrives while this read is waiting is taken as its value. Replies arriving after timeout are ignored, and only
+     * one read per encoder can be waiting at a time, so concurrent calls for the same encoder should be avoided.
+     * @return true if sample holds an angle no older than max_age or received since the register was requested, false if the
+     * read timed out (sample then holds the stale values) or can_id is not one of the encoders this interface listens to.
+     */
+    bool get_angle_sample(std::uint32_t can_id, EncoderSample::clock::duration max_age, EncoderSample& sample,
+                          std::chrono::milliseconds timeout = std::chrono::milliseconds{1000});
+
+    /**
+     * Like @ref get_angle_sample, for the temperature.
+     */
+    bool get_temperature_sample(std::uint32_t can_id, EncoderSample::clock::duration max_age, EncoderSample& sample,
+                                std::chrono::milliseconds timeout = std::chrono::milliseconds{1000});
+
+    /**
+     * Sets the RETURN_RATE the encoders are configured with, so gaps in their streams are counted as missed frames in
+     * @ref health_snapshot. Can be called from any thread.
+     * @param rate return rate in Hz, 0 to stop counting gaps.
+     */
+    void set_expected_rate(double rate);
+
+    /**
+     * Copies out the per encoder frame counts, rates, jitter, gaps and errors and the read loop's timings, from any thread.
+     * Pass the result to @ref to_prometheus or @ref to_json to export it.
+     */
+    HealthSnapshot health_snapshot() const;
+
+    /**
+     * Turns the timing probes around socket reads, filtering, decoding and every signal emit on or off, from any thread.
+     * The probes only exist if the library was built with UMRT_ENCODER_PROFILING, otherwise this just logs a warning;
+     * built in but turned off they cost a relaxed load and a branch each.
+     */
+    void set_profiling(bool enabled);
+
+    /**
+     * @return call counts and total, mean and maximum times of every probe since the last @ref reset_profile, from any thread.
+     */
+    std::vector<ProbeStats> profile_report() const;
+
+    /**
+     * Zeroes every probe, from any thread.
+     */
+    void reset_profile();
+
+    /**
+     * Hands every decoded angle and temperature frame to sink as an @ref AngleSample or @ref TemperatureSample, alongside
+     * the signals. One virtual call per frame with no lock and no slot list is much cheaper than the signals, which can
+     * then be left unconnected: signals without slots are not raised at all.
+     * Must be called before @ref begin_read_loop and @ref start_dispatch_thread.
+     * @param sink receives the samples on the thread raising the signals, not owned and must outlive the interface's use
+     * of it; nullptr removes it.
+     */
+    void set_sample_sink(SampleSink* sink);
+
   
     /**
      * <a href=https://www.boost.org/doc/libs/1_63_0/doc/html/signals.html>Boost signal</a> 
      * triggered by @ref handle_angle.
      */
-    boost::signals2::signal<void(std::uint32_t can_id, double angle, double angular_velocity, std::uint16_t number_of_rotations)> angle_signal;
+    boost::signals2::signal<void(std::uint32_t can_id, double angle, double angular_velocity, std::int16_t number_of_rotations)> angle_signal;
     /**
      * <a href=https://www.boost.org/doc/libs/1_63_0/doc/html/signals.html>Boost signal</a> 
      * triggered by @ref handle_temp.
@@ -69,12 +230,31 @@ public:
      * <a href=https://www.boost.org/doc/libs/1_63_0/doc/html/signals.html>Boost signal</a> 
      * triggered by @ref handle_temp. gives raw(unaltered) values
      */
-    boost::signals2::signal<void(std::uint32_t can_id, uint16_t temp_raw)> temp_signal_raw;
+    boost::signals2::signal<void(std::uint32_t can_id, std::int16_t temp_raw)> temp_signal_raw;
     /**
      * <a href=https://www.boost.org/doc/libs/1_63_0/doc/html/signals.html>Boost signal</a> 
      * triggered by @ref handle_angle. gives raw(unaltered) values
      */
-    boost::signals2::signal<void(std::uint32_t can_id, uint16_t angle_raw, uint16_t angular_velocity_raw, std::uint16_t number_of_rotations)> angle_signal_raw;
+    boost::signals2::signal<void(std::uint32_t can_id, uint16_t angle_raw, std::int16_t angular_velocity_raw, std::int16_t number_of_rotations)> angle_signal_raw;
+    /**
+     * <a href=https://www.boost.org/doc/libs/1_63_0/doc/html/signals.html>Boost signal</a> 
+     * triggered by @ref handle_angle with the encoder's continuous position: the angle plus every whole revolution turned since
+     * the first frame, unwrapped across the angle and revolution counter rolling over. time is when the frame was received:
+     * its kernel receive timestamp converted to EncoderSample's clock, or when its batch was read if it has none.
+     */
+    boost::signals2::signal<void(std::uint32_t can_id, double position_degrees, double position_radians, EncoderSample::clock::time_point time)> position_signal;
+    /**
+     * <a href=https://www.boost.org/doc/libs/1_63_0/doc/html/signals.html>Boost signal</a> 
+     * triggered by @ref handle_angle once @ref enable_motion_estimation has been called, with the filtered position (degrees),
+     * velocity (degrees per second) and acceleration (degrees per second squared) of the encoder.
+     */
+    boost::signals2::signal<void(std::uint32_t can_id, double position, double velocity, double acceleration, EncoderSample::clock::time_point time)> motion_signal;
+    /**
+     * <a href=https://www.boost.org/doc/libs/1_63_0/doc/html/signals.html>Boost signal</a> 
+     * triggered once per batch read by @ref begin_read_loop, with every valid encoder frame of the batch and the time each was received
+     * (the hardware timestamp if the CAN interface provides them, otherwise the kernel's software timestamp).
+     */
+    boost::signals2::signal<void(const can_frame* frames, const timespec* timestamps, std::size_t count)> batch_signal;
 
 private:
     ifreq ifr{};
@@ -85,6 +265,55 @@ private:
      */ 
     int can_socket = -1;
 
+    /**
+     * maximum number of frames read per recvmmsg call.
+     */
+    std::size_t m_batch_size = 32;
+
+    /**
+     * how long to wait for a batch to fill after its first frame arrives.
+     */
+    std::chrono::microseconds m_batch_max_wait{0};
+
+    /**
+     * a frame waiting in @ref m_ring.
+     */
+    struct QueuedFrame {
+        can_frame frame;
+        timespec timestamp;
+        EncoderSample::clock::time_point received_time;
+    };
+
+    /**
+     * frames waiting to be dispatched, only allocated by @ref enable_decoupled_dispatch.
+     */
+    std::unique_ptr<SpscRing<QueuedFrame>> m_ring{nullptr};
+
+    /**
+     * what the read loop does when @ref m_ring is full.
+     */
+    OverflowPolicy m_overflow_policy = OverflowPolicy::overwrite_oldest;
+
+    /**
+     * eventfd the read loop signals after queuing frames on @ref m_ring.
+     */
+    int m_dispatch_event = -1;
+
+    /**
+     * number of frames @ref poll_dispatch has raised signals for.
+     */
+    std::atomic<std::uint64_t> m_dispatched{0};
+
+    /**
+     * frames and timestamps drained from @ref m_ring by @ref poll_dispatch, kept to avoid reallocating them on every call.
+     */
+    std::vector<can_frame> m_dispatch_frames;
+    std::vector<timespec> m_dispatch_timestamps;
+    std::vector<EncoderSample::clock::time_point> m_dispatch_received_times;
+
+    std::thread m_dispatch_thread;
+    std::atomic<bool> m_dispatch_running{false};
+
     /**
      * device specified angular velocity sampling time.
      */ 
@@ -94,21 +323,168 @@ private:
      * unordered_set that contains the CAN IDs of encoders to listen to.  
      */ 
     std::shared_ptr<const std::unordered_set<uint32_t>>m_encoder_can_ids{nullptr}; 
+
+    /**
+     * latest sample from each of @ref m_encoder_can_ids.
+     */
+    std::unique_ptr<LatestValueCache> m_latest_values{nullptr};
+
+    /**
+     * health counters for each of @ref m_encoder_can_ids, updated by the read loop as frames arrive.
+     */
+    std::unique_ptr<HealthStats> m_health{nullptr};
+
+    /**
+     * timings of the probes placed with UMRT_PROFILE_SCOPE, see @ref set_profiling.
+     */
+    Profiler m_profiler;
+
+    /**
+     * see @ref set_sample_sink.
+     */
+    SampleSink* m_sample_sink = nullptr;
+
+    /**
+     * which signals have slots connected. Checking takes the signal's mutex, so it is refreshed once per batch by
+     * @ref dispatch rather than for every frame; slots connected part way through a batch are raised from the next one.
+     */
+    struct ConnectedSignals {
+        bool angle = false;
+        bool angle_raw = false;
+        bool position = false;
+        bool motion = false;
+        bool temp = false;
+        bool temp_raw = false;
+        bool verbose = false;
+        bool batch = false;
+    };
+    ConnectedSignals m_connected;
+
+    /**
+     * a read request waiting on its reply. register_address is published after deadline, so whoever takes it sees the
+     * deadline it was sent with.
+     */
+    struct PendingRead {
+        /** register read, or -1 if there is none */
+        std::atomic<int> register_address{-1};
+        /** time_since_epoch of the time the reply has to arrive by */
+        std::atomic<EncoderSample::clock::rep> deadline{0};
+    };
+
+    /**
+     * per encoder, the read request waiting on a reply. Register replies do not say which register they answer, so this
+     * is how the read loop knows what to update; the first reply within the deadline is taken, anything later is ignored.
+     */
+    std::unordered_map<std::uint32_t, PendingRead> m_pending_reads;
+
+    /**
+     * notified by @ref notify_sample_waiters after every batch the read loop decodes into @ref m_latest_values, so
+     * @ref get_sample wakes as soon as its reply is in. m_sample_waiters counts the waiting threads, letting the read
+     * loop skip the mutex while there are none.
+     */
+    std::mutex m_sample_mutex;
+    std::condition_variable m_sample_updated;
+    std::atomic<int> m_sample_waiters{0};
+
+    /**
+     * what @ref handle_angle needs to unwrap an encoder's position.
+     */
+    struct PositionState {
+        bool initialized = false;
+        std::uint16_t last_angle = 0;
+        std::int16_t last_revolutions = 0;
+        /** position in angle register counts, 32768 per revolution */
+        std::int64_t position = 0;
+    };
+
+    /**
+     * unwrapping state for each of @ref m_encoder_can_ids, created up front so no frame allocates.
+     */
+    std::unordered_map<std::uint32_t, PositionState> m_positions;
+
+    /**
+     * velocity and acceleration estimator for each of @ref m_encoder_can_ids, empty unless @ref enable_motion_estimation was called.
+     */
+    std::unordered_map<std::uint32_t, AlphaBetaGammaFilter> m_motion_filters;
+
+    /**
+     * whether the socket's CAN_RAW_FILTER only lets frames from @ref m_encoder_can_ids through,
+     * if not they are filtered in @ref begin_read_loop instead.
+     */
+    bool m_kernel_filtering = false;
+
+    /**
+     * installs a CAN_RAW_FILTER on the socket for each of @ref m_encoder_can_ids, so the kernel drops
+     * frames from any other device before they ever wake the read loop.
+     */
+    void apply_can_filters();
+
+    /**
+     * asks the kernel to attach hardware and software receive timestamps to every frame.
+     */
+    void enable_timestamps();
+
+    /**
+     * reads up to capacity frames into headers, blocking until at least one arrives and then waiting at most @ref m_batch_max_wait for more.
+     * @return number of frames read
+     */
+    std::size_t receive_batch(mmsghdr* headers, std::size_t capacity);
+
+    /**
+     * extracts the receive timestamp from a frame's control messages, falling back to the current time if there is none.
+     * @param software_timestamp set to the kernel's CLOCK_REALTIME software timestamp, left untouched if there is none
+     */
+    static timespec frame_timestamp(msghdr* header, timespec& software_timestamp);
+
+    /**
+     * decodes an angle, temperature or register reply frame into @ref m_latest_values.
+     */
+    void update_latest_values(const can_frame& message, EncoderSample::clock::time_point received_time);
+
+    /**
+     * wakes any @ref get_sample waiting on @ref m_latest_values, after a batch has been decoded into it.
+     */
+    void notify_sample_waiters();
+
+    /**
+     * sends a register read request to an encoder and records it in @ref m_pending_reads.
+     * @param deadline when to stop accepting a reply as this register's value
+     * @return false if the request could not be sent
+     */
+    bool send_read_request(std::uint32_t can_id, std::uint8_t register_address, EncoderSample::clock::time_point deadline);
+
+    /**
+     * shared implementation of @ref get_angle_sample and @ref get_temperature_sample, sample_time being the field of
+     * @ref EncoderSample which register_address updates.
+     */
+    bool get_sample(std::uint32_t can_id, std::uint8_t register_address, EncoderSample::clock::time_point EncoderSample::*sample_time,
+                    EncoderSample::clock::duration max_age, EncoderSample& sample, std::chrono::milliseconds timeout);
+
+    /**
+     * raises the signals for count frames: @ref handle_angle, @ref handle_temp and @ref handle_all for each frame,
+     * then @ref batch_signal once for all of them. Signals without slots are skipped, see @ref m_connected.
+     */
+    void dispatch(const can_frame* frames, const timespec* timestamps, const EncoderSample::clock::time_point* received_times, std::size_t count);
+
     /**
      * listens to encoder position related messages (number of rotations, anglular velocity, current angle)
-     * triggers @ref angle_signal  and @ref angle_signal_raw
+     * triggers @ref angle_signal, @ref angle_signal_raw and @ref position_signal, and the sample sink
      * @param message array pointer to 8-byte CAN massage
      * @param can_id CAN ID of spefic encoder 
+     * @param received_time when the frame was received, see @ref position_signal
+     * @param timestamp the frame's receive timestamp, see @ref batch_signal
      */ 
-    void handle_angle(const std::uint8_t* message_data, const std::uint32_t can_id);
+    void handle_angle(const std::uint8_t* message_data, const std::uint32_t can_id, EncoderSample::clock::time_point received_time, const timespec& timestamp);
 
     /**
      * listens to encoder temperature values
-     * triggers @ref temp_signal  and @ref temp_signal_raw 
+     * triggers @ref temp_signal  and @ref temp_signal_raw, and the sample sink
      * @param message array pointer to 8-byte CAN massage
      * @param can_id CAN ID of spefic encoder 
+     * @param received_time when the frame was received, see @ref position_signal
+     * @param timestamp the frame's receive timestamp, see @ref batch_signal
      */
-    void handle_temp(const std::uint8_t* message_data, const std::uint32_t can_id);
+    void handle_temp(const std::uint8_t* message_data, const std::uint32_t can_id, EncoderSample::clock::time_point received_time, const timespec& timestamp);
 
     /**
      * listens to all encoder messages for debug purposes
@@ -0,0 +1,222 @@
+/**
+ * @file
+ * Class declaration for HealthStats, per encoder frame, gap and error counters kept by EncoderInterface, and their
+ * Prometheus and JSON exports.
+ */
+
+#ifndef ARM_ENCODER_DRIVER_HEALTH_STATS_HPP
+#define ARM_ENCODER_DRIVER_HEALTH_STATS_HPP
+#include <array>
+#include <atomic>
+#include <chrono>
+#include <cstddef>
+#include <cstdint>
+#include <ctime>
+#include <linux/can.h>
+#include <memory>
+#include <string>
+#include <unordered_map>
+#include <unordered_set>
+#include <vector>
+
+/**
+ * Number of buckets in every histogram. Bucket 0 counts values of 0, bucket i counts values in [2^(i-1), 2^i), and the
+ * last bucket also counts everything larger.
+ */
+constexpr std::size_t HEALTH_HISTOGRAM_BUCKETS = 32;
+
+/**
+ * Copy of a histogram, see @ref HEALTH_HISTOGRAM_BUCKETS.
+ */
+struct HealthHistogram {
+    std::array<std::uint64_t, HEALTH_HISTOGRAM_BUCKETS> buckets{};
+    /** sum of every recorded value */
+    std::uint64_t sum = 0;
+};
+
+/**
+ * Health of one kind of streamed frame (angle or temperature) from one encoder.
+ */
+struct StreamHealth {
+    /** frames received */
+    std::uint64_t frames = 0;
+    /** frames estimated missing from gaps longer than the expected period, see @ref HealthStats::set_expected_rate */
+    std::uint64_t missed = 0;
+    /** recent frame rate in Hz, 0 until two frames have been received */
+    double rate = 0;
+    /** recent mean absolute deviation of the time between frames from its mean, in seconds */
+    double jitter = 0;
+    /** time between frames in microseconds */
+    HealthHistogram interval_us{};
+};
+
+/**
+ * Health of one encoder.
+ */
+struct EncoderHealth {
+    std::uint32_t can_id = 0;
+    /** 55 55 frames */
+    StreamHealth angle;
+    /** 55 56 frames */
+    StreamHealth temperature;
+    /** 55 5F register replies */
+    std::uint64_t replies = 0;
+    /** 8 byte frames of any other type */
+    std::uint64_t other_frames = 0;
+    /** frames which were not 8 bytes long */
+    std::uint64_t invalid_length = 0;
+    /** register reads which got no reply in time */
+    std::uint64_t reply_timeouts = 0;
+    /** requests which could not be written to the socket */
+    std::uint64_t send_errors = 0;
+};
+
+/**
+ * Copy of every counter in a @ref HealthStats, taken by @ref HealthStats::snapshot.
+ */
+struct HealthSnapshot {
+    /** seconds since the stats were created */
+    double uptime = 0;
+    /** one entry per encoder, in ascending CAN ID order */
+    std::vector<EncoderHealth> encoders;
+    /** frames from CAN IDs other than the encoders', only counted when filtering happens in user space */
+    std::uint64_t unknown_frames = 0;
+    /** batches read from the socket */
+    std::uint64_t batches = 0;
+    /** time the read loop spent decoding each frame of a batch, in nanoseconds, one sample per batch */
+    HealthHistogram decode_ns_per_frame{};
+    /** time spent raising signals for each frame of a batch, in nanoseconds, one sample per batch */
+    HealthHistogram dispatch_ns_per_frame{};
+};
+
+/**
+ * Health counters for a fixed set of encoders.
+ *
+ * Frame counters are written by the read loop only, and dispatch counters by whichever single thread raises signals,
+ * so they are updated with plain relaxed loads and stores instead of locked read-modify-writes: a frame costs a hash
+ * lookup, a handful of stores and no extra clock reads. Error counters can be bumped from any thread. Any thread can
+ * take a @ref snapshot, which may be a frame or so behind on some counters but never tears a value.
+ */
+class HealthStats {
+public:
+    using clock = std::chrono::steady_clock;
+
+    /**
+     * @param can_ids CAN IDs to keep stats for, fixed for the lifetime of the stats so lookups need no lock.
+     */
+    explicit HealthStats(const std::unordered_set<std::uint32_t>& can_ids);
+
+    /**
+     * Sets the RETURN_RATE the encoders are configured with, which gaps in their streams are measured against.
+     * A gap counts as missed frames once it is more than one and a half periods long. 0, the default, disables gap
+     * counting.
+     */
+    void set_expected_rate(double rate);
+
+    /**
+     * Counts a valid 8 byte frame received at timestamp, from the read loop only.
+     */
+    void record_frame(const can_frame& frame, const timespec& timestamp);
+
+    /**
+     * Counts a frame of the wrong length, from the read loop only.
+     */
+    void record_invalid_length(std::uint32_t can_id);
+
+    /**
+     * Counts a frame from an unknown CAN ID, from the read loop only.
+     */
+    void record_unknown_frame();
+
+    /**
+     * Records how long the read loop took over a batch of frames, from the read loop only.
+     */
+    void record_decode(std::chrono::nanoseconds elapsed, std::size_t frames);
+
+    /**
+     * Records how long raising signals for a batch of frames took, from the dispatching thread only.
+     */
+    void record_dispatch(std::chrono::nanoseconds elapsed, std::size_t frames);
+
+    /**
+     * Counts a register read which was not answered in time, from any thread.
+     */
+    void record_reply_timeout(std::uint32_t can_id);
+
+    /**
+     * Counts a request which could not be sent, from any thread.
+     */
+    void record_send_error(std::uint32_t can_id);
+
+    /**
+     * Copies out every counter, from any thread.
+     */
+    HealthSnapshot snapshot() const;
+
+private:
+    /**
+     * single writer histogram.
+     */
+    struct Histogram {
+        std::array<std::atomic<std::uint64_t>, HEALTH_HISTOGRAM_BUCKETS> buckets{};
+        std::atomic<std::uint64_t> sum{0};
+
+        void record(std::uint64_t value);
+        HealthHistogram copy() const;
+    };
+
+    /**
+     * live counters behind a @ref StreamHealth.
+     */
+    struct Stream {
+        std::atomic<std::uint64_t> frames{0};
+        std::atomic<std::uint64_t> missed{0};
+        /** exponentially weighted mean and mean absolute deviation of the time between frames, in seconds */
+        std::atomic<double> mean_interval{0};
+        std::atomic<double> jitter{0};
+        Histogram interval_us;
+        /** receive timestamp of the last frame in nanoseconds, 0 before the first */
+        std::int64_t last_time = 0;
+
+        void record(std::int64_t time, double expected_period);
+    };
+
+    /**
+     * live counters behind an @ref EncoderHealth.
+     */
+    struct alignas(64) Encoder {
+        Stream angle;
+        Stream temperature;
+        std::atomic<std::uint64_t> replies{0};
+        std::atomic<std::uint64_t> other_frames{0};
+        std::atomic<std::uint64_t> invalid_length{0};
+        std::atomic<std::uint64_t> reply_timeouts{0};
+        std::atomic<std::uint64_t> send_errors{0};
+    };
+
+    Encoder* find(std::uint32_t can_id);
+
+    clock::time_point m_created = clock::now();
+    std::atomic<double> m_expected_period{0};
+    /**
+     * one entry per CAN ID, never modified after construction.
+     */
+    std::unordered_map<std::uint32_t, std::unique_ptr<Encoder>> m_encoders;
+    std::atomic<std::uint64_t> m_unknown_frames{0};
+    std::atomic<std::uint64_t> m_batches{0};
+    Histogram m_decode_ns_per_frame;
+    Histogram m_dispatch_ns_per_frame;
+};
+
+/**
+ * Formats a snapshot in the Prometheus text exposition format, every metric prefixed with umrt_encoder_ and labelled
+ * with the encoder's CAN ID. Histograms are exported as cumulative buckets with power of two upper bounds.
+ */
+std::string to_prometheus(const HealthSnapshot& snapshot);
+
+/**
+ * Formats a snapshot as a single JSON object, histograms as arrays of bucket counts.
+ */
+std::string to_json(const HealthSnapshot& snapshot);
+
+#endif //ARM_ENCODER_DRIVER_HEALTH_STATS_HPP
@@ -0,0 +1,111 @@
+/**
+ * @file
+ * Class declaration for LatestValueCache, which holds the most recent sample from every encoder for lock-free reads.
+ */
+
+#ifndef ARM_ENCODER_DRIVER_LATEST_VALUE_CACHE_HPP
+#define ARM_ENCODER_DRIVER_LATEST_VALUE_CACHE_HPP
+#include <atomic>
+#include <chrono>
+#include <cstdint>
+#include <memory>
+#include <unordered_map>
+#include <unordered_set>
+
+/**
+ * The most recent values received from one encoder.
+ */
+struct EncoderSample {
+    using clock = std::chrono::steady_clock;
+
+    /** angle within the current revolution in degrees */
+    double angle = 0;
+    /** angular velocity in degrees per second */
+    double angular_velocity = 0;
+    /** number of revolutions */
+    std::int16_t revolutions = 0;
+    /** when the angle, velocity and revolutions were received, the clock's epoch if they never have been */
+    clock::time_point angle_time{};
+    /** temperature in degrees Celsius */
+    double temperature = 0;
+    /** when the temperature was received, the clock's epoch if it never has been */
+    clock::time_point temperature_time{};
+
+    /**
+     * @return how long ago the angle was received, or the maximum duration if it never has been.
+     */
+    clock::duration angle_age(clock::time_point now = clock::now()) const {
+        return angle_time == clock::time_point{} ? clock::duration::max() : now - angle_time;
+    }
+
+    /**
+     * @return how long ago the temperature was received, or the maximum duration if it never has been.
+     */
+    clock::duration temperature_age(clock::time_point now = clock::now()) const {
+        return temperature_time == clock::time_point{} ? clock::duration::max() : now - temperature_time;
+    }
+};
+
+/**
+ * Latest @ref EncoderSample for each of a fixed set of CAN IDs.
+ * Each CAN ID has one writer (the read loop) and any number of readers, guarded by a seqlock: writers never wait and
+ * readers never block the writer, they just retry if an update happened while they were copying.
+ */
+class LatestValueCache {
+public:
+    using clock = EncoderSample::clock;
+
+    /**
+     * @param can_ids CAN IDs to hold samples for, fixed for the lifetime of the cache so lookups need no lock.
+     */
+    explicit LatestValueCache(const std::unordered_set<std::uint32_t>& can_ids);
+
+    /**
+     * Stores a new angle sample, from the writer thread only. Ignored for CAN IDs the cache was not created with.
+     */
+    void update_angle(std::uint32_t can_id, double angle, double angular_velocity, std::int16_t revolutions, clock::time_point time);
+
+    /**
+     * Stores a new temperature sample, from the writer thread only. Ignored for CAN IDs the cache was not created with.
+     */
+    void update_temperature(std::uint32_t can_id, double temperature, clock::time_point time);
+
+    /**
+     * Copies out the latest sample for can_id, from any thread.
+     * @return false if the cache was not created with can_id
+     */
+    bool read(std::uint32_t can_id, EncoderSample& sample) const;
+
+private:
+    /**
+     * one encoder's sample. The fields are relaxed atomics so copying them while they are being written is not a data
+     * race, the sequence number is what makes a copy consistent.
+     */
+    struct alignas(64) Slot {
+        /** odd while an update is in progress */
+        std::atomic<std::uint32_t> sequence{0};
+        std::atomic<double> angle{0};
+        std::atomic<double> angular_velocity{0};
+        std::atomic<std::int16_t> revolutions{0};
+        std::atomic<clock::rep> angle_time{0};
+        std::atomic<double> temperature{0};
+        std::atomic<clock::rep> temperature_time{0};
+    };
+
+    /**
+     * makes the slot's sequence number odd, call before writing its fields.
+     */
+    static void begin_write(Slot& slot);
+
+    /**
+     * makes the slot's sequence number even again, call after writing its fields.
+     */
+    static void end_write(Slot& slot);
+
+    /**
+     * one slot per CAN ID, never modified after construction.
+     */
+    std::unordered_map<std::uint32_t, std::unique_ptr<Slot>> m_slots;
+};
+
+#endif //ARM_ENCODER_DRIVER_LATEST_VALUE_CACHE_HPP
@@ -0,0 +1,58 @@
+/**
+ * @file
+ * Class declaration for AlphaBetaGammaFilter, which estimates velocity and acceleration from timestamped positions.
+ */
+
+#ifndef ARM_ENCODER_DRIVER_MOTION_ESTIMATOR_HPP
+#define ARM_ENCODER_DRIVER_MOTION_ESTIMATOR_HPP
+
+/**
+ * Alpha-beta-gamma filter tracking position, velocity and acceleration from position measurements at irregular times.
+ * Each update is constant work: predict from the last estimate, then correct by the residual scaled by alpha, beta and
+ * gamma. Higher gains follow changes faster but pass through more of the measurement noise.
+ *
+ * Unlike the encoder's own ANGULAR_VEL register this works at any return rate, with no sample period to overflow, and
+ * lags by a fraction of one frame rather than a whole sample period.
+ */
+class AlphaBetaGammaFilter {
+public:
+    /**
+     * The default beta and gamma follow the usual steady-state relations for alpha = 0.2
+     * (beta = 2(2 - alpha) - 4 sqrt(1 - alpha), gamma = beta^2 / (2 alpha)), low enough gains that at 1-2 kHz the
+     * acceleration estimate is not swamped by the angle register's quantisation.
+     * @param alpha position gain, 0 to 1.
+     * @param beta velocity gain, 0 to 2.
+     * @param gamma acceleration gain.
+     * @param max_gap seconds without a measurement after which the filter starts over rather than extrapolating across the gap.
+     */
+    explicit AlphaBetaGammaFilter(double alpha = 0.2, double beta = 0.022, double gamma = 0.0012, double max_gap = 0.5);
+
+    /**
+     * Feeds in a position measured at time (in seconds, on a monotonic clock such as std::chrono::steady_clock; a clock
+     * stepping backwards or jumping ahead makes the filter start over).
+     */
+    void update(double measurement, double time);
+
+    /**
+     * Forgets the current estimate, the next measurement starts the filter over.
+     */
+    void reset();
+
+    double position() const { return m_position; }
+    double velocity() const { return m_velocity; }
+    double acceleration() const { return m_acceleration; }
+
+private:
+    double m_alpha;
+    double m_beta;
+    double m_gamma;
+    double m_max_gap;
+
+    bool m_initialized = false;
+    double m_time = 0;
+    double m_position = 0;
+    double m_velocity = 0;
+    double m_acceleration = 0;
+};
+
+#endif //ARM_ENCODER_DRIVER_MOTION_ESTIMATOR_HPP
@@ -0,0 +1,140 @@
+/**
+ * @file
+ * Timing probes for EncoderInterface's read loop and signal dispatch.
+ *
+ * Probes are only compiled in when UMRT_ENCODER_PROFILING is defined (the CMake option of the same name), otherwise
+ * @ref UMRT_PROFILE_SCOPE expands to nothing and costs nothing. Compiled in, they are still off until
+ * @ref Profiler::set_enabled turns them on, and cost one relaxed load and a predictable branch each while off.
+ */
+
+#ifndef ARM_ENCODER_DRIVER_PROFILER_HPP
+#define ARM_ENCODER_DRIVER_PROFILER_HPP
+#include <array>
+#include <atomic>
+#include <chrono>
+#include <cstddef>
+#include <cstdint>
+#include <vector>
+
+/**
+ * Points in EncoderInterface that can be timed.
+ */
+enum class Probe : std::size_t {
+    /** recvmmsg and waiting for the rest of a batch, per batch. Includes blocking for the first frame, so on a quiet
+     * bus this is mostly idle time */
+    receive,
+    /** ID filtering, length checks, timestamp extraction and @ref update_latest, per batch */
+    filter,
+    /** updating the latest value cache, per frame */
+    update_latest,
+    /** decoding a 55 55 frame, per angle frame */
+    decode_angle,
+    /** unwrapping the position, per angle frame */
+    unwrap_position,
+    /** updating the motion filter, per angle frame once motion estimation is enabled */
+    estimate_motion,
+    /** decoding a 55 56 frame, per temperature frame */
+    decode_temp,
+    /** each signal emit, per frame it is raised for */
+    emit_angle_signal,
+    emit_angle_signal_raw,
+    emit_position_signal,
+    emit_motion_signal,
+    emit_temp_signal,
+    emit_temp_signal_raw,
+    emit_verbose_signal,
+    /** the sample sink, per angle and temperature frame */
+    emit_sample_sink,
+    /** batch_signal, per batch */
+    emit_batch_signal,
+    count,
+};
+
+/**
+ * Aggregated timings of one probe.
+ */
+struct ProbeStats {
+    const char* name = "";
+    std::uint64_t calls = 0;
+    std::uint64_t total_ns = 0;
+    std::uint64_t max_ns = 0;
+
+    double mean_ns() const { return calls == 0 ? 0.0 : static_cast<double>(total_ns) / static_cast<double>(calls); }
+};
+
+/**
+ * Per probe call counts and times. Each probe must only be hit from one thread at a time (the read loop or the
+ * dispatching thread), so recording is plain relaxed loads and stores; @ref report and @ref reset can be called from any
+ * thread.
+ */
+class Profiler {
+public:
+    using clock = std::chrono::steady_clock;
+
+    void set_enabled(bool enabled) { m_enabled.store(enabled, std::memory_order_relaxed); }
+
+    bool enabled() const { return m_enabled.load(std::memory_order_relaxed); }
+
+    void record(Probe probe, clock::duration elapsed);
+
+    /**
+     * @return stats for every probe, in @ref Probe order
+     */
+    std::vector<ProbeStats> report() const;
+
+    /**
+     * Zeroes every probe. Counts recorded concurrently with a reset may survive it.
+     */
+    void reset();
+
+private:
+    struct alignas(64) Counters {
+        std::atomic<std::uint64_t> calls{0};
+        std::atomic<std::uint64_t> total_ns{0};
+        std::atomic<std::uint64_t> max_ns{0};
+    };
+
+    std::atomic<bool> m_enabled{false};
+    std::array<Counters, static_cast<std::size_t>(Probe::count)> m_counters{};
+};
+
+/**
+ * Times the enclosing scope into a @ref Profiler if it is enabled, use through @ref UMRT_PROFILE_SCOPE.
+ */
+class ProfileScope {
+public:
+    ProfileScope(Profiler& profiler, Probe probe)
+        : m_profiler(profiler.enabled() ? &profiler : nullptr), m_probe(probe) {
+        if (m_profiler) {
+            m_start = Profiler::clock::now();
+        }
+    }
+
+    ~ProfileScope() {
+        if (m_profiler) {
+            m_profiler->record(m_probe, Profiler::clock::now() - m_start);
+        }
+    }
+
+    ProfileScope(const ProfileScope&) = delete;
+    ProfileScope& operator=(const ProfileScope&) = delete;
+
+private:
+    Profiler* m_profiler;
+    Probe m_probe;
+    Profiler::clock::time_point m_start{};
+};
+
+#define UMRT_PROFILE_CONCAT_INNER(a, b) a##b
+#define UMRT_PROFILE_CONCAT(a, b) UMRT_PROFILE_CONCAT_INNER(a, b)
+
+#ifdef UMRT_ENCODER_PROFILING
+/**
+ * Times the rest of the enclosing scope as probe, see @ref Profiler.
+ */
+#define UMRT_PROFILE_SCOPE(profiler, probe) ProfileScope UMRT_PROFILE_CONCAT(umrt_profile_scope_, __LINE__)((profiler), (probe))
+#else
+#define UMRT_PROFILE_SCOPE(profiler, probe) static_cast<void>(0)
+#endif
+
+#endif //ARM_ENCODER_DRIVER_PROFILER_HPP
@@ -0,0 +1,100 @@
+/**
+ * @file
+ * Decoded sample structs and the SampleSink interface, the lightweight alternative to EncoderInterface's Boost signals.
+ */
+
+#ifndef ARM_ENCODER_DRIVER_SAMPLE_SINK_HPP
+#define ARM_ENCODER_DRIVER_SAMPLE_SINK_HPP
+#include <cstdint>
+#include <ctime>
+#include <type_traits>
+#include <utility>
+#include "latest_value_cache.hpp"
+
+/**
+ * Everything decoded from one 55 55 frame.
+ */
+struct AngleSample {
+    std::uint32_t can_id;
+    /** raw register values */
+    std::uint16_t angle_raw;
+    std::int16_t angular_velocity_raw;
+    std::int16_t revolutions;
+    /** angle within the current revolution in degrees */
+    double angle;
+    /** angular velocity in degrees per second */
+    double angular_velocity;
+    /** continuous position in degrees, as raised by position_signal */
+    double position;
+    /** receive timestamp of the frame, see batch_signal */
+    timespec timestamp;
+    /** when the frame was received, on EncoderSample's clock, see position_signal */
+    EncoderSample::clock::time_point received_time;
+};
+
+/**
+ * Everything decoded from one 55 56 frame.
+ */
+struct TemperatureSample {
+    std::uint32_t can_id;
+    std::int16_t temperature_raw;
+    /** degrees Celsius */
+    double temperature;
+    /** receive timestamp of the frame, see batch_signal */
+    timespec timestamp;
+    /** when the frame was received, on EncoderSample's clock, see position_signal */
+    EncoderSample::clock::time_point received_time;
+};
+
+static_assert(std::is_trivially_copyable_v<AngleSample> && std::is_trivially_copyable_v<TemperatureSample>,
+              "samples are plain data so sinks can copy them anywhere");
+
+/**
+ * Receives one decoded sample per frame from @ref EncoderInterface::set_sample_sink, on the thread raising the signals.
+ * Unlike a signal this is a single virtual call with no lock and no slot list, so overrides should be just as cheap:
+ * copy the sample somewhere and return.
+ */
+class SampleSink {
+public:
+    virtual ~SampleSink() = default;
+
+    virtual void on_angle(const AngleSample&) {}
+
+    virtual void on_temperature(const TemperatureSample&) {}
+};
+
+/**
+ * @ref SampleSink calling handler with every sample it can be called with, so a lambda taking an AngleSample, a
+ * TemperatureSample or (with an auto parameter) both is enough. The handler is a template parameter rather than a
+ * std::function, so the call can be inlined into the sink.
+ */
+template <typename Handler>
+class HandlerSink final : public SampleSink {
+public:
+    explicit HandlerSink(Handler handler): m_handler(std::move(handler)) {}
+
+    void on_angle(const AngleSample& sample) override {
+        if constexpr (std::is_invocable_v<Handler&, const AngleSample&>) {
+            m_handler(sample);
+        }
+    }
+
+    void on_temperature(const TemperatureSample& sample) override {
+        if constexpr (std::is_invocable_v<Handler&, const TemperatureSample&>) {
+            m_handler(sample);
+        }
+    }
+
+private:
+    Handler m_handler;
+};
+
+/**
+ * @return a @ref HandlerSink wrapping handler
+ */
+template <typename Handler>
+HandlerSink<Handler> make_sample_sink(Handler handler) {
+    return HandlerSink<Handler>(std::move(handler));
+}
+
+#endif //ARM_ENCODER_DRIVER_SAMPLE_SINK_HPP
@@ -0,0 +1,169 @@
+/**
+ * @file
+ * Fixed-capacity lock-free single-producer single-consumer ring buffer, used by EncoderInterface to hand frames from
+ * the CAN reader thread to the thread raising its signals.
+ */
+
+#ifndef ARM_ENCODER_DRIVER_SPSC_RING_HPP
+#define ARM_ENCODER_DRIVER_SPSC_RING_HPP
+#include <array>
+#include <atomic>
+#include <cstddef>
+#include <cstdint>
+#include <cstring>
+#include <memory>
+#include <stdexcept>
+#include <type_traits>
+
+/**
+ * What @ref SpscRing::push does when the ring is full.
+ */
+enum class OverflowPolicy {
+    /** discard the oldest queued item to make room, so consumers always see the most recent data */
+    overwrite_oldest,
+    /** discard the item being pushed, so nothing already queued is lost */
+    drop_newest,
+};
+
+/**
+ * Bounded ring buffer for exactly one producer thread and one consumer thread, neither of which ever blocks or takes a lock.
+ *
+ * With @ref OverflowPolicy::overwrite_oldest the producer may overwrite the slot the consumer is copying out of. Slots are
+ * therefore held as relaxed atomic words rather than as T, so that copy is a torn read (which @ref pop discards) instead of
+ * a data race.
+ * @tparam T queued item, must be trivially copyable since it is copied in and out of the slots word by word
+ */
+template <typename T>
+class SpscRing {
+    static_assert(std::is_trivially_copyable_v<T>, "SpscRing items must be trivially copyable");
+    static_assert(std::atomic<std::uint64_t>::is_always_lock_free, "SpscRing slots need lock-free 64-bit atomics");
+
+public:
+    /**
+     * @param capacity number of items the ring holds, rounded up to a power of two.
+     */
+    explicit SpscRing(std::size_t capacity) {
+        if (capacity == 0) {
+            throw std::invalid_argument("[x] ring capacity must be at least 1");
+        }
+        std::size_t rounded = 1;
+        while (rounded < capacity) {
+            rounded <<= 1;
+        }
+        m_slots = std::make_unique<Slot[]>(rounded);
+        m_mask = rounded - 1;
+    }
+
+    /**
+     * Queues item, producer thread only.
+     * @return false if the ring was full and the policy was @ref OverflowPolicy::drop_newest
+     */
+    bool push(const T& item, OverflowPolicy policy) {
+        const std::size_t tail = m_tail.load(std::memory_order_relaxed);
+        std::size_t head = m_head.load(std::memory_order_acquire);
+        if (tail - head == capacity()) {
+            if (policy == OverflowPolicy::drop_newest) {
+                m_dropped.fetch_add(1, std::memory_order_relaxed);
+                return false;
+            }
+            // Take the oldest item away from the consumer, if the consumer popped it first its slot is free anyway
+            if (m_head.compare_exchange_strong(head, head + 1, std::memory_order_acq_rel)) {
+                m_overwritten.fetch_add(1, std::memory_order_relaxed);
+            }
+        }
+        store(m_slots[tail & m_mask], item);
+        m_tail.store(tail + 1, std::memory_order_release);
+        return true;
+    }
+
+    /**
+     * Takes the oldest item off the ring, consumer thread only.
+     * @return false if the ring was empty
+     */
+    bool pop(T& item) {
+        std::size_t head = m_head.load(std::memory_order_acquire);
+        while (head != m_tail.load(std::memory_order_acquire)) {
+            load(m_slots[head & m_mask], item);
+            // If the producer overwrote this slot while it was being copied it has also moved head on, so the copy is discarded.
+            // Otherwise the producer's CAS on head fails and it only writes this slot after seeing the pop, so the copy is whole
+            if (m_head.compare_exchange_weak(head, head + 1, std::memory_order_acq_rel, std::memory_order_acquire)) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    /**
+     * @return number of items currently queued
+     */
+    std::size_t size() const {
+        return m_tail.load(std::memory_order_acquire) - m_head.load(std::memory_order_acquire);
+    }
+
+    /**
+     * @return maximum number of items the ring holds
+     */
+    std::size_t capacity() const { return m_mask + 1; }
+
+    /**
+     * @return number of items ever queued, including ones later overwritten
+     */
+    std::uint64_t pushed() const { return m_tail.load(std::memory_order_relaxed); }
+
+    /**
+     * @return number of queued items discarded by @ref OverflowPolicy::overwrite_oldest
+     */
+    std::uint64_t overwritten() const { return m_overwritten.load(std::memory_order_relaxed); }
+
+    /**
+     * @return number of items refused by @ref OverflowPolicy::drop_newest
+     */
+    std::uint64_t dropped() const { return m_dropped.load(std::memory_order_relaxed); }
+
+private:
+    static constexpr std::size_t SLOT_WORDS = (sizeof(T) + sizeof(std::uint64_t) - 1) / sizeof(std::uint64_t);
+
+    /**
+     * one item's bytes, as words both threads may access at once.
+     */
+    struct Slot {
+        std::array<std::atomic<std::uint64_t>, SLOT_WORDS> words;
+    };
+
+    static void store(Slot& slot, const T& item) {
+        std::array<std::uint64_t, SLOT_WORDS> buffer{};
+        std::memcpy(buffer.data(), &item, sizeof(T));
+        for (std::size_t i = 0; i < SLOT_WORDS; ++i) {
+            slot.words[i].store(buffer[i], std::memory_order_relaxed);
+        }
+    }
+
+    static void load(const Slot& slot, T& item) {
+        std::array<std::uint64_t, SLOT_WORDS> buffer;
+        for (std::size_t i = 0; i < SLOT_WORDS; ++i) {
+            buffer[i] = slot.words[i].load(std::memory_order_relaxed);
+        }
+        std::memcpy(static_cast<void*>(&item), buffer.data(), sizeof(T));
+    }
+
+    std::unique_ptr<Slot[]> m_slots;
+    std::size_t m_mask = 0;
+
+    // The indices only ever increase, the slot is the index masked to the capacity. Each sits on its own cache line so
+    // the producer and consumer are not invalidating each other's on every push and pop.
+
+    /**
+     * index of the next item to pop.
+     */
+    alignas(64) std::atomic<std::size_t> m_head{0};
+
+    /**
+     * index of the next slot to push into.
+     */
+    alignas(64) std::atomic<std::size_t> m_tail{0};
+
+    alignas(64) std::atomic<std::uint64_t> m_overwritten{0};
+    std::atomic<std::uint64_t> m_dropped{0};
+};
+
+#endif //ARM_ENCODER_DRIVER_SPSC_RING_HPP
@@ -2,14 +2,53 @@
 //Created by Toni Odujinrin on 2025-06-21
 //
 #include "encoder_interface.hpp"
+#include <algorithm>
 
 using std::uint16_t;
 using std::uint32_t;
 using std::uint8_t;
 
+namespace {
+    constexpr uint8_t READ_COMMAND = 0x27;
+    constexpr uint8_t ANG_VAL_REGISTER = 0x11;
+    constexpr uint8_t TEMPERATURE_REGISTER = 0x14;
+    constexpr double RADIANS_PER_REVOLUTION = 6.283185307179586;
+
+    /**
+     * room for the SO_TIMESTAMPING control message of one frame
+     */
+    struct alignas(cmsghdr) ControlBuffer {
+        char data[CMSG_SPACE(sizeof(scm_timestamping))];
+    };
+
+    /**
+     * when a frame was received on EncoderSample's clock, from its CLOCK_REALTIME software timestamp and the time its
+     * batch was read on both clocks, or the batch's time if the frame has no software timestamp.
+     */
+    EncoderSample::clock::time_point frame_receive_time(const timespec& software_timestamp, EncoderSample::clock::time_point batch_time,
+                                                        const timespec& batch_realtime) {
+        if (software_timestamp.tv_sec == 0 && software_timestamp.tv_nsec == 0) {
+            return batch_time;
+        }
+        const auto age = std::chrono::seconds{batch_realtime.tv_sec - software_timestamp.tv_sec}
+                         + std::chrono::nanoseconds{batch_realtime.tv_nsec - software_timestamp.tv_nsec};
+        // A frame cannot arrive after its batch was read, so anything else is the wall clock having been stepped
+        if (age < EncoderSample::clock::duration::zero()) {
+            return batch_time;
+        }
+        return batch_time - std::chrono::duration_cast<EncoderSample::clock::duration>(age);
+    }
+}
+
 EncoderInterface::EncoderInterface(const std::string& can_interface, std::shared_ptr< const std::unordered_set<uint32_t>> encoder_can_ids, double angular_velocity_sample_time): m_angular_velocity_sample_time(angular_velocity_sample_time)
 {
     m_encoder_can_ids = std::move(encoder_can_ids); 
+    m_latest_values = std::make_unique<LatestValueCache>(*m_encoder_can_ids);
+    m_health = std::make_unique<HealthStats>(*m_encoder_can_ids);
+    for (uint32_t can_id : *m_encoder_can_ids) {
+        m_pending_reads.emplace(std::piecewise_construct, std::forward_as_tuple(can_id), std::forward_as_tuple());
+        m_positions.emplace(can_id, PositionState{});
+    }
     BOOST_LOG_TRIVIAL(info) << "[+] initializing channel";
 
     BOOST_LOG_TRIVIAL(info) << "[+] initializing socket";
@@ -29,6 +68,9 @@ EncoderInterface::EncoderInterface(const std::string& can_interface, std::shared
         can_socket = -1;
         throw std::runtime_error("[x] could not find can interface"); 
     }
+    apply_can_filters();
+    enable_timestamps();
+
     BOOST_LOG_TRIVIAL(info) << "[+] binding socket";
     addr.can_family = AF_CAN;
     addr.can_ifindex = ifr.ifr_ifindex;
@@ -42,6 +84,11 @@ EncoderInterface::EncoderInterface(const std::string& can_interface, std::shared
 }
 
 EncoderInterface::~EncoderInterface() {
+    stop_dispatch_thread();
+    if (m_dispatch_event >= 0) {
+        close(m_dispatch_event);
+        m_dispatch_event = -1;
+    }
     if (can_socket >= 0) {
         close(can_socket);
         can_socket = -1;
@@ -54,22 +101,447 @@ void EncoderInterface::begin_read_loop() {
         throw std::runtime_error("[x] can_socket not valid"); 
     }
     BOOST_LOG_TRIVIAL(info) << "[+] beginning read loop: ";
+
+    const std::size_t batch_size = m_batch_size;
+    std::vector<can_frame> frames(batch_size);
+    std::vector<timespec> timestamps(batch_size);
+    std::vector<EncoderSample::clock::time_point> received_times(batch_size);
+    std::vector<iovec> iovecs(batch_size);
+    std::vector<ControlBuffer> controls(batch_size);
+    std::vector<mmsghdr> headers(batch_size);
+    for (std::size_t i = 0; i < batch_size; ++i) {
+        iovecs[i].iov_base = &frames[i];
+        iovecs[i].iov_len = sizeof(can_frame);
+        headers[i].msg_hdr.msg_iov = &iovecs[i];
+        headers[i].msg_hdr.msg_iovlen = 1;
+        headers[i].msg_hdr.msg_control = controls[i].data;
+    }
+
     while (true) {
-        can_frame message{};
-        ssize_t nbytes = read(can_socket, &message, sizeof(can_frame));
-        if(nbytes > 0 && m_encoder_can_ids->count(message.can_id)){
-            if (message.len == 8) {
-                handle_angle(message.data, message.can_id);
-                handle_temp(message.data, message.can_id);
-                handle_all(message);
-            } else {
-                BOOST_LOG_TRIVIAL(error) << "[x] invalid data length " << message.len;
+        // The kernel shrinks msg_controllen to what it wrote, so it has to be reset before every call
+        for (mmsghdr& header : headers) {
+            header.msg_hdr.msg_controllen = sizeof(ControlBuffer);
+        }
+        std::size_t received = 0;
+        {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::receive);
+            received = receive_batch(headers.data(), batch_size);
+        }
+        const auto received_time = EncoderSample::clock::now();
+        timespec received_realtime{};
+        clock_gettime(CLOCK_REALTIME, &received_realtime);
+
+        // Valid frames are compacted to the front of frames for batch_signal
+        std::size_t valid = 0;
+        {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::filter);
+            for (std::size_t i = 0; i < received; ++i) {
+                const can_frame message = frames[i];
+                if (!m_kernel_filtering && !m_encoder_can_ids->count(message.can_id)) {
+                    m_health->record_unknown_frame();
+                    continue;
+                }
+                if (message.len != 8) {
+                    m_health->record_invalid_length(message.can_id);
+                    BOOST_LOG_TRIVIAL(error) << "[x] invalid data length " << message.len;
+                    continue;
+                }
+                timespec software_timestamp{};
+                frames[valid] = message;
+                timestamps[valid] = frame_timestamp(&headers[i].msg_hdr, software_timestamp);
+                // Every frame of a batch is read at once, so each is timed by its own timestamp rather than received_time
+                received_times[valid] = frame_receive_time(software_timestamp, received_time, received_realtime);
+                update_latest_values(message, received_times[valid]);
+                m_health->record_frame(message, timestamps[valid]);
+                ++valid;
             }
         }
+        m_health->record_decode(EncoderSample::clock::now() - received_time, valid);
+        if (valid == 0) {
+            continue;
+        }
+        notify_sample_waiters();
+
+        if (m_ring) {
+            for (std::size_t i = 0; i < valid; ++i) {
+                m_ring->push(QueuedFrame{frames[i], timestamps[i], received_times[i]}, m_overflow_policy);
+            }
+            // One wakeup per batch rather than per frame
+            eventfd_write(m_dispatch_event, 1);
+        } else {
+            dispatch(frames.data(), timestamps.data(), received_times.data(), valid);
+        }
+    }
+};
+
+void EncoderInterface::dispatch(const can_frame* frames, const timespec* timestamps, const EncoderSample::clock::time_point* received_times, std::size_t count) {
+    const auto start = EncoderSample::clock::now();
+    m_connected.angle = !angle_signal.empty();
+    m_connected.angle_raw = !angle_signal_raw.empty();
+    m_connected.position = !position_signal.empty();
+    m_connected.motion = !motion_signal.empty();
+    m_connected.temp = !temp_signal.empty();
+    m_connected.temp_raw = !temp_signal_raw.empty();
+    m_connected.verbose = !verbose_signal.empty();
+    m_connected.batch = !batch_signal.empty();
+
+    for (std::size_t i = 0; i < count; ++i) {
+        handle_angle(frames[i].data, frames[i].can_id, received_times[i], timestamps[i]);
+        handle_temp(frames[i].data, frames[i].can_id, received_times[i], timestamps[i]);
+        if (m_connected.verbose) {
+            handle_all(frames[i]);
+        }
+    }
+    if (m_connected.batch) {
+        UMRT_PROFILE_SCOPE(m_profiler, Probe::emit_batch_signal);
+        batch_signal(frames, timestamps, count);
+    }
+    m_health->record_dispatch(EncoderSample::clock::now() - start, count);
+};
+
+void EncoderInterface::update_latest_values(const can_frame& message, EncoderSample::clock::time_point received_time) {
+    UMRT_PROFILE_SCOPE(m_profiler, Probe::update_latest);
+    const uint8_t* data = message.data;
+    if (data[0] != 0x55) {
+        return;
+    }
+    auto little_endian = [data](std::size_t offset) { return static_cast<uint16_t>(data[offset + 1] << 8 | data[offset]); };
+
+    if (data[1] == 0x55) {
+        // 55 55: angle, angular velocity, revolutions
+        m_latest_values->update_angle(message.can_id, little_endian(2) * 360.0 / 32768,
+                                      static_cast<int16_t>(little_endian(4)) * 360.0 / 32768 / m_angular_velocity_sample_time,
+                                      static_cast<int16_t>(little_endian(6)), received_time);
+    } else if (data[1] == 0x56) {
+        // 55 56: temperature
+        m_latest_values->update_temperature(message.can_id, static_cast<int16_t>(little_endian(2)) / 100.0, received_time);
+    } else if (data[1] == 0x5F) {
+        // 55 5F: reply to a read request, holding the requested register and the two after it
+        auto pending = m_pending_reads.find(message.can_id);
+        if (pending == m_pending_reads.end()) {
+            return;
+        }
+        const int register_address = pending->second.register_address.exchange(-1, std::memory_order_acquire);
+        if (register_address < 0 || received_time.time_since_epoch().count() > pending->second.deadline.load(std::memory_order_relaxed)) {
+            // Nothing was waiting, or the read it was waiting for has given up: this reply answers some other request
+            return;
+        }
+        if (register_address == ANG_VAL_REGISTER) {
+            // ANG_VAL, then REVOLUTIONS, then ANGULAR_VEL
+            m_latest_values->update_angle(message.can_id, little_endian(2) * 360.0 / 32768,
+                                          static_cast<int16_t>(little_endian(6)) * 360.0 / 32768 / m_angular_velocity_sample_time,
+                                          static_cast<int16_t>(little_endian(4)), received_time);
+        } else if (register_address == TEMPERATURE_REGISTER) {
+            m_latest_values->update_temperature(message.can_id, static_cast<int16_t>(little_endian(2)) / 100.0, received_time);
+        }
     }
 };
 
+void EncoderInterface::enable_motion_estimation(double alpha, double beta, double gamma) {
+    m_motion_filters.clear();
+    for (uint32_t can_id : *m_encoder_can_ids) {
+        m_motion_filters.emplace(can_id, AlphaBetaGammaFilter(alpha, beta, gamma));
+    }
+};
+
+void EncoderInterface::notify_sample_waiters() {
+    // Ordered after the cache updates, so a waiter which registers too late to be seen here reads the new values itself
+    std::atomic_thread_fence(std::memory_order_seq_cst);
+    if (m_sample_waiters.load(std::memory_order_relaxed) > 0) {
+        std::lock_guard<std::mutex> lock(m_sample_mutex);
+        m_sample_updated.notify_all();
+    }
+};
+
+bool EncoderInterface::latest_sample(uint32_t can_id, EncoderSample& sample) const {
+    return m_latest_values && m_latest_values->read(can_id, sample);
+};
+
+bool EncoderInterface::get_angle_sample(uint32_t can_id, EncoderSample::clock::duration max_age, EncoderSample& sample, std::chrono::milliseconds timeout) {
+    return get_sample(can_id, ANG_VAL_REGISTER, &EncoderSample::angle_time, max_age, sample, timeout);
+};
+
+bool EncoderInterface::get_temperature_sample(uint32_t can_id, EncoderSample::clock::duration max_age, EncoderSample& sample, std::chrono::milliseconds timeout) {
+    return get_sample(can_id, TEMPERATURE_REGISTER, &EncoderSample::temperature_time, max_age, sample, timeout);
+};
+
+bool EncoderInterface::get_sample(uint32_t can_id, uint8_t register_address, EncoderSample::clock::time_point EncoderSample::*sample_time,
+                                  EncoderSample::clock::duration max_age, EncoderSample& sample, std::chrono::milliseconds timeout) {
+    if (!latest_sample(can_id, sample)) {
+        return false;
+    }
+    const auto requested_time = EncoderSample::clock::now();
+    if (sample.*sample_time != EncoderSample::clock::time_point{} && requested_time - sample.*sample_time <= max_age) {
+        return true;
+    }
+    const auto deadline = requested_time + timeout;
+    if (!send_read_request(can_id, register_address, deadline)) {
+        return false;
+    }
+
+    // The reply is picked up by the read loop, so wait for it to move the cache past the request. A streamed frame
+    // arriving in the meantime is just as fresh, and counts too.
+    bool fresh;
+    {
+        std::unique_lock<std::mutex> lock(m_sample_mutex);
+        m_sample_waiters.fetch_add(1);
+        fresh = m_sample_updated.wait_until(lock, deadline, [&] {
+            latest_sample(can_id, sample);
+            return sample.*sample_time >= requested_time;
+        });
+        m_sample_waiters.fetch_sub(1);
+    }
+    if (fresh) {
+        return true;
+    }
+    // Stop waiting for the reply, unless another read has been sent since
+    int expected = register_address;
+    m_pending_reads.at(can_id).register_address.compare_exchange_strong(expected, -1);
+    m_health->record_reply_timeout(can_id);
+    return false;
+};
+
+bool EncoderInterface::send_read_request(uint32_t can_id, uint8_t register_address, EncoderSample::clock::time_point deadline) {
+    can_frame request{};
+    request.can_id = can_id > CAN_SFF_MASK ? (can_id | CAN_EFF_FLAG) : can_id;
+    request.len = 5;
+    request.data[0] = 0xFF;
+    request.data[1] = 0xAA;
+    request.data[2] = READ_COMMAND;
+    request.data[3] = register_address;
+    request.data[4] = 0x00;
+
+    PendingRead& pending = m_pending_reads.at(can_id);
+    pending.deadline.store(deadline.time_since_epoch().count(), std::memory_order_relaxed);
+    pending.register_address.store(register_address, std::memory_order_release);
+    if (write(can_socket, &request, sizeof(request)) != static_cast<ssize_t>(sizeof(request))) {
+        BOOST_LOG_TRIVIAL(warning) << "[x] could not send read request to " << can_id << ": " << std::strerror(errno);
+        m_health->record_send_error(can_id);
+        pending.register_address.store(-1);
+        return false;
+    }
+    return true;
+};
+
+void EncoderInterface::set_profiling(bool enabled) {
+#ifndef UMRT_ENCODER_PROFILING
+    if (enabled) {
+        BOOST_LOG_TRIVIAL(warning) << "[x] profiling probes were not compiled in, rebuild with -DUMRT_ENCODER_PROFILING=ON";
+    }
+#endif
+    m_profiler.set_enabled(enabled);
+};
+
+std::vector<ProbeStats> EncoderInterface::profile_report() const {
+    return m_profiler.report();
+};
+
+void EncoderInterface::reset_profile() {
+    m_profiler.reset();
+};
+
+void EncoderInterface::set_sample_sink(SampleSink* sink) {
+    m_sample_sink = sink;
+};
+
+void EncoderInterface::set_expected_rate(double rate) {
+    m_health->set_expected_rate(rate);
+};
+
+HealthSnapshot EncoderInterface::health_snapshot() const {
+    return m_health ? m_health->snapshot() : HealthSnapshot{};
+};
+
+void EncoderInterface::enable_decoupled_dispatch(std::size_t capacity, OverflowPolicy policy) {
+    BOOST_LOG_TRIVIAL(info) << "[+] enabling decoupled dispatch";
+    if (m_dispatch_event < 0) {
+        m_dispatch_event = eventfd(0, EFD_NONBLOCK | EFD_CLOEXEC);
+        if (m_dispatch_event < 0) {
+            BOOST_LOG_TRIVIAL(error) << "[x] could not create dispatch eventfd: " << std::strerror(errno);
+            throw std::runtime_error("[x] could not create dispatch eventfd");
+        }
+    }
+    m_ring = std::make_unique<SpscRing<QueuedFrame>>(capacity);
+    m_overflow_policy = policy;
+    m_dispatch_frames.resize(m_ring->capacity());
+    m_dispatch_timestamps.resize(m_ring->capacity());
+    m_dispatch_received_times.resize(m_ring->capacity());
+};
+
+std::size_t EncoderInterface::poll_dispatch(std::size_t max_frames) {
+    if (!m_ring) {
+        return 0;
+    }
+    // Clear the wakeup before draining, so frames queued from here on signal it again
+    eventfd_t wakeups = 0;
+    eventfd_read(m_dispatch_event, &wakeups);
+
+    std::size_t total = 0;
+    QueuedFrame queued{};
+    while (total < max_frames) {
+        // Dispatch in chunks of up to the ring's capacity so batch_signal still sees batches
+        std::size_t count = 0;
+        const std::size_t limit = std::min(m_dispatch_frames.size(), max_frames - total);
+        while (count < limit && m_ring->pop(queued)) {
+            m_dispatch_frames[count] = queued.frame;
+            m_dispatch_timestamps[count] = queued.timestamp;
+            m_dispatch_received_times[count] = queued.received_time;
+            ++count;
+        }
+        if (count == 0) {
+            break;
+        }
+        dispatch(m_dispatch_frames.data(), m_dispatch_timestamps.data(), m_dispatch_received_times.data(), count);
+        m_dispatched.fetch_add(count, std::memory_order_relaxed);
+        total += count;
+    }
+
+    // Stopped by max_frames with frames left over, make sure whoever is waiting on the eventfd comes back for them
+    if (m_ring->size() > 0) {
+        eventfd_write(m_dispatch_event, 1);
+    }
+    return total;
+};
+
+int EncoderInterface::dispatch_fd() const {
+    return m_dispatch_event;
+};
+
+void EncoderInterface::start_dispatch_thread() {
+    if (!m_ring) {
+        throw std::runtime_error("[x] decoupled dispatch not enabled");
+    }
+    if (m_dispatch_running.exchange(true)) {
+        return;
+    }
+    BOOST_LOG_TRIVIAL(info) << "[+] starting dispatch thread";
+    m_dispatch_thread = std::thread([this]() {
+        pollfd event_poll{m_dispatch_event, POLLIN, 0};
+        while (m_dispatch_running.load(std::memory_order_relaxed)) {
+            // The timeout only bounds how long stop_dispatch_thread can take if the wakeup is missed
+            if (poll(&event_poll, 1, 100) > 0) {
+                poll_dispatch();
+            }
+        }
+    });
+};
+
+void EncoderInterface::stop_dispatch_thread() {
+    if (!m_dispatch_running.exchange(false)) {
+        return;
+    }
+    eventfd_write(m_dispatch_event, 1);
+    m_dispatch_thread.join();
+};
+
+DispatchStats EncoderInterface::dispatch_stats() const {
+    DispatchStats stats{};
+    if (m_ring) {
+        stats.queued = m_ring->size();
+        stats.capacity = m_ring->capacity();
+        stats.pushed = m_ring->pushed();
+        stats.dispatched = m_dispatched.load(std::memory_order_relaxed);
+        stats.overwritten = m_ring->overwritten();
+        stats.dropped = m_ring->dropped();
+    }
+    return stats;
+};
+
+void EncoderInterface::set_batch_receive(std::size_t batch_size, std::chrono::microseconds max_wait) {
+    if (batch_size == 0) {
+        throw std::invalid_argument("[x] batch size must be at least 1");
+    }
+    m_batch_size = batch_size;
+    m_batch_max_wait = max_wait;
+};
+
+std::size_t EncoderInterface::receive_batch(mmsghdr* headers, std::size_t capacity) {
+    // MSG_WAITFORONE blocks for the first frame only, then takes whatever else is already queued
+    int received = recvmmsg(can_socket, headers, static_cast<unsigned int>(capacity), MSG_WAITFORONE, nullptr);
+    if (received < 0) {
+        if (errno != EINTR) {
+            BOOST_LOG_TRIVIAL(error) << "[x] could not read from socket: " << std::strerror(errno);
+        }
+        return 0;
+    }
+
+    std::size_t total = static_cast<std::size_t>(received);
+    if (m_batch_max_wait.count() > 0) {
+        const auto deadline = std::chrono::steady_clock::now() + m_batch_max_wait;
+        while (total < capacity) {
+            const auto remaining = std::chrono::duration_cast<std::chrono::nanoseconds>(deadline - std::chrono::steady_clock::now());
+            if (remaining.count() <= 0) {
+                break;
+            }
+            timespec timeout{};
+            timeout.tv_sec = static_cast<time_t>(remaining.count() / 1000000000);
+            timeout.tv_nsec = static_cast<long>(remaining.count() % 1000000000);
+            pollfd socket_poll{can_socket, POLLIN, 0};
+            if (ppoll(&socket_poll, 1, &timeout, nullptr) <= 0) {
+                break;
+            }
+            received = recvmmsg(can_socket, headers + total, static_cast<unsigned int>(capacity - total), MSG_DONTWAIT, nullptr);
+            if (received <= 0) {
+                break;
+            }
+            total += static_cast<std::size_t>(received);
+        }
+    }
+    return total;
+};
+
+void EncoderInterface::enable_timestamps() {
+    int flags = SOF_TIMESTAMPING_RX_HARDWARE | SOF_TIMESTAMPING_RAW_HARDWARE | SOF_TIMESTAMPING_RX_SOFTWARE | SOF_TIMESTAMPING_SOFTWARE;
+    if (setsockopt(can_socket, SOL_SOCKET, SO_TIMESTAMPING, &flags, sizeof(flags)) < 0) {
+        BOOST_LOG_TRIVIAL(warning) << "[x] could not enable receive timestamps, frames will be stamped when read: " << std::strerror(errno);
+    }
+};
+
+timespec EncoderInterface::frame_timestamp(msghdr* header, timespec& software_timestamp) {
+    for (cmsghdr* control = CMSG_FIRSTHDR(header); control != nullptr; control = CMSG_NXTHDR(header, control)) {
+        if (control->cmsg_level == SOL_SOCKET && control->cmsg_type == SO_TIMESTAMPING) {
+            scm_timestamping stamps{};
+            std::memcpy(&stamps, CMSG_DATA(control), sizeof(stamps));
+            software_timestamp = stamps.ts[0];
+            // ts[2] is the raw hardware timestamp, only filled in if the interface supports them
+            if (stamps.ts[2].tv_sec != 0 || stamps.ts[2].tv_nsec != 0) {
+                return stamps.ts[2];
+            }
+            return stamps.ts[0];
+        }
+    }
+    timespec now{};
+    clock_gettime(CLOCK_REALTIME, &now);
+    return now;
+};
+
+void EncoderInterface::apply_can_filters() {
+    BOOST_LOG_TRIVIAL(info) << "[+] setting CAN ID filters";
+    std::vector<can_filter> filters;
+    filters.reserve(m_encoder_can_ids->size());
+    for (uint32_t can_id : *m_encoder_can_ids) {
+        can_filter filter{};
+        if (can_id > CAN_SFF_MASK) {
+            filter.can_id = can_id | CAN_EFF_FLAG;
+            filter.can_mask = CAN_EFF_MASK | CAN_EFF_FLAG | CAN_RTR_FLAG;
+        } else {
+            filter.can_id = can_id;
+            filter.can_mask = CAN_SFF_MASK | CAN_EFF_FLAG | CAN_RTR_FLAG;
+        }
+        filters.push_back(filter);
+    }
+
+    // The kernel caps the number of filters per socket (CAN_RAW_FILTER_MAX), past that every frame has to be checked here instead
+    if (setsockopt(can_socket, SOL_CAN_RAW, CAN_RAW_FILTER, filters.data(), static_cast<socklen_t>(filters.size() * sizeof(can_filter))) < 0) {
+        BOOST_LOG_TRIVIAL(warning) << "[x] could not set CAN ID filters, filtering in user space instead: " << std::strerror(errno);
+        m_kernel_filtering = false;
+        return;
+    }
+    m_kernel_filtering = true;
+};
+
 void EncoderInterface::handle_all(const can_frame& message) {
+    UMRT_PROFILE_SCOPE(m_profiler, Probe::emit_verbose_signal);
     verbose_signal(message);
 };
 
@@ -77,23 +549,104 @@ void EncoderInterface::handle_all(const can_frame& message) {
 
 
 
-void EncoderInterface::handle_angle(const uint8_t* message_data, const uint32_t can_id) {
+void EncoderInterface::handle_angle(const uint8_t* message_data, const uint32_t can_id, EncoderSample::clock::time_point received_time, const timespec& timestamp) {
     if (message_data[0] == 0x55 && message_data[1] == 0x55) {
-        uint16_t angle_register_value = static_cast<uint16_t>(message_data[3] << 8) | message_data[2];
-        double angle = angle_register_value * 360.0 / 32768; 
-        uint16_t angular_velocity_register_value = static_cast<uint16_t>(message_data[5] << 8) | message_data[4];
-        double angular_velocity = angular_velocity_register_value * 360.0 / 32768 / m_angular_velocity_sample_time;
-        uint16_t number_of_rotations = static_cast<uint16_t>(message_data[7] << 8) | message_data[6];
-        angle_signal(can_id, angle, angular_velocity, number_of_rotations);
-        angle_signal_raw(can_id, angle_register_value, angular_velocity_register_value, number_of_rotations); 
+        uint16_t angle_register_value = 0;
+        double angle = 0;
+        int16_t angular_velocity_register_value = 0;
+        double angular_velocity = 0;
+        int16_t number_of_rotations = 0;
+        {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::decode_angle);
+            angle_register_value = static_cast<uint16_t>(message_data[3] << 8) | message_data[2];
+            angle = angle_register_value * 360.0 / 32768; 
+            // Angular velocity and revolutions are signed 16-bit
+            angular_velocity_register_value = static_cast<int16_t>(static_cast<uint16_t>(message_data[5] << 8) | message_data[4]);
+            angular_velocity = angular_velocity_register_value * 360.0 / 32768 / m_angular_velocity_sample_time;
+            number_of_rotations = static_cast<int16_t>(static_cast<uint16_t>(message_data[7] << 8) | message_data[6]);
+        }
+        if (m_connected.angle) {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::emit_angle_signal);
+            angle_signal(can_id, angle, angular_velocity, number_of_rotations);
+        }
+        if (m_connected.angle_raw) {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::emit_angle_signal_raw);
+            angle_signal_raw(can_id, angle_register_value, angular_velocity_register_value, number_of_rotations); 
+        }
+
+        auto found = m_positions.find(can_id);
+        if (found == m_positions.end()) {
+            return;
+        }
+        PositionState& state = found->second;
+        double revolutions = 0;
+        {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::unwrap_position);
+            if (!state.initialized) {
+                state.position = static_cast<int64_t>(number_of_rotations) * 32768 + angle_register_value;
+                state.initialized = true;
+            } else {
+                // The revolution counter wraps at 16 bits, so its change is taken modulo 2^16. In single-turn mode it never changes,
+                // and a jump of more than half a turn in the angle is taken to be the angle wrapping around instead.
+                const int64_t revolutions_change = static_cast<int16_t>(static_cast<uint16_t>(number_of_rotations - state.last_revolutions));
+                const int64_t angle_change = static_cast<int64_t>(angle_register_value) - state.last_angle;
+                int64_t change = revolutions_change * 32768 + angle_change;
+                if (revolutions_change == 0 && angle_change > 16384) {
+                    change -= 32768;
+                } else if (revolutions_change == 0 && angle_change < -16384) {
+                    change += 32768;
+                }
+                state.position += change;
+            }
+            state.last_angle = angle_register_value;
+            state.last_revolutions = number_of_rotations;
+            revolutions = static_cast<double>(state.position) / 32768;
+        }
+        if (m_sample_sink) {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::emit_sample_sink);
+            m_sample_sink->on_angle(AngleSample{can_id, angle_register_value, angular_velocity_register_value, number_of_rotations,
+                                                angle, angular_velocity, revolutions * 360.0, timestamp, received_time});
+        }
+        if (m_connected.position) {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::emit_position_signal);
+            position_signal(can_id, revolutions * 360.0, revolutions * RADIANS_PER_REVOLUTION, received_time);
+        }
+
+        auto filter = m_motion_filters.find(can_id);
+        if (filter != m_motion_filters.end()) {
+            {
+                UMRT_PROFILE_SCOPE(m_profiler, Probe::estimate_motion);
+                // Timed by the frame's receive time on the steady clock, which unlike timestamp cannot step backwards
+                filter->second.update(revolutions * 360.0, std::chrono::duration<double>(received_time.time_since_epoch()).count());
+            }
+            if (m_connected.motion) {
+                UMRT_PROFILE_SCOPE(m_profiler, Probe::emit_motion_signal);
+                motion_signal(can_id, filter->second.position(), filter->second.velocity(), filter->second.acceleration(), received_time);
+            }
+        }
     }
 };
 
-void EncoderInterface::handle_temp(const uint8_t* message_data, const uint32_t can_id) {
+void EncoderInterface::handle_temp(const uint8_t* message_data, const uint32_t can_id, EncoderSample::clock::time_point received_time, const timespec& timestamp) {
     if (message_data[0] == 0x55 && message_data[1] == 0x56) {
-        uint16_t temperature_register_value = static_cast<uint16_t>(message_data[3] << 8) | message_data[2];
-        int temperature = temperature_register_value / 100;
-        temp_signal(can_id, temperature);
-        temp_signal_raw(can_id, temperature_register_value); 
+        int16_t temperature_register_value = 0;
+        double temperature = 0;
+        {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::decode_temp);
+            temperature_register_value = static_cast<int16_t>(static_cast<uint16_t>(message_data[3] << 8) | message_data[2]);
+            temperature = temperature_register_value / 100.0;
+        }
+        if (m_sample_sink) {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::emit_sample_sink);
+            m_sample_sink->on_temperature(TemperatureSample{can_id, temperature_register_value, temperature, timestamp, received_time});
+        }
+        if (m_connected.temp) {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::emit_temp_signal);
+            temp_signal(can_id, temperature);
+        }
+        if (m_connected.temp_raw) {
+            UMRT_PROFILE_SCOPE(m_profiler, Probe::emit_temp_signal_raw);
+            temp_signal_raw(can_id, temperature_register_value); 
+        }
     }
-};
+};
\ No newline at end of file
@@ -0,0 +1,337 @@
+#include "health_stats.hpp"
+#include <algorithm>
+#include <cmath>
+#include <cstdio>
+#include <sstream>
+
+namespace {
+    /**
+     * weight of each new interval in the running mean and jitter, about the last 16 frames.
+     */
+    constexpr double INTERVAL_SMOOTHING = 1.0 / 16;
+
+    /**
+     * adds n to a counter only one thread writes, without the cost of a locked read-modify-write.
+     */
+    void bump(std::atomic<std::uint64_t>& counter, std::uint64_t n = 1) {
+        counter.store(counter.load(std::memory_order_relaxed) + n, std::memory_order_relaxed);
+    }
+
+    std::size_t bucket_of(std::uint64_t value) {
+        std::size_t bucket = 0;
+        while (value != 0 && bucket + 1 < HEALTH_HISTOGRAM_BUCKETS) {
+            value >>= 1;
+            ++bucket;
+        }
+        return bucket;
+    }
+
+    std::string hex_id(std::uint32_t can_id) {
+        char buffer[16];
+        std::snprintf(buffer, sizeof(buffer), "0x%X", can_id);
+        return buffer;
+    }
+}
+
+HealthStats::HealthStats(const std::unordered_set<std::uint32_t>& can_ids) {
+    for (std::uint32_t can_id : can_ids) {
+        m_encoders.emplace(can_id, std::make_unique<Encoder>());
+    }
+}
+
+void HealthStats::set_expected_rate(double rate) {
+    m_expected_period.store(rate > 0 ? 1.0 / rate : 0.0, std::memory_order_relaxed);
+}
+
+HealthStats::Encoder* HealthStats::find(std::uint32_t can_id) {
+    auto found = m_encoders.find(can_id);
+    return found == m_encoders.end() ? nullptr : found->second.get();
+}
+
+void HealthStats::Histogram::record(std::uint64_t value) {
+    bump(buckets[bucket_of(value)]);
+    bump(sum, value);
+}
+
+HealthHistogram HealthStats::Histogram::copy() const {
+    HealthHistogram histogram;
+    for (std::size_t i = 0; i < HEALTH_HISTOGRAM_BUCKETS; ++i) {
+        histogram.buckets[i] = buckets[i].load(std::memory_order_relaxed);
+    }
+    histogram.sum = sum.load(std::memory_order_relaxed);
+    return histogram;
+}
+
+void HealthStats::Stream::record(std::int64_t time, double expected_period) {
+    bump(frames);
+    const std::int64_t previous = last_time;
+    last_time = time;
+    if (previous == 0 || time <= previous) {
+        return;
+    }
+
+    const double interval = static_cast<double>(time - previous) * 1e-9;
+    interval_us.record(static_cast<std::uint64_t>(time - previous) / 1000);
+    double mean = mean_interval.load(std::memory_order_relaxed);
+    if (mean == 0) {
+        mean = interval;
+    } else {
+        const double previous_jitter = jitter.load(std::memory_order_relaxed);
+        jitter.store(previous_jitter + (std::fabs(interval - mean) - previous_jitter) * INTERVAL_SMOOTHING, std::memory_order_relaxed);
+        mean += (interval - mean) * INTERVAL_SMOOTHING;
+    }
+    mean_interval.store(mean, std::memory_order_relaxed);
+
+    if (expected_period > 0 && interval > 1.5 * expected_period) {
+        bump(missed, static_cast<std::uint64_t>(std::llround(interval / expected_period)) - 1);
+    }
+}
+
+void HealthStats::record_frame(const can_frame& frame, const timespec& timestamp) {
+    Encoder* encoder = find(frame.can_id & CAN_EFF_MASK);
+    if (encoder == nullptr) {
+        return;
+    }
+    if (frame.data[0] == 0x55 && (frame.data[1] == 0x55 || frame.data[1] == 0x56)) {
+        const std::int64_t time = static_cast<std::int64_t>(timestamp.tv_sec) * 1000000000 + timestamp.tv_nsec;
+        Stream& stream = frame.data[1] == 0x55 ? encoder->angle : encoder->temperature;
+        stream.record(time, m_expected_period.load(std::memory_order_relaxed));
+    } else if (frame.data[0] == 0x55 && frame.data[1] == 0x5F) {
+        bump(encoder->replies);
+    } else {
+        bump(encoder->other_frames);
+    }
+}
+
+void HealthStats::record_invalid_length(std::uint32_t can_id) {
+    if (Encoder* encoder = find(can_id & CAN_EFF_MASK)) {
+        bump(encoder->invalid_length);
+    }
+}
+
+void HealthStats::record_unknown_frame() {
+    bump(m_unknown_frames);
+}
+
+void HealthStats::record_decode(std::chrono::nanoseconds elapsed, std::size_t frames) {
+    bump(m_batches);
+    if (frames > 0) {
+        m_decode_ns_per_frame.record(static_cast<std::uint64_t>(elapsed.count()) / frames);
+    }
+}
+
+void HealthStats::record_dispatch(std::chrono::nanoseconds elapsed, std::size_t frames) {
+    if (frames > 0) {
+        m_dispatch_ns_per_frame.record(static_cast<std::uint64_t>(elapsed.count()) / frames);
+    }
+}
+
+void HealthStats::record_reply_timeout(std::uint32_t can_id) {
+    if (Encoder* encoder = find(can_id)) {
+        encoder->reply_timeouts.fetch_add(1, std::memory_order_relaxed);
+    }
+}
+
+void HealthStats::record_send_error(std::uint32_t can_id) {
+    if (Encoder* encoder = find(can_id)) {
+        encoder->send_errors.fetch_add(1, std::memory_order_relaxed);
+    }
+}
+
+HealthSnapshot HealthStats::snapshot() const {
+    auto copy_stream = [](const Stream& stream) {
+        StreamHealth health;
+        health.frames = stream.frames.load(std::memory_order_relaxed);
+        health.missed = stream.missed.load(std::memory_order_relaxed);
+        const double mean = stream.mean_interval.load(std::memory_order_relaxed);
+        health.rate = mean > 0 ? 1.0 / mean : 0.0;
+        health.jitter = stream.jitter.load(std::memory_order_relaxed);
+        health.interval_us = stream.interval_us.copy();
+        return health;
+    };
+
+    HealthSnapshot snapshot;
+    snapshot.uptime = std::chrono::duration<double>(clock::now() - m_created).count();
+    for (const auto& [can_id, encoder] : m_encoders) {
+        EncoderHealth health;
+        health.can_id = can_id;
+        health.angle = copy_stream(encoder->angle);
+        health.temperature = copy_stream(encoder->temperature);
+        health.replies = encoder->replies.load(std::memory_order_relaxed);
+        health.other_frames = encoder->other_frames.load(std::memory_order_relaxed);
+        health.invalid_length = encoder->invalid_length.load(std::memory_order_relaxed);
+        health.reply_timeouts = encoder->reply_timeouts.load(std::memory_order_relaxed);
+        health.send_errors = encoder->send_errors.load(std::memory_order_relaxed);
+        snapshot.encoders.push_back(health);
+    }
+    std::sort(snapshot.encoders.begin(), snapshot.encoders.end(),
+              [](const EncoderHealth& a, const EncoderHealth& b) { return a.can_id < b.can_id; });
+    snapshot.unknown_frames = m_unknown_frames.load(std::memory_order_relaxed);
+    snapshot.batches = m_batches.load(std::memory_order_relaxed);
+    snapshot.decode_ns_per_frame = m_decode_ns_per_frame.copy();
+    snapshot.dispatch_ns_per_frame = m_dispatch_ns_per_frame.copy();
+    return snapshot;
+}
+
+namespace {
+    /**
+     * writes the samples of one metric family under a single HELP and TYPE, as the exposition format requires.
+     */
+    class PrometheusWriter {
+    public:
+        explicit PrometheusWriter(std::ostringstream& out): m_out(out) {}
+
+        void family(const std::string& name, const char* type, const char* help) {
+            m_name = "umrt_encoder_" + name;
+            m_out << "# HELP " << m_name << ' ' << help << '\n' << "# TYPE " << m_name << ' ' << type << '\n';
+        }
+
+        template <typename T>
+        void sample(const std::string& labels, T value, const char* suffix = "") {
+            m_out << m_name << suffix;
+            if (!labels.empty()) {
+                m_out << '{' << labels << '}';
+            }
+            m_out << ' ' << value << '\n';
+        }
+
+        /**
+         * histogram of integer values in unit (e.g. 1e-6 for microseconds), exported in seconds.
+         */
+        void histogram(const std::string& labels, const HealthHistogram& histogram, double unit) {
+            const std::string separator = labels.empty() ? "" : ",";
+            std::uint64_t cumulative = 0;
+            for (std::size_t i = 0; i + 1 < HEALTH_HISTOGRAM_BUCKETS; ++i) {
+                cumulative += histogram.buckets[i];
+                // Bucket i holds values below 2^i
+                std::ostringstream bound;
+                bound << std::ldexp(unit, static_cast<int>(i));
+                sample(labels + separator + "le=\"" + bound.str() + "\"", cumulative, "_bucket");
+            }
+            cumulative += histogram.buckets[HEALTH_HISTOGRAM_BUCKETS - 1];
+            sample(labels + separator + "le=\"+Inf\"", cumulative, "_bucket");
+            sample(labels, static_cast<double>(histogram.sum) * unit, "_sum");
+            sample(labels, cumulative, "_count");
+        }
+
+    private:
+        std::ostringstream& m_out;
+        std::string m_name;
+    };
+
+    std::string encoder_labels(const EncoderHealth& encoder, const char* extra = nullptr) {
+        std::string labels = "can_id=\"" + hex_id(encoder.can_id) + "\"";
+        if (extra != nullptr) {
+            labels += std::string(",") + extra;
+        }
+        return labels;
+    }
+
+    void json_histogram(std::ostringstream& out, const HealthHistogram& histogram) {
+        out << "{\"sum\":" << histogram.sum << ",\"buckets\":[";
+        for (std::size_t i = 0; i < HEALTH_HISTOGRAM_BUCKETS; ++i) {
+            out << (i ? "," : "") << histogram.buckets[i];
+        }
+        out << "]}";
+    }
+
+    void json_stream(std::ostringstream& out, const StreamHealth& stream) {
+        out << "{\"frames\":" << stream.frames << ",\"missed\":" << stream.missed << ",\"rate\":" << stream.rate
+            << ",\"jitter\":" << stream.jitter << ",\"interval_us\":";
+        json_histogram(out, stream.interval_us);
+        out << '}';
+    }
+}
+
+std::string to_prometheus(const HealthSnapshot& snapshot) {
+    std::ostringstream out;
+    PrometheusWriter writer(out);
+    const std::pair<const char*, StreamHealth EncoderHealth::*> streams[] = {
+        {"stream=\"angle\"", &EncoderHealth::angle},
+        {"stream=\"temperature\"", &EncoderHealth::temperature},
+    };
+
+    writer.family("uptime_seconds", "gauge", "Seconds since the stats were created.");
+    writer.sample("", snapshot.uptime);
+
+    writer.family("frames_total", "counter", "Frames received by type.");
+    for (const EncoderHealth& encoder : snapshot.encoders) {
+        writer.sample(encoder_labels(encoder, "type=\"angle\""), encoder.angle.frames);
+        writer.sample(encoder_labels(encoder, "type=\"temperature\""), encoder.temperature.frames);
+        writer.sample(encoder_labels(encoder, "type=\"reply\""), encoder.replies);
+        writer.sample(encoder_labels(encoder, "type=\"other\""), encoder.other_frames);
+        writer.sample(encoder_labels(encoder, "type=\"invalid_length\""), encoder.invalid_length);
+    }
+
+    writer.family("missed_frames_total", "counter", "Frames estimated missing from gaps in the stream longer than the expected period.");
+    for (const EncoderHealth& encoder : snapshot.encoders) {
+        for (const auto& [label, stream] : streams) {
+            writer.sample(encoder_labels(encoder, label), (encoder.*stream).missed);
+        }
+    }
+
+    writer.family("frame_rate_hertz", "gauge", "Recent frame rate of the stream.");
+    for (const EncoderHealth& encoder : snapshot.encoders) {
+        for (const auto& [label, stream] : streams) {
+            writer.sample(encoder_labels(encoder, label), (encoder.*stream).rate);
+        }
+    }
+
+    writer.family("frame_jitter_seconds", "gauge", "Recent mean absolute deviation of the time between frames.");
+    for (const EncoderHealth& encoder : snapshot.encoders) {
+        for (const auto& [label, stream] : streams) {
+            writer.sample(encoder_labels(encoder, label), (encoder.*stream).jitter);
+        }
+    }
+
+    writer.family("frame_interval_seconds", "histogram", "Time between frames of the stream.");
+    for (const EncoderHealth& encoder : snapshot.encoders) {
+        for (const auto& [label, stream] : streams) {
+            writer.histogram(encoder_labels(encoder, label), (encoder.*stream).interval_us, 1e-6);
+        }
+    }
+
+    writer.family("reply_timeouts_total", "counter", "Register reads which got no reply in time.");
+    for (const EncoderHealth& encoder : snapshot.encoders) {
+        writer.sample(encoder_labels(encoder), encoder.reply_timeouts);
+    }
+
+    writer.family("send_errors_total", "counter", "Requests which could not be sent.");
+    for (const EncoderHealth& encoder : snapshot.encoders) {
+        writer.sample(encoder_labels(encoder), encoder.send_errors);
+    }
+
+    writer.family("unknown_frames_total", "counter", "Frames from CAN IDs other than the encoders'.");
+    writer.sample("", snapshot.unknown_frames);
+
+    writer.family("batches_total", "counter", "Batches read from the socket.");
+    writer.sample("", snapshot.batches);
+
+    writer.family("decode_seconds_per_frame", "histogram", "Read loop time per frame, one sample per batch.");
+    writer.histogram("", snapshot.decode_ns_per_frame, 1e-9);
+
+    writer.family("dispatch_seconds_per_frame", "histogram", "Signal dispatch time per frame, one sample per batch.");
+    writer.histogram("", snapshot.dispatch_ns_per_frame, 1e-9);
+    return out.str();
+}
+
+std::string to_json(const HealthSnapshot& snapshot) {
+    std::ostringstream out;
+    out << "{\"uptime\":" << snapshot.uptime << ",\"encoders\":{";
+    for (std::size_t i = 0; i < snapshot.encoders.size(); ++i) {
+        const EncoderHealth& encoder = snapshot.encoders[i];
+        out << (i ? "," : "") << '"' << hex_id(encoder.can_id) << "\":{\"angle\":";
+        json_stream(out, encoder.angle);
+        out << ",\"temperature\":";
+        json_stream(out, encoder.temperature);
+        out << ",\"replies\":" << encoder.replies << ",\"other_frames\":" << encoder.other_frames
+            << ",\"invalid_length\":" << encoder.invalid_length << ",\"reply_timeouts\":" << encoder.reply_timeouts
+            << ",\"send_errors\":" << encoder.send_errors << '}';
+    }
+    out << "},\"unknown_frames\":" << snapshot.unknown_frames << ",\"batches\":" << snapshot.batches << ",\"decode_ns_per_frame\":";
+    json_histogram(out, snapshot.decode_ns_per_frame);
+    out << ",\"dispatch_ns_per_frame\":";
+    json_histogram(out, snapshot.dispatch_ns_per_frame);
+    out << '}';
+    return out.str();
+}
@@ -0,0 +1,68 @@
+#include "latest_value_cache.hpp"
+
+LatestValueCache::LatestValueCache(const std::unordered_set<std::uint32_t>& can_ids) {
+    for (std::uint32_t can_id : can_ids) {
+        m_slots.emplace(can_id, std::make_unique<Slot>());
+    }
+}
+
+void LatestValueCache::begin_write(Slot& slot) {
+    slot.sequence.store(slot.sequence.load(std::memory_order_relaxed) + 1, std::memory_order_relaxed);
+    // Keeps the field stores below from becoming visible before the sequence number goes odd
+    std::atomic_thread_fence(std::memory_order_release);
+}
+
+void LatestValueCache::end_write(Slot& slot) {
+    slot.sequence.store(slot.sequence.load(std::memory_order_relaxed) + 1, std::memory_order_release);
+}
+
+void LatestValueCache::update_angle(std::uint32_t can_id, double angle, double angular_velocity, std::int16_t revolutions, clock::time_point time) {
+    auto found = m_slots.find(can_id);
+    if (found == m_slots.end()) {
+        return;
+    }
+    Slot& slot = *found->second;
+    begin_write(slot);
+    slot.angle.store(angle, std::memory_order_relaxed);
+    slot.angular_velocity.store(angular_velocity, std::memory_order_relaxed);
+    slot.revolutions.store(revolutions, std::memory_order_relaxed);
+    slot.angle_time.store(time.time_since_epoch().count(), std::memory_order_relaxed);
+    end_write(slot);
+}
+
+void LatestValueCache::update_temperature(std::uint32_t can_id, double temperature, clock::time_point time) {
+    auto found = m_slots.find(can_id);
+    if (found == m_slots.end()) {
+        return;
+    }
+    Slot& slot = *found->second;
+    begin_write(slot);
+    slot.temperature.store(temperature, std::memory_order_relaxed);
+    slot.temperature_time.store(time.time_since_epoch().count(), std::memory_order_relaxed);
+    end_write(slot);
+}
+
+bool LatestValueCache::read(std::uint32_t can_id, EncoderSample& sample) const {
+    auto found = m_slots.find(can_id);
+    if (found == m_slots.end()) {
+        return false;
+    }
+    const Slot& slot = *found->second;
+    while (true) {
+        const std::uint32_t before = slot.sequence.load(std::memory_order_acquire);
+        if (before & 1) {
+            continue;
+        }
+        sample.angle = slot.angle.load(std::memory_order_relaxed);
+        sample.angular_velocity = slot.angular_velocity.load(std::memory_order_relaxed);
+        sample.revolutions = slot.revolutions.load(std::memory_order_relaxed);
+        sample.angle_time = clock::time_point(clock::duration(slot.angle_time.load(std::memory_order_relaxed)));
+        sample.temperature = slot.temperature.load(std::memory_order_relaxed);
+        sample.temperature_time = clock::time_point(clock::duration(slot.temperature_time.load(std::memory_order_relaxed)));
+        // Keeps the field loads above from moving after the second sequence load
+        std::atomic_thread_fence(std::memory_order_acquire);
+        if (slot.sequence.load(std::memory_order_relaxed) == before) {
+            return true;
+        }
+    }
+}
@@ -5,10 +5,10 @@
 using std::uint16_t;
 using std::uint32_t;
 
-void temperature_handler(uint32_t can_id, uint16_t temp) {
+void temperature_handler(uint32_t can_id, double temp) {
     BOOST_LOG_TRIVIAL(info) << "can_id: " << can_id << " temp: " << temp << "\n";
 };
-void angle_handler(uint32_t can_id, uint16_t angle, uint16_t angular_vel, uint16_t n_rotations) {
+void angle_handler(uint32_t can_id, double angle, double angular_vel, std::int16_t n_rotations) {
     BOOST_LOG_TRIVIAL(info) << "can_id: " << can_id <<" angle: " <<angle<<" velocity: " << angular_vel << " num rotations: " << n_rotations << "\n";
 };
 
@@ -22,14 +22,24 @@ int main(int argc, char** argv) {
         can_interface = argv[1];
     }
 
-    std::shared_ptr<const std::unordered_set<uint32_t>> encoder_can_ids = std::make_shared<const std::unordered_set<uint32_t>>(std::initializer_list<uint32_t>{}); 
+    // Grab the CAN IDs of the encoders from the remaining CLI arguments, e.g. "encoder_dump can0 0x50 0x51"
+    // (the format encoder_fleet.py prints discovered encoders in)
+    std::unordered_set<uint32_t> can_ids;
+    for (int i = 2; i < argc; ++i) {
+        can_ids.insert(static_cast<uint32_t>(std::stoul(argv[i], nullptr, 0)));
+    }
+    std::shared_ptr<const std::unordered_set<uint32_t>> encoder_can_ids = std::make_shared<const std::unordered_set<uint32_t>>(std::move(can_ids));
 
     //initial can interface 
     EncoderInterface myInterface(can_interface, encoder_can_ids);
 
     //set up signal handlers
-    myInterface.angle_signal.connect([](uint32_t can_id, uint16_t angle, uint16_t angular_vel, uint16_t n_rotations) { angle_handler(can_id, angle, angular_vel, n_rotations); });
-    myInterface.temp_signal.connect([](uint32_t can_id, uint16_t temp) { temperature_handler(can_id, temp); });
+    myInterface.angle_signal.connect([](uint32_t can_id, double angle, double angular_vel, std::int16_t n_rotations) { angle_handler(can_id, angle, angular_vel, n_rotations); });
+    myInterface.temp_signal.connect([](uint32_t can_id, double temp) { temperature_handler(can_id, temp); });
+
+    //log from a dispatch thread so a slow log sink cannot hold up socket reads
+    myInterface.enable_decoupled_dispatch(4096);
+    myInterface.start_dispatch_thread();
 
     //start recieving CAN messages
     myInterface.begin_read_loop();
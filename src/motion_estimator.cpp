@@ -0,0 +1,38 @@
+#include "motion_estimator.hpp"
+
+AlphaBetaGammaFilter::AlphaBetaGammaFilter(double alpha, double beta, double gamma, double max_gap)
+    : m_alpha(alpha), m_beta(beta), m_gamma(gamma), m_max_gap(max_gap) {}
+
+void AlphaBetaGammaFilter::update(double measurement, double time) {
+    const double dt = time - m_time;
+    if (m_initialized && dt == 0) {
+        // Two measurements stamped with the same time say nothing about velocity
+        return;
+    }
+    // Start over on the first measurement, after a gap, or if the clock went backwards
+    if (!m_initialized || dt < 0 || dt > m_max_gap) {
+        m_initialized = true;
+        m_time = time;
+        m_position = measurement;
+        m_velocity = 0;
+        m_acceleration = 0;
+        return;
+    }
+
+    const double predicted_position = m_position + m_velocity * dt + 0.5 * m_acceleration * dt * dt;
+    const double predicted_velocity = m_velocity + m_acceleration * dt;
+    const double residual = measurement - predicted_position;
+
+    m_position = predicted_position + m_alpha * residual;
+    m_velocity = predicted_velocity + m_beta * residual / dt;
+    m_acceleration = m_acceleration + 2 * m_gamma * residual / (dt * dt);
+    m_time = time;
+}
+
+void AlphaBetaGammaFilter::reset() {
+    m_initialized = false;
+    m_time = 0;
+    m_position = 0;
+    m_velocity = 0;
+    m_acceleration = 0;
+}
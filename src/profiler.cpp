@@ -0,0 +1,56 @@
+#include "profiler.hpp"
+#include <iterator>
+
+namespace {
+    constexpr const char* PROBE_NAMES[] = {
+        "receive",
+        "filter",
+        "update_latest",
+        "decode_angle",
+        "unwrap_position",
+        "estimate_motion",
+        "decode_temp",
+        "emit_angle_signal",
+        "emit_angle_signal_raw",
+        "emit_position_signal",
+        "emit_motion_signal",
+        "emit_temp_signal",
+        "emit_temp_signal_raw",
+        "emit_verbose_signal",
+        "emit_sample_sink",
+        "emit_batch_signal",
+    };
+    static_assert(std::size(PROBE_NAMES) == static_cast<std::size_t>(Probe::count), "every probe needs a name");
+}
+
+void Profiler::record(Probe probe, clock::duration elapsed) {
+    Counters& counters = m_counters[static_cast<std::size_t>(probe)];
+    const auto elapsed_ns = static_cast<std::uint64_t>(std::chrono::duration_cast<std::chrono::nanoseconds>(elapsed).count());
+    counters.calls.store(counters.calls.load(std::memory_order_relaxed) + 1, std::memory_order_relaxed);
+    counters.total_ns.store(counters.total_ns.load(std::memory_order_relaxed) + elapsed_ns, std::memory_order_relaxed);
+    if (elapsed_ns > counters.max_ns.load(std::memory_order_relaxed)) {
+        counters.max_ns.store(elapsed_ns, std::memory_order_relaxed);
+    }
+}
+
+std::vector<ProbeStats> Profiler::report() const {
+    std::vector<ProbeStats> stats;
+    stats.reserve(m_counters.size());
+    for (std::size_t i = 0; i < m_counters.size(); ++i) {
+        ProbeStats probe;
+        probe.name = PROBE_NAMES[i];
+        probe.calls = m_counters[i].calls.load(std::memory_order_relaxed);
+        probe.total_ns = m_counters[i].total_ns.load(std::memory_order_relaxed);
+        probe.max_ns = m_counters[i].max_ns.load(std::memory_order_relaxed);
+        stats.push_back(probe);
+    }
+    return stats;
+}
+
+void Profiler::reset() {
+    for (Counters& counters : m_counters) {
+        counters.calls.store(0, std::memory_order_relaxed);
+        counters.total_ns.store(0, std::memory_order_relaxed);
+        counters.max_ns.store(0, std::memory_order_relaxed);
+    }
+}
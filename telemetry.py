@@ -0,0 +1,331 @@
+"""
+Vectorized decoding of the frames the encoders stream (0x55 0x55 angle frames and 0x55 0x56 temperature frames),
+for when there are too many of them to decode one at a time like dump_info.py does
+"""
+
+import math
+import threading
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+import can
+
+from get_register import REGISTER_FORMATS, Register, send_read_and_wait
+
+# The first two bytes of each kind of streamed frame, read big-endian
+ANGLE_HEADER = 0x5555
+TEMPERATURE_HEADER = 0x5556
+
+# One 8-byte payload, with every field the two kinds of frame can hold:
+#   55 55 aa bb cc dd ee ff -> angle = 0xbbaa, angular velocity = 0xddcc, revolutions = 0xffee
+#   55 56 aa bb 00 00 00 00 -> temperature = 0xbbaa
+# The angle and temperature fields overlap, which one is meaningful depends on the header.
+TELEMETRY_FRAME = np.dtype({
+    'names': ['header', 'angle', 'temperature', 'angular_vel', 'revolutions'],
+    'formats': ['>u2', '<u2', '<i2', '<i2', '<i2'],
+    'offsets': [0, 2, 2, 4, 6],
+    'itemsize': 8,
+})
+
+# Decoded samples, index is the position of the frame in the input so samples can be matched with timestamps or
+# CAN IDs kept alongside the payloads
+ANGLE_SAMPLE = np.dtype([
+    ('index', '<i8'),
+    ('angle', '<f8'),  # °
+    ('angular_vel', '<f8'),  # °/s
+    ('revolutions', '<i2'),
+])
+TEMPERATURE_SAMPLE = np.dtype([
+    ('index', '<i8'),
+    ('temperature', '<f8'),  # °C
+])
+
+
+# Views a contiguous buffer of 8-byte payloads (bytes, bytearray, memoryview, mmap...) as TELEMETRY_FRAME records,
+# without copying
+def as_frames(payloads):
+    if isinstance(payloads, np.ndarray) and payloads.dtype == TELEMETRY_FRAME:
+        return payloads
+    return np.frombuffer(payloads, dtype=TELEMETRY_FRAME)
+
+
+# Packs the payloads of received can.Message objects into one buffer for decode_telemetry, skipping anything which
+# is not 8 bytes long
+def pack_payloads(msgs):
+    return b''.join(bytes(msg.data) for msg in msgs if len(msg.data) == 8)
+
+
+# Receives a batch of up to max_frames messages from bus, for handing to pack_payloads/decode_telemetry in one go.
+# Blocks up to timeout [s] (forever if None) for the first frame, then takes whatever else is already waiting and,
+# if max_wait [s] is non-zero, keeps waiting up to max_wait for the batch to fill. Returns an empty list on timeout.
+def recv_batch(bus, max_frames=64, max_wait=0.0, timeout=None):
+    msg = bus.recv(timeout)
+    if msg is None:
+        return []
+    batch = [msg]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < max_frames:
+        msg = bus.recv(max(0.0, deadline - time.monotonic()))
+        if msg is None:
+            break
+        batch.append(msg)
+    return batch
+
+
+# Decodes every angle and temperature frame in payloads in one pass, using the same formulas as dump_info.py:
+#   Angle [°] = ANGLE_REG * 360 / 32768
+#   Angular velocity [°/s] = ANGULAR_VEL_REG * 360 / 32768 / angular_vel_sample_time [s]
+#   Temperature [°C] = TEMPERATURE_REG / 100
+# Returns (ANGLE_SAMPLE array, TEMPERATURE_SAMPLE array), frames of any other kind are ignored
+def decode_telemetry(payloads, angular_vel_sample_time=0.1):
+    frames = as_frames(payloads)
+
+    angle_index = np.flatnonzero(frames['header'] == ANGLE_HEADER)
+    angle_frames = frames[angle_index]
+    angles = np.empty(len(angle_index), dtype=ANGLE_SAMPLE)
+    angles['index'] = angle_index
+    angles['angle'] = angle_frames['angle'] * REGISTER_FORMATS[Register.ANG_VAL].scale
+    angles['angular_vel'] = (angle_frames['angular_vel'] * REGISTER_FORMATS[Register.ANGULAR_VEL].scale
+                             / angular_vel_sample_time)
+    angles['revolutions'] = angle_frames['revolutions']
+
+    temperature_index = np.flatnonzero(frames['header'] == TEMPERATURE_HEADER)
+    temperatures = np.empty(len(temperature_index), dtype=TEMPERATURE_SAMPLE)
+    temperatures['index'] = temperature_index
+    temperatures['temperature'] = (frames['temperature'][temperature_index]
+                                   * REGISTER_FORMATS[Register.TEMPERATURE].scale)
+
+    return angles, temperatures
+
+
+# Continuous position [°] for the ANGLE_SAMPLE array of a single encoder (e.g. from decode_telemetry on
+# capture['payload'][capture['can_id'] == 0x50]): the angle plus every revolution turned since the first sample,
+# unwrapped across the angle and revolution counter rolling over the same way PositionStream does
+def unwrap_positions(angles):
+    counts = np.rint(angles['angle'] / REGISTER_FORMATS[Register.ANG_VAL].scale).astype(np.int64)
+    revolutions = angles['revolutions'].astype(np.int64)
+    positions = np.empty(len(angles), dtype=np.float64)
+    if len(angles) == 0:
+        return positions
+
+    revolutions_change = (np.diff(revolutions) + 0x8000) % 0x10000 - 0x8000
+    angle_change = np.diff(counts)
+    change = revolutions_change * 32768 + angle_change
+    single_turn = revolutions_change == 0
+    change[single_turn & (angle_change > 16384)] -= 32768
+    change[single_turn & (angle_change < -16384)] += 32768
+
+    positions[0] = revolutions[0] * 32768 + counts[0]
+    np.cumsum(change, out=positions[1:])
+    positions[1:] += positions[0]
+    return positions * REGISTER_FORMATS[Register.ANG_VAL].scale
+
+
+class PositionStream(can.Listener):
+    # Turns the angle frames of every encoder into a continuous position, calling
+    # callback(device_addr, degrees, radians, time) for each with time being time.monotonic() when it was received.
+    # Like LatestValueCache it can be a can.Notifier listener or a BusDispatcher subscriber.
+    #
+    # Position is the angle plus every revolution turned since the first frame. The revolution counter is a signed
+    # 16-bit register, so its change between frames is taken modulo 2^16. In single-turn mode it never changes, and a
+    # jump of more than half a turn in the angle is taken to be the angle wrapping around instead, which holds as long
+    # as the shaft turns less than half a revolution between frames.
+    def __init__(self, callback):
+        self.callback = callback
+        # Per device address, [last angle register, last revolutions, position in angle register counts], updated in
+        # place
+        self._state = {}
+
+    def on_message_received(self, msg):
+        data = msg.data
+        if len(data) == 8 and data[0] == 0x55 and data[1] == 0x55:
+            self.update(msg.arbitration_id, data[2] | data[3] << 8, int.from_bytes(data[6:8], 'little', signed=True))
+
+    # Feeds in one angle frame's registers, returning the position [°]
+    def update(self, device_addr, angle, revolutions, timestamp=None):
+        state = self._state.get(device_addr)
+        if state is None:
+            state = self._state[device_addr] = [angle, revolutions, revolutions * 32768 + angle]
+        else:
+            revolutions_change = (revolutions - state[1] + 0x8000) % 0x10000 - 0x8000
+            angle_change = angle - state[0]
+            change = revolutions_change * 32768 + angle_change
+            if revolutions_change == 0:
+                if angle_change > 16384:
+                    change -= 32768
+                elif angle_change < -16384:
+                    change += 32768
+            state[0] = angle
+            state[1] = revolutions
+            state[2] += change
+
+        degrees = state[2] * REGISTER_FORMATS[Register.ANG_VAL].scale
+        self.callback(device_addr, degrees, math.radians(degrees), time.monotonic() if timestamp is None else timestamp)
+        return degrees
+
+    # Forgets device_addr's position, or every encoder's if device_addr is None, so it restarts from the next frame
+    def reset(self, device_addr=None):
+        if device_addr is None:
+            self._state.clear()
+        else:
+            self._state.pop(device_addr, None)
+
+
+class AlphaBetaGammaFilter:
+    # Tracks position, velocity and acceleration from position measurements at irregular times, with constant work per
+    # measurement: predict from the last estimate, then correct by the residual scaled by alpha, beta and gamma.
+    # Unlike the encoder's ANGULAR_VEL register it works at any return rate, with no sample period to overflow.
+    #
+    # The default beta and gamma follow the usual steady-state relations for alpha = 0.2
+    # (beta = 2(2 - alpha) - 4 sqrt(1 - alpha), gamma = beta^2 / (2 alpha)), low enough that at 1-2 kHz the
+    # acceleration is not swamped by the angle register's quantisation. After more than max_gap [s] without a
+    # measurement, or if time goes backwards, the filter starts over.
+    def __init__(self, alpha=0.2, beta=0.022, gamma=0.0012, max_gap=0.5):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.max_gap = max_gap
+        self.reset()
+
+    def reset(self):
+        self.time = None
+        self.position = 0.0
+        self.velocity = 0.0
+        self.acceleration = 0.0
+
+    # Feeds in a position measured at time [s], returning (position, velocity, acceleration)
+    def update(self, measurement, time):
+        if self.time is not None:
+            dt = time - self.time
+            if dt == 0:
+                # Two measurements stamped with the same time say nothing about velocity
+                return self.position, self.velocity, self.acceleration
+        if self.time is None or dt < 0 or dt > self.max_gap:
+            self.time = time
+            self.position = measurement
+            self.velocity = 0.0
+            self.acceleration = 0.0
+            return self.position, self.velocity, self.acceleration
+
+        predicted_position = self.position + self.velocity * dt + 0.5 * self.acceleration * dt * dt
+        residual = measurement - predicted_position
+        self.position = predicted_position + self.alpha * residual
+        self.velocity = self.velocity + self.acceleration * dt + self.beta * residual / dt
+        self.acceleration = self.acceleration + 2 * self.gamma * residual / (dt * dt)
+        self.time = time
+        return self.position, self.velocity, self.acceleration
+
+
+class MotionEstimator:
+    # Per-encoder AlphaBetaGammaFilter, to be used as the callback of a PositionStream:
+    #   PositionStream(MotionEstimator(callback))
+    # calls callback(device_addr, position [°], velocity [°/s], acceleration [°/s²], time) for every angle frame
+    # The estimate is only as good as the times it is given: feeding PositionStream.update with msg.timestamp uses the
+    # interface's receive time rather than when the frame got through the notifier.
+    def __init__(self, callback, alpha=0.2, beta=0.022, gamma=0.0012):
+        self.callback = callback
+        self._filter_args = (alpha, beta, gamma)
+        self._filters = {}
+
+    def __call__(self, device_addr, degrees, radians, time):
+        estimator = self._filters.get(device_addr)
+        if estimator is None:
+            estimator = self._filters[device_addr] = AlphaBetaGammaFilter(*self._filter_args)
+        position, velocity, acceleration = estimator.update(degrees, time)
+        self.callback(device_addr, position, velocity, acceleration, time)
+
+
+class LatestSample(NamedTuple):
+    # The most recent values from one encoder, None until the first frame of that kind arrives.
+    # Times are time.monotonic() when the values were received.
+    angle: Optional[float] = None  # °
+    angular_vel: Optional[float] = None  # °/s
+    revolutions: Optional[int] = None
+    angle_time: Optional[float] = None
+    temperature: Optional[float] = None  # °C
+    temperature_time: Optional[float] = None
+
+    def angle_age(self, now=None):
+        if self.angle_time is None:
+            return float('inf')
+        return (time.monotonic() if now is None else now) - self.angle_time
+
+    def temperature_age(self, now=None):
+        if self.temperature_time is None:
+            return float('inf')
+        return (time.monotonic() if now is None else now) - self.temperature_time
+
+
+_NO_SAMPLE = LatestSample()
+
+
+class LatestValueCache(can.Listener):
+    # Keeps the latest streamed angle and temperature of every encoder, so a control loop can ask for the current angle
+    # of a joint without a register round trip. Like CaptureWriter it can be a can.Notifier listener or a BusDispatcher
+    # subscriber.
+    #
+    # Each update replaces an immutable LatestSample in one dict assignment, so readers never take a lock and never
+    # see half of an update. get_angle/get_temperature fall back to reading the registers only when the cached values
+    # are older than the caller allows.
+    def __init__(self, angular_vel_sample_time=0.1):
+        self.angular_vel_sample_time = angular_vel_sample_time
+        self._latest = {}
+        # Serialises the read-modify-write of updates, the notifier thread and a fallback read may both be updating
+        self._update_lock = threading.Lock()
+
+    def on_message_received(self, msg):
+        data = msg.data
+        if len(data) != 8 or data[0] != 0x55:
+            return
+        if data[1] == 0x55:
+            self._update_angle(msg.arbitration_id, int.from_bytes(data[2:4], 'little'),
+                               int.from_bytes(data[4:6], 'little', signed=True),
+                               int.from_bytes(data[6:8], 'little', signed=True))
+        elif data[1] == 0x56:
+            self._update_temperature(msg.arbitration_id, int.from_bytes(data[2:4], 'little', signed=True))
+
+    # The LatestSample for device_addr, without touching the bus
+    def latest(self, device_addr):
+        return self._latest.get(device_addr, _NO_SAMPLE)
+
+    # The LatestSample for device_addr, reading ANG_VAL (which the encoder answers along with REVOLUTIONS and
+    # ANGULAR_VEL) over bus first if the cached angle is older than max_age [s]. bus can be a BusDispatcher feeding
+    # this cache. If the read times out the stale sample is returned as is.
+    def get_angle(self, bus, device_addr, max_age, timeout=1):
+        sample = self.latest(device_addr)
+        if sample.angle_age() <= max_age:
+            return sample
+        msg = send_read_and_wait(bus, Register.ANG_VAL, timeout, device_addr=device_addr)
+        if msg is None:
+            return sample
+        self._update_angle(device_addr, int.from_bytes(msg.data[2:4], 'little'),
+                           int.from_bytes(msg.data[6:8], 'little', signed=True),
+                           int.from_bytes(msg.data[4:6], 'little', signed=True))
+        return self.latest(device_addr)
+
+    # Like get_angle, for the temperature
+    def get_temperature(self, bus, device_addr, max_age, timeout=1):
+        sample = self.latest(device_addr)
+        if sample.temperature_age() <= max_age:
+            return sample
+        msg = send_read_and_wait(bus, Register.TEMPERATURE, timeout, device_addr=device_addr)
+        if msg is None:
+            return sample
+        self._update_temperature(device_addr, int.from_bytes(msg.data[2:4], 'little', signed=True))
+        return self.latest(device_addr)
+
+    def _update_angle(self, device_addr, angle, angular_vel, revolutions):
+        now = time.monotonic()
+        with self._update_lock:
+            self._latest[device_addr] = self._latest.get(device_addr, _NO_SAMPLE)._replace(
+                angle=angle * REGISTER_FORMATS[Register.ANG_VAL].scale,
+                angular_vel=angular_vel * REGISTER_FORMATS[Register.ANGULAR_VEL].scale / self.angular_vel_sample_time,
+                revolutions=revolutions, angle_time=now)
+
+    def _update_temperature(self, device_addr, temperature):
+        now = time.monotonic()
+        with self._update_lock:
+            self._latest[device_addr] = self._latest.get(device_addr, _NO_SAMPLE)._replace(
+                temperature=temperature * REGISTER_FORMATS[Register.TEMPERATURE].scale, temperature_time=now)